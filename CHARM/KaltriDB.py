@@ -1,13 +1,229 @@
-from pymongo import MongoClient
-from datetime import datetime
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import date, datetime, timedelta
 from bson import ObjectId
 
-client = MongoClient('mongodb://localhost:27017/')
-db = client.hospital_inventory
-usage_collection = db['usage_logs']
+from charm.storage import lazy_collection, lazy_database
 
-def log_usage(hospital, medication, quantity_change, action, user):
-    """Logs any change to inventory (add, use, edit, delete)"""
+# Shared pooled client (charm.storage); nothing connects until first use
+db = lazy_database()
+usage_collection = lazy_collection('usage_logs')
+# Monthly totals per (hospital, month, medication), kept in step by log_usage
+rollup_collection = lazy_collection('usage_monthly')
+
+PAGE_SIZE = 50
+
+# Fields the list views actually render (_id is always returned)
+INVENTORY_FIELDS = {"name": 1, "quantity": 1, "cost": 1, "date_added": 1, "expiry_date": 1}
+USAGE_LOG_FIELDS = {"medication": 1, "quantity_change": 1, "action": 1, "user": 1, "date": 1}
+
+LOW_STOCK_THRESHOLD = 100  # units
+EXPIRY_WINDOW_DAYS = 90
+
+# Usage logs are written behind: batched into insert_many on size or time.
+# CHARM_USAGE_LOG_SYNC=1 makes every log_usage wait for the write ack.
+USAGE_LOG_BATCH_SIZE = 500
+USAGE_LOG_FLUSH_SECONDS = 1.0
+USAGE_LOG_SYNC = os.environ.get("CHARM_USAGE_LOG_SYNC") == "1"
+
+logger = logging.getLogger(__name__)
+
+PURCHASE_ACTIONS = ["added", "restock"]
+USAGE_ACTIONS = ["usage", "removed"]
+
+_indexed_inventories = set()
+
+def inventory_collection(hospital):
+    """The inventory_<h> collection of *hospital*, with its indexes in place."""
+    collection = db[f"inventory_{hospital.lower()}"]
+    if collection.name not in _indexed_inventories:
+        ensure_inventory_indexes(collection)
+    return collection
+
+def ensure_inventory_indexes(collection):
+    """Index an inventory collection for the dashboard's range counts."""
+    collection.create_index([("expiry_date", ASCENDING)], name="expiry_date")
+    collection.create_index([("quantity", ASCENDING)], name="quantity")
+    _indexed_inventories.add(collection.name)
+
+def ensure_indexes():
+    """Create the indexes the listing queries rely on (idempotent)."""
+    for name in db.list_collection_names(filter={"name": {"$regex": "^inventory_"}}):
+        ensure_inventory_indexes(db[name])
+    # Newest-first log pages per hospital, with _id breaking ties on equal dates
+    usage_collection.create_index(
+        [("hospital", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+        name="hospital_date",
+    )
+    rollup_collection.create_index(
+        [("hospital", ASCENDING), ("month", ASCENDING), ("medication", ASCENDING)],
+        name="hospital_month_medication",
+        unique=True,
+    )
+    rollup_collection.create_index([("month", ASCENDING)], name="month")
+
+class UsageLogBuffer:
+    """Write-behind buffer that groups log entries into insert_many batches.
+
+    Entries are flushed when *max_batch* are pending, every *flush_interval*
+    seconds by a background thread (None: only on demand), and on
+    ``close()``. Each flushed batch also updates *rollups* (if given) with
+    one bulk $inc per (hospital, month, medication). A failed batch is kept
+    and retried; entries the server already stored come back as duplicate
+    _id errors and count as written.
+
+    Rollup deltas of stored entries are kept until their $inc is
+    acknowledged and retried on the next flush. When a rollup write fails
+    without saying which updates applied, the retry may count them twice;
+    those (hospital, month) pairs are added to ``dirty_rollups`` and logged
+    so ``backfill_rollups.py`` can rebuild them.
+    """
+
+    def __init__(self, collection, rollups=None, max_batch=USAGE_LOG_BATCH_SIZE,
+                 flush_interval=USAGE_LOG_FLUSH_SECONDS):
+        self.collection = collection
+        self.rollups = rollups
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._rollup_backlog = {}  # (hospital, month, medication) -> $inc
+        self.dirty_rollups = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def add(self, entry, wait=False):
+        """Queue *entry*; with *wait*, flush now and return once it is acknowledged."""
+        with self._lock:
+            self._pending.append(entry)
+            full = len(self._pending) >= self.max_batch
+        if wait:
+            self.flush()
+        elif self.flush_interval is None:
+            if full:
+                self.flush()
+        else:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+
+    def flush(self):
+        """Write every pending entry; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            written = []
+            if batch:
+                try:
+                    written = self._insert(batch)
+                except Exception:
+                    with self._lock:
+                        self._pending[:0] = batch
+                    raise
+            if self.rollups is not None:
+                _merge_rollup_totals(self._rollup_backlog, written)
+                self._write_rollups()
+            return len(written)
+
+    def _write_rollups(self):
+        if not self._rollup_backlog:
+            return
+        keys = list(self._rollup_backlog)
+        try:
+            self.rollups.bulk_write(_rollup_updates(self._rollup_backlog), ordered=False)
+        except BulkWriteError as e:
+            failed = {keys[err["index"]] for err in e.details["writeErrors"]}
+            self._rollup_backlog = {k: self._rollup_backlog[k] for k in keys if k in failed}
+            logger.warning("Retrying %d usage rollup updates after write errors", len(failed))
+        except Exception:
+            # Unknown which updates applied: retry all, flag them for a rebuild
+            dirty = {(h, m) for h, m, _ in keys}
+            self.dirty_rollups |= dirty
+            logger.exception(
+                "Usage rollup update failed; retrying on next flush. Rollups may be off for %s "
+                "until backfill_rollups.py is run", sorted(dirty))
+        else:
+            self._rollup_backlog = {}
+
+    def close(self):
+        """Stop the background thread and flush what is left."""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def _insert(self, batch):
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            return batch
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details["writeErrors"] if err["code"] != 11000}
+            if failed:
+                with self._lock:
+                    self._pending[:0] = [batch[i] for i in sorted(failed)]
+                logger.warning("Requeued %d usage log entries after write errors", len(failed))
+            return [entry for i, entry in enumerate(batch) if i not in failed]
+
+    def _ensure_thread(self):
+        # A thread started before fork does not exist in the child.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="usage-log-writer",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Usage log flush failed; will retry")
+
+_usage_buffer = UsageLogBuffer(usage_collection, rollups=rollup_collection)
+atexit.register(_usage_buffer.close)
+
+@contextmanager
+def buffered_usage_log(collection=None, rollups=None, max_batch=1000):
+    """Batch the usage-log writes of a bulk job; flushes and waits for the ack on exit.
+
+    Without *collection*, yields the shared log_usage buffer. Otherwise
+    yields a buffer for *collection* (with optional *rollups*) that only
+    writes when *max_batch* entries are pending and on exit.
+    """
+    if collection is None:
+        try:
+            yield _usage_buffer
+        finally:
+            _usage_buffer.flush()
+        return
+    buffer = UsageLogBuffer(collection, rollups=rollups, max_batch=max_batch,
+                            flush_interval=None)
+    try:
+        yield buffer
+    finally:
+        buffer.close()
+
+def log_usage(hospital, medication, quantity_change, action, user, wait=None):
+    """Logs any change to inventory (add, use, edit, delete)
+
+    The entry is written behind in a batch; pass ``wait=True`` (or set
+    CHARM_USAGE_LOG_SYNC=1) to return only once it is stored.
+    """
     log_entry = {
         "hospital": hospital,
         "medication": medication,
@@ -16,49 +232,214 @@ def log_usage(hospital, medication, quantity_change, action, user):
         "user": user,
         "date": datetime.now()
     }
-    usage_collection.insert_one(log_entry)
+    _usage_buffer.add(log_entry, wait=USAGE_LOG_SYNC if wait is None else wait)
+
+def _rollup_increments(action, quantity_change):
+    if action in PURCHASE_ACTIONS:
+        return {"purchased": quantity_change, "entries": 1}
+    if action in USAGE_ACTIONS:
+        return {"used": abs(quantity_change), "entries": 1}
+    return {"entries": 1}
+
+def _merge_rollup_totals(totals, entries):
+    """Add the $inc deltas of *entries* to *totals*, keyed by (hospital, month, medication)."""
+    for entry in entries:
+        key = (entry["hospital"], entry["date"].strftime("%Y-%m"), entry["medication"])
+        inc = totals.setdefault(key, defaultdict(int))
+        for field, amount in _rollup_increments(entry["action"], entry["quantity_change"]).items():
+            inc[field] += amount
+    return totals
+
+def _rollup_updates(totals):
+    """One $inc upsert per (hospital, month, medication) in *totals*."""
+    return [
+        UpdateOne({"hospital": h, "month": m, "medication": med}, {"$inc": dict(inc)}, upsert=True)
+        for (h, m, med), inc in totals.items()
+    ]
+
+def rebuild_rollups(hospital=None):
+    """Recompute monthly rollups from the full usage log (backfill/repair).
+
+    Returns the number of rollup documents written.
+    """
+    scope = {"hospital": hospital} if hospital else {}
+    rollup_collection.delete_many(scope)
+    usage_collection.aggregate([
+        {"$match": {**scope, "date": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "hospital": "$hospital",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "medication": "$medication",
+            },
+            "purchased": {"$sum": {"$cond": [
+                {"$in": ["$action", PURCHASE_ACTIONS]}, "$quantity_change", 0]}},
+            "used": {"$sum": {"$cond": [
+                {"$in": ["$action", USAGE_ACTIONS]}, {"$abs": "$quantity_change"}, 0]}},
+            "entries": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "hospital": "$_id.hospital",
+            "month": "$_id.month",
+            "medication": "$_id.medication",
+            "purchased": 1,
+            "used": 1,
+            "entries": 1,
+        }},
+        {"$merge": {
+            "into": rollup_collection.name,
+            "on": ["hospital", "month", "medication"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ])
+    return rollup_collection.count_documents(scope)
+
+def get_rollup_months():
+    """Months (YYYY-MM) with any logged activity, newest first."""
+    return sorted(rollup_collection.distinct("month"), reverse=True)
+
+def get_monthly_totals(month, hospital=None):
+    """Per-medication purchase and usage totals for *month*, most used first."""
+    match = {"month": month}
+    if hospital:
+        match["hospital"] = hospital
+    return list(rollup_collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": "$medication",
+            "purchased": {"$sum": "$purchased"},
+            "used": {"$sum": "$used"},
+        }},
+        {"$sort": {"used": -1}},
+    ]))
+
+def to_datetime(value):
+    """Coerce a "YYYY-MM-DD" string or date into a datetime (stored as a BSON date)."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.strptime(value, "%Y-%m-%d")
 
 def add_item(hospital, name, quantity, cost, date_added, expiry_date, user="System"):
-    collection = db[f"inventory_{hospital.lower()}"]
+    collection = inventory_collection(hospital)
     item = {
         "name": name,
         "quantity": quantity,
         "cost": cost,
-        "date_added": date_added,
-        "expiry_date": expiry_date
+        "date_added": to_datetime(date_added),
+        "expiry_date": to_datetime(expiry_date)
     }
     collection.insert_one(item)
     log_usage(hospital, name, quantity, "added", user)
 
-def get_inventory(hospital):
-    collection = db[f"inventory_{hospital.lower()}"]
-    return list(collection.find({}))
+def get_inventory(hospital, limit=None, after=None):
+    """Inventory items in insertion (_id) order.
+
+    With *limit*, returns at most that many items following the item whose
+    _id is *after* (keyset pagination: pass the last _id of a page to get
+    the next one).
+    """
+    collection = inventory_collection(hospital)
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    cursor = collection.find(query, INVENTORY_FIELDS).sort("_id", ASCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
 
 def update_quantity(hospital, item_id, new_quantity, user):
-    collection = db[f"inventory_{hospital.lower()}"]
-    item = collection.find_one({"_id": ObjectId(item_id)})
-    
-    if item:
-        old_quantity = item['quantity']
-        diff = new_quantity - old_quantity
-        
-        if diff != 0:
-            collection.update_one({"_id": ObjectId(item_id)}, {"$set": {"quantity": new_quantity}})
-            action = "restock" if diff > 0 else "usage"
-            log_usage(hospital, item['name'], diff, action, user)
-            return True
-    return False
+    """Set an item's quantity; logs the change against the value it replaced.
+
+    One atomic find_one_and_update: the pre-image comes back from the same
+    write, so concurrent edits each log their own exact diff.
+    """
+    collection = inventory_collection(hospital)
+    item = collection.find_one_and_update(
+        {"_id": ObjectId(item_id), "quantity": {"$ne": new_quantity}},
+        {"$set": {"quantity": new_quantity}},
+        projection={"name": 1, "quantity": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if item is None:  # missing, or already at new_quantity
+        return False
+    diff = new_quantity - item['quantity']
+    action = "restock" if diff > 0 else "usage"
+    log_usage(hospital, item['name'], diff, action, user)
+    return True
+
+def consume(hospital, item_id, n, user):
+    """Take *n* units out of stock in one round trip.
+
+    Returns the remaining quantity, or None if the item does not exist or
+    holds fewer than *n* units (stock never goes negative).
+    """
+    if n <= 0:
+        raise ValueError(f"n must be positive, got {n}")
+    collection = inventory_collection(hospital)
+    item = collection.find_one_and_update(
+        {"_id": ObjectId(item_id), "quantity": {"$gte": n}},
+        {"$inc": {"quantity": -n}},
+        projection={"name": 1, "quantity": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if item is None:
+        return None
+    log_usage(hospital, item['name'], -n, "usage", user)
+    return item['quantity']
 
 def delete_item(hospital, item_id, user):
-    collection = db[f"inventory_{hospital.lower()}"]
-    item = collection.find_one({"_id": ObjectId(item_id)})
-    
-    if item:
-        collection.delete_one({"_id": ObjectId(item_id)})
-        log_usage(hospital, item['name'], -item['quantity'], "removed", user)
-        return True
-    return False
-
-def get_usage_logs(hospital):
-    """Get usage logs for a specific hospital"""
-    return list(usage_collection.find({"hospital": hospital}).sort("date", -1))
+    collection = inventory_collection(hospital)
+    item = collection.find_one_and_delete(
+        {"_id": ObjectId(item_id)}, projection={"name": 1, "quantity": 1}
+    )
+    if item is None:
+        return False
+    log_usage(hospital, item['name'], -item['quantity'], "removed", user)
+    return True
+
+def usage_log_cursor(entry):
+    """Opaque page cursor for a usage log entry: its date and _id."""
+    return f"{entry['date'].isoformat()}_{entry['_id']}"
+
+def parse_usage_log_cursor(cursor):
+    """(date, _id) of a ``usage_log_cursor``; ValueError if it is malformed."""
+    date_str, sep, last_id = cursor.rpartition("_")
+    if not sep or not ObjectId.is_valid(last_id):
+        raise ValueError(f"Malformed usage log cursor: {cursor!r}")
+    return datetime.fromisoformat(date_str), ObjectId(last_id)
+
+def count_inventory_alerts(hospital, now=None):
+    """Items expiring within EXPIRY_WINDOW_DAYS and items below LOW_STOCK_THRESHOLD.
+
+    Two index-only counts (expiry_date and quantity indexes), so the cost
+    does not grow with the size of the inventory.
+    """
+    collection = inventory_collection(hospital)
+    cutoff = (now or datetime.now()) + timedelta(days=EXPIRY_WINDOW_DAYS)
+    expiring = collection.count_documents({"expiry_date": {"$lte": cutoff}})
+    low_stock = collection.count_documents({"quantity": {"$lt": LOW_STOCK_THRESHOLD}})
+    return expiring, low_stock
+
+def get_usage_logs(hospital, limit=None, before=None):
+    """Get usage logs for a specific hospital, newest first.
+
+    With *limit*, returns at most that many entries older than the
+    *before* cursor (see ``usage_log_cursor``). Served by the
+    (hospital, date, _id) index, so a page costs the same however long the
+    log grows.
+    """
+    query = {"hospital": hospital}
+    if before:
+        last_date, last_id = parse_usage_log_cursor(before)
+        query["$or"] = [
+            {"date": {"$lt": last_date}},
+            {"date": last_date, "_id": {"$lt": last_id}},
+        ]
+    cursor = usage_collection.find(query, USAGE_LOG_FIELDS).sort(
+        [("date", DESCENDING), ("_id", DESCENDING)]
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
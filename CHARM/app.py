@@ -1,20 +1,46 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from KaltriDB import add_item, get_inventory, update_quantity, delete_item, get_usage_logs
-from datetime import datetime, timedelta
+from KaltriDB import (add_item, get_inventory, update_quantity, consume, delete_item, get_usage_logs,
+                      ensure_indexes, usage_log_cursor, parse_usage_log_cursor, get_rollup_months, get_monthly_totals,
+                      count_inventory_alerts, buffered_usage_log, PAGE_SIZE)
+from datetime import datetime
 import re
-from pymongo import MongoClient
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from charm.storage import lazy_collection, lazy_database
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 
-# MongoDB setup
-client = MongoClient('mongodb://localhost:27017/')
-db = client['hospital_inventory']
-requests_collection = db['requests']
-users_collection = db['users']
+# MongoDB setup — shared pooled client, created lazily per worker process
+db = lazy_database()
+requests_collection = lazy_collection('requests')
+users_collection = lazy_collection('users')
+
+# Indexes are created once per process, before its first request, so they
+# exist under any WSGI server and not only when run as __main__.
+_database_ready = False
+_database_lock = threading.Lock()
+
+
+def prepare_database():
+    """Create the indexes the app's queries rely on and id legacy offers (idempotent)."""
+    ensure_indexes()
+    ensure_request_indexes()
+    backfill_offer_ids()
+
+
+@app.before_request
+def ensure_database_ready():
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_lock:
+        if not _database_ready:
+            prepare_database()  # on failure, retried by the next request
+            _database_ready = True
 
 
 # --- Seed default users on startup ---
@@ -77,8 +103,10 @@ def seed_real_data():
         ("Vitamin C injection", 150, 1.20, "2025-01-05", "2027-01-05")
     ]
 
-    for p in purchases:
-        add_item("A", p[0], p[1], p[2], p[3], p[4], user="System Import")
+    # Log entries go out in batches; the block exits once they are stored
+    with buffered_usage_log():
+        for p in purchases:
+            add_item("A", p[0], p[1], p[2], p[3], p[4], user="System Import")
 
     # 2. Usage Data (Simulated exact dates in Jan)
     # Using the negative values from the provided image
@@ -95,15 +123,14 @@ def seed_real_data():
         # Let's cap usage at purchase quantity - 1 so we have some stock left for demo.)
     ]
 
-    for u in usage_entries:
-        # Get current item to find its ID
-        item = db['inventory_a'].find_one({"name": u[0]})
-        if item:
-            qty_to_use = min(u[1], item['quantity'] - 1) # Keep at least 1 in stock
-            if qty_to_use > 0:
-                # Calculate new quantity
-                new_qty = item['quantity'] - qty_to_use
-                update_quantity("A", item['_id'], new_qty, "System Import (Usage)")
+    with buffered_usage_log():
+        for u in usage_entries:
+            # Get current item to find its ID
+            item = db['inventory_a'].find_one({"name": u[0]})
+            if item:
+                qty_to_use = min(u[1], item['quantity'] - 1) # Keep at least 1 in stock
+                if qty_to_use > 0:
+                    consume("A", item['_id'], qty_to_use, "System Import (Usage)")
 
     print("✅ Real data seeded.")
 
@@ -134,6 +161,12 @@ def role_required(role):
     return decorator
 
 
+@app.template_filter('ymd')
+def format_ymd(value):
+    """Render a stored date as YYYY-MM-DD (legacy string dates pass through)."""
+    return value.strftime('%Y-%m-%d') if isinstance(value, datetime) else value
+
+
 def parse_date(date_str):
     date_str = re.sub(r'\D', '', date_str)
     match = re.search(r'(\d{4})(\d{2})(\d{2})', date_str)
@@ -144,6 +177,12 @@ def parse_date(date_str):
         return None
 
 
+def parse_quantity(quantity_str):
+    """Whole, non-negative unit count from a form field, or None."""
+    quantity_str = quantity_str.strip()
+    return int(quantity_str) if quantity_str.isdigit() else None
+
+
 # --- Auth routes ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -211,12 +250,30 @@ def list_items():
     else:
         hospital = request.args.get('hospital', '').strip().upper()
 
-    inventory = get_inventory(hospital) if hospital else []
-    usage_logs = get_usage_logs(hospital) if hospital else []
-    
-    if not inventory and hospital:
+    inv_after = request.args.get('inv_after') or None
+    log_before = request.args.get('log_before') or None
+    # A malformed cursor (hand-edited or stale link) falls back to the first page
+    if inv_after and not ObjectId.is_valid(inv_after):
+        inv_after = None
+    if log_before:
+        try:
+            parse_usage_log_cursor(log_before)
+        except ValueError:
+            log_before = None
+
+    # Fetch one extra row per page to know whether a next page exists
+    inventory = get_inventory(hospital, limit=PAGE_SIZE + 1, after=inv_after) if hospital else []
+    usage_logs = get_usage_logs(hospital, limit=PAGE_SIZE + 1, before=log_before) if hospital else []
+
+    next_inv = str(inventory[PAGE_SIZE - 1]['_id']) if len(inventory) > PAGE_SIZE else None
+    next_log = usage_log_cursor(usage_logs[PAGE_SIZE - 1]) if len(usage_logs) > PAGE_SIZE else None
+    inventory, usage_logs = inventory[:PAGE_SIZE], usage_logs[:PAGE_SIZE]
+
+    if not inventory and hospital and not inv_after:
         flash("No items found for this hospital.", "error")
-    return render_template('list.html', inventory=inventory, usage_logs=usage_logs, hospital=hospital)
+    return render_template('list.html', inventory=inventory, usage_logs=usage_logs, hospital=hospital,
+                           inv_after=inv_after, log_before=log_before,
+                           next_inv=next_inv, next_log=next_log)
 
 
 @app.route('/update_item/<item_id>', methods=['POST'])
@@ -227,10 +284,12 @@ def update_item_route(item_id):
         return redirect(url_for('index'))
         
     hospital = session.get('hospital')
-    new_quantity = int(request.form['quantity'])
+    new_quantity = parse_quantity(request.form.get('quantity', ''))
     user = session.get('display_name')
-    
-    if update_quantity(hospital, item_id, new_quantity, user):
+
+    if new_quantity is None:
+        flash("Quantity must be a whole number of units.", "error")
+    elif update_quantity(hospital, item_id, new_quantity, user):
         flash("Item quantity updated.", "success")
     else:
         flash("Failed to update item.", "error")
@@ -238,6 +297,27 @@ def update_item_route(item_id):
     return redirect(url_for('list_items'))
 
 
+@app.route('/consume_item/<item_id>', methods=['POST'])
+@login_required
+def consume_item_route(item_id):
+    if session.get('role') != 'hospital_admin':
+        flash("Unauthorized", "error")
+        return redirect(url_for('index'))
+
+    hospital = session.get('hospital')
+    units = parse_quantity(request.form.get('units', ''))
+    user = session.get('display_name')
+
+    if not units:
+        flash("Units used must be a whole number above zero.", "error")
+    elif consume(hospital, item_id, units, user) is not None:
+        flash(f"Logged use of {units} units.", "success")
+    else:
+        flash("Not enough stock to use that many units.", "error")
+
+    return redirect(url_for('list_items'))
+
+
 @app.route('/delete_item/<item_id>', methods=['POST'])
 @login_required
 def delete_item_route(item_id):
@@ -260,109 +340,31 @@ def delete_item_route(item_id):
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    usage_collection = db['usage_logs']
-    
-    # Get available months for filter dropdown
-    # Format: YYYY-MM
-    pipeline_months = [
-        {
-            '$project': {
-                'month_str': {'$dateToString': {'format': '%Y-%m', 'date': '$date'}}
-            }
-        },
-        {'$group': {'_id': '$month_str'}},
-        {'$sort': {'_id': -1}}
-    ]
-    available_months_docs = list(usage_collection.aggregate(pipeline_months))
-    available_months = [d['_id'] for d in available_months_docs]
-    
+    # Monthly figures come from the usage_monthly rollups (one document per
+    # hospital × month × medication) kept current by KaltriDB.log_usage.
+    available_months = get_rollup_months()
+
     # Current month default
     current_month_str = datetime.now().strftime('%Y-%m')
     selected_month = request.args.get('month', current_month_str)
-    
+
+    totals = get_monthly_totals(selected_month)
+
     # 1. Total Usage per Medication (Filtered by Month)
-    pipeline_usage = [
-        {
-            '$addFields': {
-                'month_str': {'$dateToString': {'format': '%Y-%m', 'date': '$date'}}
-            }
-        },
-        {'$match': {'type': {'$ne': 'purchase'}, 'month_str': selected_month}}, 
-        # Note: 'type' might be 'usage' or 'removed'. We want consumption.
-        # Let's assume 'action' field usage: 'usage', 'removed', 'restock', 'added'.
-        # Previously we had 'type'. Now we have 'action'.
-        # Let's adjust for the new schema: 'action' in ['usage', 'removed'] count as usage.
-        # But wait, old data had 'type'. New data has 'action'.
-        # I need to handle both or migrate.
-        # Since I reset the DB, we have only New Data with 'action'.
-        # Actions: 'added', 'restock', 'usage', 'removed'.
-        # We want to show USAGE (consumption).
-        # So action='usage' or 'removed'? Probably 'usage'. 'removed' is waste/adjustment.
-        # Let's include both as "Outflow" for now, or just 'usage' if strict.
-        # User asked for "usage". Let's stick to action='usage' or 'removed' (as depletion).
-        
-        {'$match': {'action': {'$in': ['usage', 'removed']}}},
-        {'$group': {'_id': '$medication', 'total_usage': {'$sum': {'$abs': '$quantity_change'}}}},
-        {'$sort': {'total_usage': -1}}
-    ]
-    usage_data = list(usage_collection.aggregate(pipeline_usage))
-    
+    # 'usage' and 'removed' actions both count as depletion.
+    usage_data = [{'_id': t['_id'], 'total_usage': t['used']} for t in totals if t['used'] > 0]
+
     # 2. Balance (Restock vs Usage)
-    pipeline_balance = [
-        {
-            '$addFields': {
-                'month_str': {'$dateToString': {'format': '%Y-%m', 'date': '$date'}}
-            }
-        },
-        {'$match': {'month_str': selected_month}},
-        {'$group': {
-            '_id': '$medication',
-            'purchased': {
-                '$sum': {'$cond': [{'$in': ['$action', ['added', 'restock']]}, '$quantity_change', 0]}
-            },
-            'used': {
-                '$sum': {'$cond': [{'$in': ['$action', ['usage', 'removed']]}, {'$abs': '$quantity_change'}, 0]}
-            }
-        }}
-    ]
-    balance_data = list(usage_collection.aggregate(pipeline_balance))
+    balance_data = [{'_id': t['_id'], 'purchased': t['purchased'], 'used': t['used']} for t in totals]
 
     # 3. Key Metrics (Snapshot of current inventory, not monthly)
-    # Expiring Soon (within 90 days)
-    today = datetime.now()
-    ninety_days = today + timedelta(days=90)
-    # Since dates are stored as strings "YYYY-MM-DD" in my add_item... wait.
-    # KaltriDB.add_item stores date_added and expiry_date as passed.
-    # My parse_date returns "YYYY-MM-DD".
-    # String comparison works for ISO dates.
+    # Expiring within 90 days and low stock (< 100 units), for the
+    # logged-in hospital; both are indexed counts.
     expiring_count = 0
     low_stock_count = 0
-    
-    # We need to iterate all hospitals or just the logged in one?
-    # Dashboard implies global or specific? 
-    # The previous dashboard code didn't filter by hospital for metrics, but usage logs sort of did?
-    # Actually usage logs were global in the previous code?
-    # `usage_collection = db['usage_logs']`
-    # `list(usage_collection.aggregate(...))` matches ALL.
-    # The user is likely a "Hospital Admin" (e.g. A).
-    # Metrics should probably be for THEIR hospital if they are admin.
-    
     hospital_filter = session.get('hospital')
     if hospital_filter:
-         # Filter usage logs by hospital as well for more accuracy
-         # Inject match stage at start of pipelines?
-         # For simplicity, I'll keep usage global (or per hospital if I add match).
-         # Let's filter metrics by hospital at least.
-         inventory_col = db[f"inventory_{hospital_filter.lower()}"]
-         all_items = list(inventory_col.find({}))
-         
-         ninety_days_str = ninety_days.strftime('%Y-%m-%d')
-         
-         for item in all_items:
-             if item.get('expiry_date') and item['expiry_date'] <= ninety_days_str:
-                 expiring_count += 1
-             if item.get('quantity', 0) < 100: # Threshold for Low Stock
-                 low_stock_count += 1
+        expiring_count, low_stock_count = count_inventory_alerts(hospital_filter)
 
     return render_template('dashboard.html', 
                          usage_data=usage_data,
@@ -420,6 +422,7 @@ def make_offer(request_id):
     offering_hospital = session.get('hospital') or 'Distributor'
 
     offer = {
+        'offer_id': ObjectId(),
         'offering_hospital': offering_hospital,
         'offer_price': price,
         'offer_time': datetime.now(),
@@ -446,55 +449,64 @@ def my_requests():
     return render_template('my_requests.html', requests=my_reqs)
 
 
-@app.route('/accept_offer/<request_id>/<int:offer_index>', methods=['POST'])
+@app.route('/accept_offer/<request_id>/<offer_id>', methods=['POST'])
 @role_required('hospital_admin')
-def accept_offer(request_id, offer_index):
-    req = requests_collection.find_one({'_id': ObjectId(request_id)})
-    if not req or req['requesting_hospital'] != session.get('hospital'):
-        flash("Unauthorized action.", "error")
-        return redirect(url_for('my_requests'))
-
-    # Mark the accepted offer
-    requests_collection.update_one(
-        {'_id': ObjectId(request_id)},
+def accept_offer(request_id, offer_id):
+    offer_id = ObjectId(offer_id)
+    # One update: accept this offer, decline every other one. The filter
+    # only matches our own request while the offer is still pending.
+    result = requests_collection.update_one(
+        {
+            '_id': ObjectId(request_id),
+            'requesting_hospital': session.get('hospital'),
+            'status': {'$ne': 'accepted'},
+            'offers': {'$elemMatch': {'offer_id': offer_id, 'status': 'pending'}},
+        },
         {
             '$set': {
-                f'offers.{offer_index}.status': 'accepted',
+                'offers.$[chosen].status': 'accepted',
+                'offers.$[other].status': 'declined',
                 'status': 'accepted'
             }
-        }
+        },
+        array_filters=[{'chosen.offer_id': offer_id}, {'other.offer_id': {'$ne': offer_id}}]
     )
-    # Decline all other offers
-    for i, offer in enumerate(req.get('offers', [])):
-        if i != offer_index:
-            requests_collection.update_one(
-                {'_id': ObjectId(request_id)},
-                {'$set': {f'offers.{i}.status': 'declined'}}
-            )
+    if not result.matched_count:
+        flash("Unauthorized action.", "error")
+        return redirect(url_for('my_requests'))
 
     flash("Offer accepted!", "success")
     return redirect(url_for('my_requests'))
 
 
-@app.route('/decline_offer/<request_id>/<int:offer_index>', methods=['POST'])
+@app.route('/decline_offer/<request_id>/<offer_id>', methods=['POST'])
 @role_required('hospital_admin')
-def decline_offer(request_id, offer_index):
-    req = requests_collection.find_one({'_id': ObjectId(request_id)})
-    if not req or req['requesting_hospital'] != session.get('hospital'):
+def decline_offer(request_id, offer_id):
+    offer_id = ObjectId(offer_id)
+    req = requests_collection.find_one_and_update(
+        {
+            '_id': ObjectId(request_id),
+            'requesting_hospital': session.get('hospital'),
+            'offers': {'$elemMatch': {'offer_id': offer_id, 'status': 'pending'}},
+        },
+        {'$set': {'offers.$[chosen].status': 'declined'}},
+        array_filters=[{'chosen.offer_id': offer_id}],
+        projection={'offers.status': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if req is None:
         flash("Unauthorized action.", "error")
         return redirect(url_for('my_requests'))
 
-    requests_collection.update_one(
-        {'_id': ObjectId(request_id)},
-        {'$set': {f'offers.{offer_index}.status': 'declined'}}
-    )
-
-    # If all offers are declined, set request back to pending
-    updated_req = requests_collection.find_one({'_id': ObjectId(request_id)})
-    all_declined = all(o.get('status') == 'declined' for o in updated_req.get('offers', []))
-    if all_declined:
+    # If all offers are declined, set request back to pending. The filter
+    # re-checks on the server, so an offer made meanwhile keeps it 'offered'.
+    if all(o.get('status') == 'declined' for o in req.get('offers', [])):
         requests_collection.update_one(
-            {'_id': ObjectId(request_id)},
+            {
+                '_id': req['_id'],
+                'status': 'offered',
+                'offers': {'$not': {'$elemMatch': {'status': {'$ne': 'declined'}}}},
+            },
             {'$set': {'status': 'pending'}}
         )
 
@@ -502,7 +514,39 @@ def decline_offer(request_id, offer_index):
     return redirect(url_for('my_requests'))
 
 
+def ensure_request_indexes():
+    """Index the request board queries (idempotent)."""
+    requests_collection.create_index(
+        [('requesting_hospital', ASCENDING), ('status', ASCENDING)],
+        name='requesting_hospital_status',
+    )
+    requests_collection.create_index([('status', ASCENDING)], name='status')
+
+
+def backfill_offer_ids():
+    """Give offers stored before offer ids existed an ``offer_id``."""
+    for req in requests_collection.find(
+        {'offers': {'$elemMatch': {'offer_id': {'$exists': False}}}}, {'offers': 1}
+    ):
+        offers = [dict(o, offer_id=o.get('offer_id') or ObjectId()) for o in req['offers']]
+        # Only replace the array if no offer was added or changed meanwhile
+        requests_collection.update_one(
+            {'_id': req['_id'], 'offers': req['offers']},
+            {'$set': {'offers': offers}}
+        )
+
+
 # --- AI Copilot API ---
+def may_query_hospital(hospital):
+    """Hospital admins may only query their own hospital; distributors any."""
+    if session.get('role') != 'hospital_admin' or not hospital:
+        return True
+    return str(hospital).strip().upper() == session.get('hospital', '').upper()
+
+
+FOREIGN_HOSPITAL_ERROR = "Hospital admins can only query their own hospital."
+
+
 @app.route('/api/copilot', methods=['POST'])
 @login_required
 def api_copilot():
@@ -512,7 +556,9 @@ def api_copilot():
         {
             "month": "April",
             "current_stock": {"Paracetamol 500mg tablets": 200, ...},
-            "safety_buffer": 0.20  // optional, default 0.20
+            "safety_buffer": 0.20,  // optional, default 0.20
+            "hospital": "A"         // optional, default the user's hospital;
+                                    // hospital admins may only name their own
         }
     """
     try:
@@ -531,17 +577,251 @@ def api_copilot():
     if not month:
         return jsonify({"error": "Missing required field: 'month'."}), 400
 
+    if not may_query_hospital(data.get("hospital")):
+        return jsonify({"error": FOREIGN_HOSPITAL_ERROR}), 403
+    hospital = data.get("hospital") or session.get("hospital")
+
     try:
         recs = recommend_orders(
             next_month=month,
             current_stock=current_stock,
             safety_buffer=safety_buffer,
+            hospital=hospital,
         )
         return jsonify({"month": month, "safety_buffer": safety_buffer, "recommendations": recs})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/copilot/batch', methods=['POST'])
+@login_required
+def api_copilot_batch():
+    """Recommend orders for several hospitals in one pass.
+
+    Expects JSON body:
+        {
+            "requests": [
+                {"hospital": "A", "month": "April", "current_stock": {...}},
+                {"hospital": "B", "month": "April", "safety_buffer": 0.3},
+                ...
+            ]
+        }
+
+    Hospital admins may only name their own hospital, which is also the
+    default for entries without one.
+    """
+    try:
+        from charm.copilot import UnknownHospitalError, recommend_orders_batch
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get("requests"), list):
+        return jsonify({"error": "Request body must be JSON with a 'requests' list."}), 400
+
+    requests = data["requests"]
+    if session.get('role') == 'hospital_admin':
+        if not all(may_query_hospital(r.get("hospital")) for r in requests if isinstance(r, dict)):
+            return jsonify({"error": FOREIGN_HOSPITAL_ERROR}), 403
+        requests = [
+            {**r, "hospital": r.get("hospital") or session.get("hospital")} if isinstance(r, dict) else r
+            for r in requests
+        ]
+
+    try:
+        results = recommend_orders_batch(requests)
+        return jsonify({"results": results})
+    except (ValueError, UnknownHospitalError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/copilot/rebalance', methods=['POST'])
+@login_required
+def api_copilot_rebalance():
+    """Propose stock transfers between hospitals for a month.
+
+    Expects JSON body:
+        {
+            "month": "April",
+            "method": "auto",          // optional: auto | lp | greedy
+            "current_stock": {"A": {"Paracetamol 500mg tablets": 200}, ...},  // optional
+            "post_requests": false     // optional, distributor only
+        }
+
+    With ``post_requests`` each transfer is posted as a request from the
+    receiving hospital carrying a pending offer from the source hospital.
+    """
+    try:
+        from charm.rebalance import rebalance
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Request body must be JSON."}), 400
+
+    month = data.get("month")
+    if not month:
+        return jsonify({"error": "Missing required field: 'month'."}), 400
+    post_requests = bool(data.get("post_requests"))
+    if post_requests and session.get('role') != 'distributor':
+        return jsonify({"error": "Only distributors can post rebalancing requests."}), 403
+
+    try:
+        plan = rebalance(
+            month,
+            method=data.get("method", "auto"),
+            current_stock=data.get("current_stock"),
+            safety_buffer=data.get("safety_buffer", 0.20),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    transfers = [
+        {k: (None if isinstance(v, float) and v != v else v) for k, v in t.items()}
+        for t in plan.to_dict(orient="records")
+    ]
+    if post_requests and transfers:
+        now = datetime.now()
+        requests_collection.insert_many([
+            {
+                'requesting_hospital': t['target'],
+                'item_name': t['medication'],
+                'quantity': int(t['units']),
+                'status': 'offered',
+                'offers': [{
+                    'offer_id': ObjectId(),
+                    'offering_hospital': t['source'],
+                    'offer_price': 0.0,
+                    'offer_time': now,
+                    'status': 'pending',
+                }],
+                'request_time': now,
+                'source': 'rebalance',
+            }
+            for t in transfers
+        ])
+    return jsonify({"month": month, "transfers": transfers, "posted": post_requests})
+
+
+@app.route('/api/copilot/jobs', methods=['POST'])
+@login_required
+def api_copilot_jobs():
+    """Queue a copilot recommendation and return a job id to poll.
+
+    Takes the same JSON body as ``/api/copilot``. Identical requests that are
+    still queued or running share one job.
+    """
+    try:
+        from charm.copilot import recommend_orders
+        from charm.jobs import get_job_queue, job_key
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Request body must be JSON."}), 400
+
+    month = data.get("month")
+    if not month:
+        return jsonify({"error": "Missing required field: 'month'."}), 400
+
+    if not may_query_hospital(data.get("hospital")):
+        return jsonify({"error": FOREIGN_HOSPITAL_ERROR}), 403
+    params = {
+        "next_month": month,
+        "current_stock": data.get("current_stock", {}),
+        "safety_buffer": data.get("safety_buffer", 0.20),
+        "hospital": data.get("hospital") or session.get("hospital"),
+    }
+    job = get_job_queue().submit(job_key("recommend_orders", **params), recommend_orders, **params)
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "poll": url_for('api_copilot_job', job_id=job.id),
+    }), 202
+
+
+@app.route('/api/copilot/jobs/<job_id>', methods=['GET'])
+@login_required
+def api_copilot_job(job_id):
+    """Poll a queued copilot job; ``result`` is present once status is "done"."""
+    try:
+        from charm.jobs import get_job_queue
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown or expired job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/copilot/forecast', methods=['POST'])
+@login_required
+def api_copilot_forecast():
+    """Multi-month demand forecast.
+
+    Expects JSON body:
+        {
+            "month": "April",   // first forecast month
+            "months": 6,        // optional, default 6
+            "hospital": "A"     // optional, default the user's hospital;
+                                // hospital admins may only name their own
+        }
+    """
+    try:
+        from charm.copilot import UnknownHospitalError, forecast_horizon
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Request body must be JSON."}), 400
+
+    month = data.get("month")
+    if not month:
+        return jsonify({"error": "Missing required field: 'month'."}), 400
+
+    try:
+        months = int(data.get("months", 6))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'months' must be a whole number."}), 400
+    if not may_query_hospital(data.get("hospital")):
+        return jsonify({"error": FOREIGN_HOSPITAL_ERROR}), 403
+    hospital = data.get("hospital") or session.get("hospital")
+
+    try:
+        forecast = forecast_horizon(month, months=months, hospital=hospital)
+        return jsonify({"month": month, "months": months, "forecast": forecast})
+    except (ValueError, UnknownHospitalError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/copilot/stats', methods=['GET'])
+@login_required
+def api_copilot_stats():
+    """Expose model-registry, prediction-cache and job-queue counters for monitoring."""
+    try:
+        from charm.copilot import get_prediction_cache
+        from charm.jobs import get_job_queue
+        from charm.registry import get_registry
+    except ImportError:
+        return jsonify({"error": "CHARM Copilot package not installed. Run `pip install -r requirements.txt`."}), 500
+
+    return jsonify({
+        "model_registry": get_registry().stats(),
+        "prediction_cache": get_prediction_cache().stats(),
+        "jobs": get_job_queue().stats(),
+    })
+
+
 if __name__ == '__main__':
     seed_users()
     seed_real_data()
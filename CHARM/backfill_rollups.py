@@ -0,0 +1,19 @@
+"""Rebuild the usage_monthly rollups from the full usage log.
+
+Run once after upgrading (existing logs predate the rollups), or any time
+the rollups need repairing:
+
+    python backfill_rollups.py            # all hospitals
+    python backfill_rollups.py --hospital A
+"""
+import argparse
+
+from KaltriDB import ensure_indexes, rebuild_rollups
+
+parser = argparse.ArgumentParser(description="Rebuild monthly usage rollups.")
+parser.add_argument("--hospital", default=None, help="Only rebuild this hospital (e.g. A).")
+args = parser.parse_args()
+
+ensure_indexes()
+count = rebuild_rollups(args.hospital.upper() if args.hospital else None)
+print(f"✅ Rebuilt {count} monthly rollup documents.")
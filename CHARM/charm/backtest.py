@@ -0,0 +1,387 @@
+"""
+CHARM Copilot walk-forward backtest.
+
+Evaluates the demand model the way it is used: for every test period the
+model is fitted only on earlier months (expanding window) and scored one
+step ahead. Folds are fitted in parallel with joblib, and per-fold feature
+matrices are cached on disk (``joblib.Memory``) so re-running with another
+backend or safety buffer skips the encoding step.
+
+Reports MAE / MAPE / bias per medication and overall, plus the stockout and
+overstock units the ``recommend_orders`` ordering rule would have produced.
+
+CLI:
+    python -m charm.backtest --min-train 6
+    python -m charm.backtest --backend hgb --jobs -1 --out backtest.csv
+    python -m charm.backtest --scale-hospitals 20 --scale-years 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Sequence
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from charm.config import (
+    CACHE_DIR,
+    DEFAULT_LAGS,
+    DEFAULT_SAFETY_BUFFER,
+    DEFAULT_WINDOWS,
+)
+from charm.db import get_connection
+from charm.encoding import DEFAULT_ENCODING, ENCODINGS, base_columns, encode
+from charm.features import SERIES_KEYS, build_features
+from charm.train import (
+    BACKENDS,
+    DEFAULT_BACKEND,
+    TARGET,
+    build_training_matrix,
+    make_estimator,
+)
+from charm.utils import period_index, setup_logging
+
+logger = setup_logging()
+
+
+# ── Folds ────────────────────────────────────────────────────────────
+
+def time_index(df: pd.DataFrame) -> np.ndarray:
+    """Monotonic month index from ``period`` (or ``year``), else ``month_num``."""
+    if "period" in df.columns:
+        return np.array([period_index(p) for p in df["period"].tolist()], dtype=np.int64)
+    month = df["month_num"].to_numpy(dtype=np.int64)
+    if "year" in df.columns:
+        return df["year"].to_numpy(dtype=np.int64) * 12 + month
+    return month
+
+
+def walk_forward_folds(
+    periods: Sequence[int],
+    min_train: int = 6,
+    horizon: int = 1,
+    step: int = 1,
+) -> list[tuple[int, list[int]]]:
+    """Expanding-window folds over sorted distinct *periods*.
+
+    Returns ``(train_end, test_periods)`` pairs: fold *i* trains on every
+    period ≤ ``train_end`` and tests on the next *horizon* periods.
+    """
+    periods = sorted(set(int(p) for p in periods))
+    if min_train < 1 or horizon < 1 or step < 1:
+        raise ValueError("min_train, horizon and step must be positive.")
+    if len(periods) <= min_train:
+        raise ValueError(
+            f"Need more than {min_train} periods for a walk-forward backtest, "
+            f"got {len(periods)}."
+        )
+    return [
+        (periods[i - 1], periods[i:i + horizon])
+        for i in range(min_train, len(periods), step)
+    ]
+
+
+# ── Per-fold work ────────────────────────────────────────────────────
+
+def _fold_matrices(train: pd.DataFrame, test: pd.DataFrame, encoding: str):
+    """Encode one fold; the test rows reuse the training layout."""
+    X_train, feature_cols, meta = build_training_matrix(train, encoding)
+    base_cols = base_columns(feature_cols)
+    X_test = encode(
+        test[base_cols].to_numpy(dtype=np.float64),
+        test["medication"].tolist(),
+        feature_cols,
+        encoding,
+        categories=meta.get("categories"),
+    )
+    return X_train, X_test, feature_cols, meta
+
+
+def _run_fold(
+    fold: int,
+    train: pd.DataFrame,
+    test: pd.DataFrame,
+    encoding: str,
+    backend: str,
+    memory: joblib.Memory | None,
+) -> pd.DataFrame:
+    """Fit one fold and return its out-of-sample predictions."""
+    build = memory.cache(_fold_matrices) if memory is not None else _fold_matrices
+    X_train, X_test, feature_cols, meta = build(train, test, encoding)
+    meta = {**meta, "backend": backend}
+    model = make_estimator(backend, feature_cols, meta)
+    model.fit(X_train, train[TARGET].to_numpy())
+
+    out = test[[*SERIES_KEYS, "month_num", "_t"]].copy()
+    out["fold"] = fold
+    out["actual"] = test[TARGET].to_numpy(dtype=np.float64)
+    out["predicted"] = np.maximum(0.0, model.predict(X_test))
+    return out
+
+
+# ── Metrics ──────────────────────────────────────────────────────────
+
+def error_metrics(actual: np.ndarray, predicted: np.ndarray) -> dict[str, float]:
+    """MAE, MAPE (over non-zero actuals, in %) and bias (mean predicted − actual)."""
+    err = predicted - actual
+    nonzero = actual != 0
+    mape = (
+        float(np.mean(np.abs(err[nonzero]) / actual[nonzero]) * 100)
+        if nonzero.any() else float("nan")
+    )
+    return {
+        "mae": float(np.mean(np.abs(err))),
+        "mape": mape,
+        "bias": float(np.mean(err)),
+    }
+
+
+def simulate_orders(
+    predictions: pd.DataFrame,
+    safety_buffer: float = DEFAULT_SAFETY_BUFFER,
+) -> pd.DataFrame:
+    """Replay the ``recommend_orders`` rule over the test months.
+
+    Each series starts with no stock. Every month it orders
+    ``ceil(predicted × (1 + buffer) − stock)``, consumes the actual usage
+    and carries the remainder over. Adds ``ordered``, ``stockout_units``
+    (unmet demand) and ``overstock_units`` (stock left above the buffered
+    actual demand) columns.
+    """
+    df = predictions.sort_values([*SERIES_KEYS, "_t"]).reset_index(drop=True)
+    series = df.groupby(SERIES_KEYS, sort=False).ngroup().to_numpy()
+    step = df.groupby(SERIES_KEYS, sort=False).cumcount().to_numpy()
+    stock = np.zeros(series.max() + 1 if len(df) else 0)
+
+    ordered = np.zeros(len(df))
+    stockout = np.zeros(len(df))
+    overstock = np.zeros(len(df))
+    predicted = df["predicted"].to_numpy()
+    actual = df["actual"].to_numpy()
+    # Sequential in time, vectorised across series.
+    for k in range(int(step.max()) + 1 if len(df) else 0):
+        rows = np.flatnonzero(step == k)
+        s = series[rows]
+        order = np.maximum(0.0, np.ceil(predicted[rows] * (1 + safety_buffer) - stock[s]))
+        available = stock[s] + order
+        ordered[rows] = order
+        stockout[rows] = np.maximum(0.0, actual[rows] - available)
+        buffered_actual = np.ceil(actual[rows] * (1 + safety_buffer))
+        overstock[rows] = np.maximum(0.0, available - buffered_actual)
+        stock[s] = np.maximum(0.0, available - actual[rows])
+
+    return df.assign(ordered=ordered, stockout_units=stockout, overstock_units=overstock)
+
+
+def summarise(simulated: pd.DataFrame) -> dict:
+    """Overall and per-medication metrics for a ``simulate_orders`` frame."""
+    overall = error_metrics(
+        simulated["actual"].to_numpy(), simulated["predicted"].to_numpy()
+    )
+    overall["stockout_units"] = float(simulated["stockout_units"].sum())
+    overall["overstock_units"] = float(simulated["overstock_units"].sum())
+    overall["rows"] = int(len(simulated))
+
+    per_med = []
+    for med, g in simulated.groupby("medication", sort=True):
+        row = {"medication": med}
+        row.update(error_metrics(g["actual"].to_numpy(), g["predicted"].to_numpy()))
+        row["stockout_units"] = float(g["stockout_units"].sum())
+        row["overstock_units"] = float(g["overstock_units"].sum())
+        per_med.append(row)
+    return {"overall": overall, "per_medication": pd.DataFrame(per_med)}
+
+
+# ── Public API ───────────────────────────────────────────────────────
+
+def backtest_frame(
+    df: pd.DataFrame,
+    min_train: int = 6,
+    horizon: int = 1,
+    step: int = 1,
+    encoding: str = DEFAULT_ENCODING,
+    backend: str = DEFAULT_BACKEND,
+    safety_buffer: float = DEFAULT_SAFETY_BUFFER,
+    n_jobs: int = -1,
+    cache_dir: str | None = CACHE_DIR,
+) -> dict:
+    """Walk-forward backtest over a ``build_features(one_hot=False)`` frame.
+
+    Returns a dict with ``overall`` metrics, a ``per_medication`` DataFrame,
+    the out-of-sample ``predictions`` (with simulated orders) and ``folds``.
+    Set *cache_dir* to None to disable the fold-matrix cache.
+    """
+    df = df.copy()
+    if "hospital" not in df.columns:
+        df["hospital"] = ""
+    df["_t"] = time_index(df)
+    folds = walk_forward_folds(df["_t"].unique(), min_train, horizon, step)
+    memory = joblib.Memory(cache_dir, verbose=0) if cache_dir else None
+
+    t = df["_t"].to_numpy()
+    tasks = []
+    for i, (train_end, test_periods) in enumerate(folds):
+        train = df[t <= train_end]
+        test = df[np.isin(t, test_periods)]
+        tasks.append(joblib.delayed(_run_fold)(i, train, test, encoding, backend, memory))
+
+    logger.info(
+        "Backtesting %d fold(s) on %d rows (%s / %s) …", len(folds), len(df), backend, encoding
+    )
+    start = time.perf_counter()
+    parts = joblib.Parallel(n_jobs=n_jobs)(tasks)
+    logger.info("Folds fitted in %.1f s.", time.perf_counter() - start)
+
+    predictions = pd.concat(parts, ignore_index=True)
+    if horizon > 1:
+        # Overlapping folds score a month several times; keep the freshest fit.
+        predictions = predictions.sort_values("fold").drop_duplicates(
+            [*SERIES_KEYS, "_t"], keep="last"
+        )
+    simulated = simulate_orders(predictions, safety_buffer)
+    result = summarise(simulated)
+    result["predictions"] = simulated.drop(columns="_t")
+    result["folds"] = [
+        {"train_end": int(end), "test": [int(p) for p in test]} for end, test in folds
+    ]
+    return result
+
+
+def run_backtest(
+    db_path: str | None = None,
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+    hospitals: Sequence[str] | None = None,
+    **kwargs,
+) -> dict:
+    """Walk-forward backtest over the orders in *db_path*.
+
+    Keyword arguments are passed to :func:`backtest_frame`.
+    """
+    conn = get_connection(db_path)
+    try:
+        df = build_features(
+            conn=conn, lags=lags, windows=windows, one_hot=False, hospitals=hospitals
+        )
+    finally:
+        conn.close()
+    return backtest_frame(df, **kwargs)
+
+
+# ── CLI ──────────────────────────────────────────────────────────────
+
+def _print_report(result: dict, label: str) -> None:
+    o = result["overall"]
+    print(f"\n{'='*72}")
+    print(f"  CHARM backtest — {label}")
+    print(f"  {len(result['folds'])} fold(s), {o['rows']} scored rows")
+    print(f"{'='*72}\n")
+    print(f"  {'medication':<40s} {'MAE':>8s} {'MAPE%':>7s} {'bias':>8s} "
+          f"{'stockout':>9s} {'overstock':>10s}")
+    for r in result["per_medication"].itertuples(index=False):
+        print(f"  {r.medication:<40s} {r.mae:>8.1f} {r.mape:>7.1f} {r.bias:>8.1f} "
+              f"{r.stockout_units:>9.0f} {r.overstock_units:>10.0f}")
+    print(f"\n  {'OVERALL':<40s} {o['mae']:>8.1f} {o['mape']:>7.1f} {o['bias']:>8.1f} "
+          f"{o['stockout_units']:>9.0f} {o['overstock_units']:>10.0f}")
+    print(f"{'='*72}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="charm.backtest",
+        description="Walk-forward backtest of the CHARM demand model.",
+    )
+    parser.add_argument("--db", default=None, help="Path to SQLite database.")
+    parser.add_argument(
+        "--min-train",
+        type=int,
+        default=6,
+        help="Months in the first training window (default: 6).",
+    )
+    parser.add_argument("--horizon", type=int, default=1, help="Test months per fold.")
+    parser.add_argument("--step", type=int, default=1, help="Months between folds.")
+    parser.add_argument("--lags", type=int, nargs="+", default=list(DEFAULT_LAGS))
+    parser.add_argument("--windows", type=int, nargs="+", default=list(DEFAULT_WINDOWS))
+    parser.add_argument("--encoding", choices=ENCODINGS, default=DEFAULT_ENCODING)
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND)
+    parser.add_argument("--hospitals", nargs="+", default=None)
+    parser.add_argument(
+        "--safety",
+        type=float,
+        default=DEFAULT_SAFETY_BUFFER,
+        help=f"Safety buffer for the order simulation (default {DEFAULT_SAFETY_BUFFER}).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=-1,
+        help="Parallel fold fits (joblib n_jobs; default -1 = all cores).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        help="Fold-matrix cache directory (default: CHARM_CACHE_DIR or .cache/).",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Disable the fold cache.")
+    parser.add_argument(
+        "--scale-hospitals",
+        type=int,
+        default=None,
+        help="Backtest the Nene Tereza export scaled to N hospitals instead of the DB.",
+    )
+    parser.add_argument(
+        "--scale-years",
+        type=int,
+        default=2,
+        help="Years of data with --scale-hospitals (default: 2).",
+    )
+    parser.add_argument(
+        "--out",
+        default=None,
+        help="Write per-row predictions to this CSV and the summary next to it as JSON.",
+    )
+    args = parser.parse_args()
+
+    options = dict(
+        min_train=args.min_train,
+        horizon=args.horizon,
+        step=args.step,
+        encoding=args.encoding,
+        backend=args.backend,
+        safety_buffer=args.safety,
+        n_jobs=args.jobs,
+        cache_dir=None if args.no_cache else args.cache_dir,
+    )
+    if args.scale_hospitals:
+        from charm.bench import scale_nene_dataset
+
+        df = scale_nene_dataset(args.scale_hospitals, args.scale_years)
+        df["hospital"] = df["hospital"].astype(str)
+        result = backtest_frame(df, **options)
+        label = f"{args.scale_hospitals} hospitals × {args.scale_years} years (scaled)"
+    else:
+        result = run_backtest(
+            args.db, args.lags, args.windows, hospitals=args.hospitals, **options
+        )
+        label = args.db or "default DB"
+    _print_report(result, f"{label}, {args.backend} / {args.encoding}")
+
+    if args.out:
+        result["predictions"].to_csv(args.out, index=False)
+        summary = {
+            "overall": result["overall"],
+            "per_medication": result["per_medication"].to_dict(orient="records"),
+            "folds": result["folds"],
+            "options": {k: v for k, v in options.items() if k != "cache_dir"},
+        }
+        with open(f"{args.out.rsplit('.', 1)[0]}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info("Backtest written to %s", args.out)
+
+
+if __name__ == "__main__":
+    main()
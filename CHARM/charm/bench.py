@@ -0,0 +1,179 @@
+"""
+CHARM Copilot micro-benchmarks.
+
+CLI:
+    python -m charm.bench features --medications 10000 --months 60
+    python -m charm.bench train --hospitals 100 --years 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from charm.config import BASE_DIR, MONTH_NAME_TO_NUM
+from charm.features import _add_lag_features_legacy, add_lag_features
+from charm.train import BACKENDS, TARGET, build_training_matrix, make_estimator
+from charm.utils import setup_logging
+
+logger = setup_logging()
+
+
+def synthetic_orders(n_medications: int, n_months: int, seed: int = 42) -> pd.DataFrame:
+    """Return a sorted (medication, month) orders-like frame with random usage."""
+    rng = np.random.default_rng(seed)
+    n = n_medications * n_months
+    base = rng.integers(20, 2000, size=n_medications).repeat(n_months)
+    used = np.maximum(0, base + rng.normal(0, 0.1, size=n) * base).astype(np.int64)
+    return pd.DataFrame(
+        {
+            "medication": np.repeat([f"MED{i:06d}" for i in range(n_medications)], n_months),
+            "month_num": np.tile(np.arange(1, n_months + 1), n_medications),
+            "quantity": (used * 1.1).astype(np.int64),
+            "quantity_used": used,
+            "avg_daily_consumption": used / 30.0,
+        }
+    )
+
+
+NENE_CSV = BASE_DIR / "data" / "nene_tereza_synthetic_orders_2025_with_consumption.csv"
+
+
+def scale_nene_dataset(
+    n_hospitals: int = 100,
+    n_years: int = 1,
+    csv_path: str | Path = NENE_CSV,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """Replicate the Nene Tereza CSV across hospitals and years with noise.
+
+    Each hospital gets a random size multiplier and ±10 % monthly noise, so
+    the per-medication seasonality of the real export is preserved. Returns
+    a feature frame (default lag/window set) sorted by hospital, medication
+    and time, ready for ``build_training_matrix``.
+    """
+    rng = np.random.default_rng(seed)
+    src = pd.read_csv(csv_path)
+    src["month_num"] = src["order_month"].map(MONTH_NAME_TO_NUM)
+    src = src.sort_values(["medication", "month_num"]).reset_index(drop=True)
+
+    reps = n_hospitals * n_years
+    df = pd.concat([src] * reps, ignore_index=True)
+    block = len(src)
+    hospital = np.repeat(np.arange(n_hospitals), n_years * block)
+    year = np.tile(np.repeat(np.arange(n_years), block), n_hospitals)
+    scale = rng.uniform(0.3, 3.0, n_hospitals)[hospital] * rng.normal(1.0, 0.1, len(df))
+    scale = np.clip(scale, 0.05, None)
+
+    df["hospital"] = hospital
+    df["year"] = year
+    for col in ("quantity", "quantity_used"):
+        df[col] = np.round(df[col].to_numpy() * scale).astype(np.int64)
+    df["avg_daily_consumption"] = df["avg_daily_consumption"] * scale
+
+    df = df.sort_values(["hospital", "medication", "year", "month_num"]).reset_index(drop=True)
+    return add_lag_features(df, group_cols=["hospital", "medication"])
+
+
+def _best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_features(
+    n_medications: int = 10_000,
+    n_months: int = 60,
+    lags: tuple[int, ...] = (1, 2, 3, 12),
+    windows: tuple[int, ...] = (3, 6, 12),
+    repeat: int = 3,
+) -> dict[str, float]:
+    """Time the legacy lambda-based features against the vectorised kernel."""
+    df = synthetic_orders(n_medications, n_months)
+
+    legacy = _add_lag_features_legacy(df.copy())
+    kernel = add_lag_features(df, lags=(1,), windows=(3,))
+    for col in ("lag_1_used", "lag_1_ordered", "rolling_mean_3_used"):
+        np.testing.assert_allclose(kernel[col], legacy[col])
+
+    results = {
+        "legacy (lag 1, rolling 3)": _best_of(lambda: _add_lag_features_legacy(df.copy()), repeat),
+        "kernel (lag 1, rolling 3)": _best_of(
+            lambda: add_lag_features(df, lags=(1,), windows=(3,)), repeat
+        ),
+        f"kernel (lags {lags}, windows {windows})": _best_of(
+            lambda: add_lag_features(df, lags=lags, windows=windows), repeat
+        ),
+    }
+
+    print(f"\nLag/rolling features — {n_medications} medications × {n_months} months "
+          f"({len(df):,} rows), best of {repeat}")
+    for name, secs in results.items():
+        print(f"  {name:<48s} {secs * 1000:>10.1f} ms")
+    speedup = results["legacy (lag 1, rolling 3)"] / results["kernel (lag 1, rolling 3)"]
+    print(f"  speed-up on the default feature set: {speedup:.0f}×\n")
+    return results
+
+
+def bench_train(
+    n_hospitals: int = 100,
+    n_years: int = 1,
+    backends: tuple[str, ...] = BACKENDS,
+    encodings: tuple[str, ...] = ("onehot", "ordinal"),
+) -> dict[str, float]:
+    """Time model fitting for each backend × encoding on a scaled dataset."""
+    df = scale_nene_dataset(n_hospitals, n_years)
+    y = df[TARGET].to_numpy()
+    print(f"\nTraining — {n_hospitals} hospitals × {n_years} year(s) "
+          f"({len(df):,} rows)")
+
+    results: dict[str, float] = {}
+    for encoding in encodings:
+        X, feature_cols, meta = build_training_matrix(df, encoding)
+        for backend in backends:
+            meta["backend"] = backend
+            model = make_estimator(backend, feature_cols, meta)
+            secs = _best_of(lambda: model.fit(X, y), repeat=1)
+            mae = float(np.mean(np.abs(model.predict(X) - y)))
+            name = f"{backend} / {encoding}"
+            results[name] = secs
+            print(f"  {name:<24s} {secs:>8.2f} s   in-sample MAE {mae:>8.2f}")
+    print()
+    return results
+
+
+# ── CLI ──────────────────────────────────────────────────────────────
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="charm.bench",
+        description="Run CHARM Copilot performance benchmarks.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_feat = sub.add_parser("features", help="Lag/rolling feature kernels.")
+    p_feat.add_argument("--medications", type=int, default=10_000)
+    p_feat.add_argument("--months", type=int, default=60)
+    p_feat.add_argument("--repeat", type=int, default=3)
+
+    p_train = sub.add_parser("train", help="Estimator backends on scaled Nene Tereza data.")
+    p_train.add_argument("--hospitals", type=int, default=100)
+    p_train.add_argument("--years", type=int, default=1)
+    p_train.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+
+    args = parser.parse_args()
+    if args.command == "features":
+        bench_features(args.medications, args.months, repeat=args.repeat)
+    elif args.command == "train":
+        bench_train(args.hospitals, args.years, tuple(args.backends))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,20 @@ BASE_DIR = Path(__file__).resolve().parent.parent  # repo root
 
 DB_PATH: str = os.environ.get("CHARM_DB_PATH", str(BASE_DIR / "charm.db"))
 MODEL_DIR: str = os.environ.get("CHARM_MODEL_DIR", str(BASE_DIR / "models"))
+CACHE_DIR: str = os.environ.get("CHARM_CACHE_DIR", str(BASE_DIR / ".cache"))
+
+# ── Storage ──────────────────────────────────────────────────────────
+MONGO_URI: str = os.environ.get("CHARM_MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB: str = os.environ.get("CHARM_MONGO_DB", "hospital_inventory")
+MONGO_MAX_POOL_SIZE: int = int(os.environ.get("CHARM_MONGO_MAX_POOL_SIZE", "50"))  # per process
+MONGO_MIN_POOL_SIZE: int = int(os.environ.get("CHARM_MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS: int = int(os.environ.get("CHARM_MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(
+    os.environ.get("CHARM_MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+SQLITE_TIMEOUT: float = float(os.environ.get("CHARM_SQLITE_TIMEOUT", "30"))  # busy wait, seconds
+SQLITE_REUSE_CONNECTIONS: bool = os.environ.get("CHARM_SQLITE_REUSE", "1") != "0"
+SQLITE_MAX_CACHED: int = 8  # open SQLite connections kept per thread
 
 # ── Month helpers ────────────────────────────────────────────────────
 MONTH_NAMES: list[str] = [
@@ -32,6 +46,15 @@ REQUIRED_COLUMNS: set[str] = {
 }
 
 # ── Defaults ─────────────────────────────────────────────────────────
+DEFAULT_HOSPITAL: str = "A"  # hospital assumed for CSVs without a hospital column
 DEFAULT_SAFETY_BUFFER: float = 0.20
 EXPIRY_WARNING_DAYS: int = 90
 OVERSTOCK_MARGIN: float = 0.50  # 50 % above buffered demand → overstock warning
+DEFAULT_LAGS: tuple[int, ...] = (1,)  # lag_<k>_used / lag_<k>_ordered features
+DEFAULT_WINDOWS: tuple[int, ...] = (3,)  # rolling_mean_<w>_used features
+INGEST_CHUNK_ROWS: int = 50_000  # rows per transaction in streaming ingestion
+FEATURE_REFRESH_SERIES: int = 500  # dirty series per feature-store refresh batch
+PREDICTION_CACHE_SIZE: int = 256  # cached demand predictions (LRU)
+PREDICTION_CACHE_TTL: float = 3600.0  # seconds before a cached prediction is dropped
+JOB_WORKERS: int = int(os.environ.get("CHARM_JOB_WORKERS", "2"))  # background job threads
+JOB_RESULT_TTL: float = 900.0  # seconds a finished job stays pollable
@@ -2,10 +2,19 @@
 CHARM Copilot recommendation engine.
 
 Public API:
-    recommend_orders(next_month, current_stock, safety_buffer=0.20)
+    recommend_orders(next_month, current_stock, safety_buffer=0.20, hospital=None)
+    recommend_orders_batch(requests)  # [{hospital, next_month, current_stock, ...}]
+    forecast_horizon(start_month, months=6, hospital=None)
 
 CLI:
     python -m charm.copilot --month April --stock-json examples/current_stock.json
+    python -m charm.copilot --month April --stock-json stock_b.json --hospital B
+    python -m charm.copilot --month April --stock-dir stock/   # A.json, B.json, ...
+    python -m charm.copilot --month April --horizon 12
+
+When the model directory holds a partition manifest (see
+``charm.train.train_partitioned``), each medication is scored by its
+hospital's or cluster's model, falling back to the global model.
 """
 
 from __future__ import annotations
@@ -13,41 +22,136 @@ from __future__ import annotations
 import argparse
 import json
 import math
-from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Hashable, Sequence
 
-import joblib
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
+from charm.cache import LRUCache
 from charm.config import (
+    DB_PATH,
+    DEFAULT_HOSPITAL,
     DEFAULT_SAFETY_BUFFER,
     EXPIRY_WARNING_DAYS,
     MODEL_DIR,
     MONTH_NAMES,
     OVERSTOCK_MARGIN,
+    PREDICTION_CACHE_SIZE,
+    PREDICTION_CACHE_TTL,
 )
 from charm.db import get_connection
-from charm.utils import days_in_month, month_name_to_num, setup_logging
+from charm.encoding import base_columns, encode
+from charm.features import (
+    SERIES_KEYS,
+    ensure_feature_store,
+    next_step_features,
+    parse_lag_spec,
+)
+from charm.lots import fetch_lots, project_waste
+from charm.registry import DEFAULT_META, LoadedModel, get_model, load_manifest
+from charm.utils import (
+    days_in_month,
+    month_name_to_num,
+    next_month_start,
+    setup_logging,
+    shift_period,
+)
 
 logger = setup_logging()
 
+# Raw demand predictions keyed by (database, hospital, month, orders watermark,
+# model versions). Stock and safety buffer are applied after the lookup.
+_prediction_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+
+
+class UnknownHospitalError(RuntimeError):
+    """No order history for the requested hospital (a caller error)."""
+
 
 # ── Internal helpers ─────────────────────────────────────────────────
 
 def _load_model(model_dir: str | None = None):
-    """Load model + feature columns from disk."""
-    md = Path(model_dir or MODEL_DIR)
-    model_path = md / "model.joblib"
-    cols_path = md / "columns.joblib"
-
-    if not model_path.exists():
-        raise FileNotFoundError(
-            f"Trained model not found at {model_path}. Run `python -m charm.train` first."
+    """Return the resident model + feature columns (see ``charm.registry``)."""
+    loaded = get_model(model_dir)
+    return loaded.model, loaded.feature_cols
+
+
+def _fetch_recent_history(
+    conn, n: int, hospital: str | Sequence[str] = DEFAULT_HOSPITAL
+) -> pd.DataFrame:
+    """Fetch the last *n* feature-store rows for every medication in one query.
+
+    *hospital* may also be a list of hospitals, fetched together.
+    """
+    hospitals = [hospital] if isinstance(hospital, str) else list(hospital)
+    return pd.read_sql_query(
+        f"""
+        SELECT hospital, medication, rn, quantity, quantity_used, avg_daily_consumption
+        FROM (
+            SELECT hospital, medication, quantity, quantity_used, avg_daily_consumption,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY hospital, medication ORDER BY period DESC, order_id DESC
+                   ) AS rn
+            FROM features
+            WHERE hospital IN ({", ".join("?" * len(hospitals))})
         )
+        WHERE rn <= ?
+        """,
+        conn,
+        params=(*hospitals, n),
+    )
+
+
+def _history_depth(feature_cols: list[str]) -> int:
+    """Months of history needed to build *feature_cols*' lag/rolling inputs."""
+    lags, windows = parse_lag_spec(feature_cols)
+    return max((*lags, *windows, 1))
+
 
-    model = joblib.load(model_path)
-    feature_cols: list[str] = joblib.load(cols_path)
-    return model, feature_cols
+def _history_matrices(
+    history: pd.DataFrame, medications: list[str], depth: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Scatter long-format history into (n_meds × depth) arrays, newest first.
+
+    Returns (used, ordered, latest avg_daily_consumption); NaN where missing.
+    """
+    n = len(medications)
+    used = np.full((n, depth), np.nan)
+    ordered = np.full((n, depth), np.nan)
+    avg_daily = np.full(n, np.nan)
+
+    rows = pd.Index(medications).get_indexer(history["medication"])
+    cols = history["rn"].to_numpy() - 1
+    keep = (rows >= 0) & (cols < depth)
+    rows, cols = rows[keep], cols[keep]
+    used[rows, cols] = history["quantity_used"].to_numpy()[keep]
+    ordered[rows, cols] = history["quantity"].to_numpy()[keep]
+    latest = cols == 0
+    avg_daily[rows[latest]] = history["avg_daily_consumption"].to_numpy()[keep][latest]
+    return used, ordered, avg_daily
+
+
+def _fill_missing_history(
+    used: np.ndarray,
+    ordered: np.ndarray,
+    avg_daily: np.ndarray,
+    month_num: int,
+    medications: list[str],
+) -> None:
+    """Seed medications without history with a 5 units/day estimate, in place."""
+    # Fallback — no history (shouldn't happen with our data)
+    missing = np.isnan(used[:, 0])
+    if missing.any():
+        fallback = 5.0 * days_in_month(month_num, next_month_start(month_num).year)
+        used[missing, 0] = fallback
+        ordered[missing, 0] = fallback
+        avg_daily[missing] = 5.0
+        logger.warning(
+            "No history for %s; using fallback estimates.",
+            ", ".join(f"'{m}'" for m in pd.Index(medications)[missing]),
+        )
 
 
 def _build_inference_features(
@@ -55,88 +159,352 @@ def _build_inference_features(
     month_num: int,
     medications: list[str],
     feature_cols: list[str],
-) -> pd.DataFrame:
-    """Build a feature row per medication for inference on *month_num*."""
-    rows = []
-    for med in medications:
-        # Fetch most recent rows for this medication (ordered by month_num)
-        cursor = conn.execute(
-            """
-            SELECT month_num, quantity, quantity_used, avg_daily_consumption
-            FROM orders
-            WHERE medication = ?
-            ORDER BY month_num DESC
-            LIMIT 3
-            """,
-            (med,),
-        )
-        history = cursor.fetchall()
+    col_index: dict[str, int] | None = None,
+    meta: dict | None = None,
+    history: pd.DataFrame | None = None,
+    hospital: str = DEFAULT_HOSPITAL,
+):
+    """Build the inference matrix for *month_num*, one row per medication.
+
+    The lag/window set is read back from *feature_cols* and the medication
+    encoding from *meta* (``model_meta.json``), so the matrix matches the
+    training layout exactly — dense, or CSR for ``sparse`` models. Pass a
+    prefetched *history* (at least as deep as the lags) to skip the query.
+    """
+    meta = meta or DEFAULT_META
+
+    lags, windows = parse_lag_spec(feature_cols)
+    depth = _history_depth(feature_cols)
+    if history is None:
+        history = _fetch_recent_history(conn, depth, hospital)
+    used, ordered, avg_daily = _history_matrices(history, medications, depth)
+    _fill_missing_history(used, ordered, avg_daily, month_num, medications)
+    base = next_step_features(used, ordered, lags, windows)
+    base["avg_daily_consumption"] = avg_daily
+    base["month_num"] = month_num
+    base_cols = base_columns(feature_cols)
+    base_matrix = np.empty((len(medications), len(base_cols)), dtype=np.float64)
+    for j, col in enumerate(base_cols):
+        base_matrix[:, j] = base[col]
+
+    return encode(
+        base_matrix,
+        medications,
+        feature_cols,
+        meta["encoding"],
+        categories=meta.get("categories"),
+        col_index=col_index,
+    )
 
-        if history:
-            last = history[0]
-            lag_1_used = last["quantity_used"]
-            lag_1_ordered = last["quantity"]
-            avg_daily = last["avg_daily_consumption"]
 
-            # Rolling mean of last 3 months quantity_used
-            used_vals = [h["quantity_used"] for h in history]
-            rolling_mean_3_used = sum(used_vals) / len(used_vals)
-        else:
-            # Fallback — no history (shouldn't happen with our data)
-            avg_daily = 5.0
-            dm = days_in_month(month_num)
-            lag_1_used = avg_daily * dm
-            lag_1_ordered = lag_1_used
-            rolling_mean_3_used = lag_1_used
-            logger.warning("No history for '%s'; using fallback estimates.", med)
-
-        row: dict = {
-            "medication": med,
-            "month_num": month_num,
-            "lag_1_used": lag_1_used,
-            "lag_1_ordered": lag_1_ordered,
-            "rolling_mean_3_used": rolling_mean_3_used,
-            "avg_daily_consumption": avg_daily,
-        }
-        rows.append(row)
+def _route_models(
+    model_dir: str | None, hospital: str, medications: list[str]
+) -> list[tuple[LoadedModel, np.ndarray]]:
+    """Group *medications* by the model that should score them.
+
+    Returns ``(model, row indices)`` pairs. With a partition manifest each
+    medication goes to its hospital's or cluster's model; anything without
+    a partition falls back to the global model in *model_dir*.
+    """
+    base = Path(model_dir or MODEL_DIR)
+    manifest = load_manifest(base)
+    if manifest is None:
+        return [(get_model(str(base)), np.arange(len(medications)))]
+
+    partitions = manifest["partitions"]
+    if manifest["by"] == "hospital":
+        owner = {m: hospital for m in medications} if hospital in partitions else {}
+    else:
+        owner = {m: key for key, entry in partitions.items() for m in entry["medications"]}
 
-    df = pd.DataFrame(rows)
+    buckets: dict[str | None, list[int]] = {}
+    for i, med in enumerate(medications):
+        buckets.setdefault(owner.get(med), []).append(i)
 
-    # One-hot encode medication to match training columns
-    med_dummies = pd.get_dummies(df["medication"], prefix="med")
-    df = pd.concat([df, med_dummies], axis=1)
+    routes = []
+    for key, idx in buckets.items():
+        model_path = base / partitions[key]["path"] if key is not None else base
+        routes.append((get_model(str(model_path)), np.asarray(idx)))
+    return routes
 
-    # Align columns with training set (add missing med cols as 0)
-    for col in feature_cols:
-        if col not in df.columns:
-            df[col] = 0
 
-    return df
+def _predict_demand(
+    conn,
+    month_num: int,
+    medications: list[str],
+    model_dir: str | None,
+    hospital: str,
+    routes: list[tuple[LoadedModel, np.ndarray]] | None = None,
+) -> np.ndarray:
+    """Predict next-month usage per medication, routing through partitions."""
+    if routes is None:
+        routes = _route_models(model_dir, hospital, medications)
+    depth = max(_history_depth(loaded.feature_cols) for loaded, _ in routes)
+    history = _fetch_recent_history(conn, depth, hospital)
+
+    predictions = np.empty(len(medications))
+    for loaded, idx in routes:
+        X = _build_inference_features(
+            conn,
+            month_num,
+            [medications[i] for i in idx],
+            loaded.feature_cols,
+            loaded.col_index,
+            loaded.meta,
+            history=history,
+        )
+        predictions[idx] = loaded.model.predict(X)
+    return predictions
+
+
+def _predict_stacked(
+    history: pd.DataFrame,
+    blocks: list[tuple[Hashable, str, int, list[str], list[tuple[LoadedModel, np.ndarray]]]],
+) -> dict[Hashable, np.ndarray]:
+    """Score several (hospital, month) blocks with one ``predict`` per model.
+
+    Each block is ``(key, hospital, month_num, medications, routes)``;
+    *history* holds the rows of every block's hospital. The blocks routed
+    to the same model are stacked into one matrix. Returns the predictions
+    per block key.
+    """
+    by_hospital = dict(tuple(history.groupby("hospital"))) if len(history) else {}
+    stacks: dict[str, tuple[LoadedModel, list]] = {}
+    out: dict[Hashable, np.ndarray] = {}
+    for key, hospital, month_num, medications, routes in blocks:
+        out[key] = np.empty(len(medications))
+        hist = by_hospital.get(hospital, history.iloc[:0])
+        for loaded, idx in routes:
+            X = _build_inference_features(
+                None,
+                month_num,
+                [medications[i] for i in idx],
+                loaded.feature_cols,
+                loaded.col_index,
+                loaded.meta,
+                history=hist,
+            )
+            stacks.setdefault(loaded.version, (loaded, []))[1].append((key, idx, X))
+
+    for loaded, parts in stacks.values():
+        matrices = [X for _, _, X in parts]
+        stacked = (
+            sparse.vstack(matrices, format="csr")
+            if sparse.issparse(matrices[0])
+            else np.vstack(matrices)
+        )
+        y = loaded.model.predict(stacked)
+        offset = 0
+        for key, idx, X in parts:
+            out[key][idx] = y[offset : offset + X.shape[0]]
+            offset += X.shape[0]
+    return out
+
 
+def _forecast_steps(
+    loaded: LoadedModel,
+    history: pd.DataFrame,
+    medications: list[str],
+    month_num: int,
+    months: int,
+) -> np.ndarray:
+    """Recursive multi-month forecast, shape (n_medications × months).
+
+    Each step's predicted usage becomes the newest history column for the
+    next step (future orders are assumed to match usage). The model matrix
+    is allocated once and only its base columns are rewritten per step, so
+    every step is a single ``predict`` call; ``sparse`` models re-encode.
+    """
+    feature_cols, meta = loaded.feature_cols, loaded.meta
+    lags, windows = parse_lag_spec(feature_cols)
+    depth = _history_depth(feature_cols)
+    used, ordered, avg_daily = _history_matrices(history, medications, depth)
+    _fill_missing_history(used, ordered, avg_daily, month_num, medications)
+
+    base_cols = base_columns(feature_cols)
+    n_base = len(base_cols)
+    base_matrix = np.zeros((len(medications), n_base), dtype=np.float64)
+
+    def encoded():
+        return encode(
+            base_matrix,
+            medications,
+            feature_cols,
+            meta["encoding"],
+            categories=meta.get("categories"),
+            col_index=loaded.col_index,
+        )
 
-def _expiry_info(conn, med: str) -> dict | None:
-    """Return approximate expiry info for a medication."""
-    row = conn.execute(
-        """
-        SELECT expiration_date
+    dense = meta["encoding"] != "sparse"
+    X = encoded() if dense else None
+    start = next_month_start(month_num)
+    out = np.empty((len(medications), months), dtype=np.float64)
+    for step in range(months):
+        year, month = divmod(start.year * 12 + month_num - 1 + step, 12)
+        month += 1
+        base = next_step_features(used, ordered, lags, windows)
+        base["avg_daily_consumption"] = avg_daily
+        base["month_num"] = month
+        for j, col in enumerate(base_cols):
+            base_matrix[:, j] = base[col]
+        if dense:
+            X[:, :n_base] = base_matrix
+        pred = np.maximum(0.0, loaded.model.predict(X if dense else encoded()))
+        out[:, step] = pred
+
+        used[:, 1:] = used[:, :-1]
+        ordered[:, 1:] = ordered[:, :-1]
+        used[:, 0] = ordered[:, 0] = pred
+        avg_daily = pred / days_in_month(month, year)
+    return out
+
+
+def _expiry_batch(conn, hospital: str | Sequence[str] = DEFAULT_HOSPITAL) -> pd.DataFrame:
+    """Latest batch expiry for every medication of *hospital* in one query.
+
+    Returns a frame indexed by medication (by hospital and medication when
+    *hospital* is a list) with ``expiration_date`` and ``days_left`` (NaN
+    when the date does not parse). SQLite fills the bare ``expiration_date``
+    column from the row holding ``MAX(period)``, and
+    ``idx_orders_hospital_med_period_exp`` covers the whole scan.
+    """
+    hospitals = [hospital] if isinstance(hospital, str) else list(hospital)
+    df = pd.read_sql_query(
+        f"""
+        SELECT hospital, medication, expiration_date, MAX(period) AS period
         FROM orders
-        WHERE medication = ?
-        ORDER BY month_num DESC
-        LIMIT 1
+        WHERE hospital IN ({", ".join("?" * len(hospitals))})
+        GROUP BY hospital, medication
         """,
-        (med,),
-    ).fetchone()
+        conn,
+        params=hospitals,
+    )
+    df["days_left"] = _days_left(df["expiration_date"])
+    index = "medication" if isinstance(hospital, str) else SERIES_KEYS
+    return df.set_index(index)[["expiration_date", "days_left"]]
 
-    if not row:
-        return None
 
-    try:
-        exp = datetime.strptime(row["expiration_date"], "%Y-%m-%d")
-        today = datetime.now()
-        days_left = (exp - today).days
-        return {"expiration_date": row["expiration_date"], "days_left": days_left}
-    except Exception:
+def _days_left(expiration_dates) -> np.ndarray:
+    """Whole days from now until each ``YYYY-MM-DD`` date (NaN if unparseable)."""
+    expires = pd.to_datetime(pd.Series(expiration_dates, dtype=object),
+                             format="%Y-%m-%d", errors="coerce")
+    return (expires - pd.Timestamp.now()).dt.days.to_numpy(dtype=np.float64)
+
+
+def _hospital_medications(conn, hospital: str) -> list[str]:
+    """Medications ordered by *hospital*, alphabetically; raises if none."""
+    medications = [
+        r["medication"]
+        for r in conn.execute(
+            "SELECT DISTINCT medication FROM orders WHERE hospital = ? ORDER BY medication",
+            (hospital,),
+        )
+    ]
+    if not medications:
+        raise UnknownHospitalError(
+            f"No medications found for hospital '{hospital}' — run ingestion first."
+        )
+    return medications
+
+
+def _orders_watermark(conn) -> tuple:
+    """(MAX(id), COUNT(*), version) of ``orders``; changes on every insert, update or delete."""
+    return tuple(conn.execute(
+        "SELECT MAX(id), COUNT(*), (SELECT version FROM orders_version) FROM orders"
+    ).fetchone())
+
+
+def _prediction_key(
+    watermark: tuple,
+    db_path: str | None,
+    hospital: str,
+    month_num: int,
+    routes: list[tuple[LoadedModel, np.ndarray]],
+    *extra,
+) -> tuple:
+    """Cache key for raw predictions: any order change or retrained model changes it."""
+    versions = tuple((loaded.version, len(idx)) for loaded, idx in routes)
+    database = str(Path(db_path or DB_PATH).resolve())
+    return (database, hospital, month_num, watermark, versions, *extra)
+
+
+def _lot_projection(
+    lots: pd.DataFrame, hospital: str, medications: list[str], demand: np.ndarray, month_num: int
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """On-hand lot stock and FEFO-projected waste over the target month.
+
+    *lots* is a ``fetch_lots`` frame. Returns None when it holds no lots for
+    *hospital*. Lots already expired by the start of the month count as
+    waste too.
+    """
+    lots = lots[lots["hospital"] == hospital]
+    if lots.empty:
         return None
+    index = pd.MultiIndex.from_product([[hospital], medications], names=SERIES_KEYS)
+    projection = project_waste(
+        lots, pd.DataFrame({0: np.maximum(demand, 0.0)}, index=index), next_month_start(month_num)
+    ).reindex(index)
+    return projection["on_hand"].to_numpy(), projection["projected_waste"].to_numpy()
+
+
+def _order_lines(
+    medications: list[str],
+    predictions: np.ndarray,
+    expiration_dates: Sequence[str | None],
+    current_stock: dict[str, int],
+    safety_buffer: float,
+    lot_view: tuple[np.ndarray, np.ndarray] | None,
+) -> list[dict]:
+    """Turn predicted demand into order lines, sorted by ``recommended_order`` (desc)."""
+    days_left = _days_left(expiration_dates)
+    at_risk = (days_left > 0) & (days_left <= EXPIRY_WARNING_DAYS)
+
+    results: list[dict] = []
+    for idx, med in enumerate(medications):
+        pred_demand = max(0.0, float(predictions[idx]))
+        waste = 0.0
+        if lot_view is None:
+            stock = current_stock.get(med, 0)
+        else:
+            stock = current_stock.get(med, int(lot_view[0][idx]))
+            waste = min(float(stock), float(lot_view[1][idx]))
+        buffered_demand = pred_demand * (1 + safety_buffer)
+        order_qty = max(0, math.ceil(buffered_demand - (stock - waste)))
+
+        warnings: list[str] = []
+
+        # Projected waste (lot-level FEFO)
+        if waste > 0:
+            warnings.append(f"projected_waste (~{waste:.0f} units expire unused)")
+
+        # Expiry risk
+        if at_risk[idx]:
+            warnings.append(
+                f"expiry_risk (batch expires {expiration_dates[idx]}, "
+                f"~{int(days_left[idx])}d left — approx)"
+            )
+
+        # Overstock risk
+        if stock > buffered_demand * (1 + OVERSTOCK_MARGIN):
+            warnings.append(
+                f"overstock_risk (stock {stock} >> buffered demand {buffered_demand:.0f})"
+            )
+
+        results.append(
+            {
+                "medication": med,
+                "predicted_demand": round(pred_demand, 1),
+                "recommended_order": order_qty,
+                "current_stock": stock,
+                "projected_waste": round(waste, 1),
+                "safety_buffer": safety_buffer,
+                "warnings": warnings,
+            }
+        )
+
+    # Sort by recommended_order descending
+    results.sort(key=lambda r: r["recommended_order"], reverse=True)
+    return results
 
 
 # ── Public API ───────────────────────────────────────────────────────
@@ -147,6 +515,8 @@ def recommend_orders(
     safety_buffer: float = DEFAULT_SAFETY_BUFFER,
     model_dir: str | None = None,
     db_path: str | None = None,
+    hospital: str | None = None,
+    use_cache: bool = True,
 ) -> list[dict]:
     """Generate order recommendations for *next_month*.
 
@@ -162,77 +532,285 @@ def recommend_orders(
         Path to saved model artifacts.
     db_path : str | None
         Path to SQLite database.
+    hospital : str | None
+        Hospital whose history and stock are used (default ``DEFAULT_HOSPITAL``).
+    use_cache : bool
+        Reuse cached demand predictions (see ``get_prediction_cache``).
+        Only the stock arithmetic is redone when *current_stock* or
+        *safety_buffer* change.
 
     Returns
     -------
     list[dict]
         Sorted (desc) by ``recommended_order``. Each dict has keys:
-        medication, predicted_demand, recommended_order, current_stock, warnings.
+        medication, predicted_demand, recommended_order, current_stock,
+        projected_waste, safety_buffer, warnings.
     """
     month_num = month_name_to_num(next_month)
+    hospital = (hospital or DEFAULT_HOSPITAL).upper()
 
-    model, feature_cols = _load_model(model_dir)
     conn = get_connection(db_path)
 
     try:
-        # Discover medications from DB
-        med_rows = conn.execute(
-            "SELECT DISTINCT medication FROM orders ORDER BY medication"
-        ).fetchall()
-        medications = [r["medication"] for r in med_rows]
-
-        if not medications:
-            raise RuntimeError("No medications found in DB — run ingestion first.")
+        medications = _hospital_medications(conn, hospital)
+        routes = _route_models(model_dir, hospital, medications)
+        key = _prediction_key(_orders_watermark(conn), db_path, hospital, month_num, routes)
+        cached = _prediction_cache.get(key) if use_cache else None
+        if cached is None:
+            ensure_feature_store(conn)
+            predictions = _predict_demand(
+                conn, month_num, medications, model_dir, hospital, routes
+            )
+            predictions.setflags(write=False)
+            expiry = _expiry_batch(conn, hospital).reindex(medications)
+            cached = (predictions, tuple(expiry["expiration_date"]))
+            if use_cache:
+                _prediction_cache.put(key, cached)
+        predictions, expiration_dates = cached
+        lots = fetch_lots(conn, hospital)
+    finally:
+        conn.close()
 
-        inf_df = _build_inference_features(conn, month_num, medications, feature_cols)
+    lot_view = _lot_projection(lots, hospital, medications, predictions, month_num)
+    return _order_lines(
+        medications, predictions, expiration_dates, current_stock, safety_buffer, lot_view
+    )
 
-        X = inf_df[feature_cols].values
-        predictions = model.predict(X)
 
-        results: list[dict] = []
-        for idx, med in enumerate(medications):
-            pred_demand = max(0.0, float(predictions[idx]))
-            stock = current_stock.get(med, 0)
-            buffered_demand = pred_demand * (1 + safety_buffer)
-            order_qty = max(0, math.ceil(buffered_demand - stock))
+def recommend_orders_batch(
+    requests: list[dict],
+    model_dir: str | None = None,
+    db_path: str | None = None,
+    use_cache: bool = True,
+) -> list[dict]:
+    """Recommend orders for many hospitals in one pass.
 
-            warnings: list[str] = []
+    Each request is a dict with ``hospital`` and ``next_month`` plus the
+    optional ``current_stock`` and ``safety_buffer`` of ``recommend_orders``.
+    History, expiry dates and lots are read with one query each for all
+    hospitals, and the feature rows of every request are stacked so each
+    model runs a single ``predict``. Requests sharing a hospital and month
+    are scored once.
 
-            # Expiry risk
-            exp_info = _expiry_info(conn, med)
-            if exp_info and 0 < exp_info["days_left"] <= EXPIRY_WARNING_DAYS:
-                warnings.append(
-                    f"expiry_risk (batch expires {exp_info['expiration_date']}, "
-                    f"~{exp_info['days_left']}d left — approx)"
-                )
+    Returns one dict per request, in order, with keys hospital, month,
+    safety_buffer and recommendations (as returned by ``recommend_orders``).
+    """
+    specs = []
+    for req in requests:
+        month = req.get("next_month") or req.get("month")
+        if not month:
+            raise ValueError(f"Batch request is missing 'next_month': {req!r}")
+        specs.append(
+            (
+                (req.get("hospital") or DEFAULT_HOSPITAL).upper(),
+                month_name_to_num(month),
+                month,
+                req.get("current_stock") or {},
+                req.get("safety_buffer", DEFAULT_SAFETY_BUFFER),
+            )
+        )
+    if not specs:
+        return []
+    hospitals = sorted({spec[0] for spec in specs})
 
-            # Overstock risk
-            if stock > buffered_demand * (1 + OVERSTOCK_MARGIN):
-                warnings.append(
-                    f"overstock_risk (stock {stock} >> buffered demand {buffered_demand:.0f})"
+    conn = get_connection(db_path)
+    try:
+        med_lists: dict[str, list[str]] = {h: [] for h in hospitals}
+        for r in conn.execute(
+            f"""
+            SELECT DISTINCT hospital, medication FROM orders
+            WHERE hospital IN ({", ".join("?" * len(hospitals))})
+            ORDER BY hospital, medication
+            """,
+            hospitals,
+        ):
+            med_lists[r["hospital"]].append(r["medication"])
+        for h, meds in med_lists.items():
+            if not meds:
+                raise UnknownHospitalError(
+                    f"No medications found for hospital '{h}' — run ingestion first."
                 )
 
-            results.append(
-                {
-                    "medication": med,
-                    "predicted_demand": round(pred_demand, 1),
-                    "recommended_order": order_qty,
-                    "current_stock": stock,
-                    "safety_buffer": safety_buffer,
-                    "warnings": warnings,
-                }
+        routes = {h: _route_models(model_dir, h, med_lists[h]) for h in hospitals}
+        watermark = _orders_watermark(conn)
+        keys = [
+            _prediction_key(watermark, db_path, h, month_num, routes[h])
+            for h, month_num, *_ in specs
+        ]
+        demand: dict[Hashable, tuple] = {}
+        pending: dict[Hashable, tuple[str, int]] = {}
+        for key, (h, month_num, *_) in zip(keys, specs):
+            if key in demand or key in pending:
+                continue
+            cached = _prediction_cache.get(key) if use_cache else None
+            if cached is None:
+                pending[key] = (h, month_num)
+            else:
+                demand[key] = cached
+
+        if pending:
+            ensure_feature_store(conn)
+            pending_hospitals = sorted({h for h, _ in pending.values()})
+            depth = max(
+                _history_depth(loaded.feature_cols)
+                for h in pending_hospitals
+                for loaded, _ in routes[h]
             )
-
-        # Sort by recommended_order descending
-        results.sort(key=lambda r: r["recommended_order"], reverse=True)
+            history = _fetch_recent_history(conn, depth, pending_hospitals)
+            expiry = _expiry_batch(conn, pending_hospitals)["expiration_date"]
+            scored = _predict_stacked(
+                history,
+                [
+                    (key, h, month_num, med_lists[h], routes[h])
+                    for key, (h, month_num) in pending.items()
+                ],
+            )
+            for key, (h, _) in pending.items():
+                predictions = scored[key]
+                predictions.setflags(write=False)
+                dates = expiry.reindex(pd.MultiIndex.from_product([[h], med_lists[h]]))
+                demand[key] = (predictions, tuple(dates))
+                if use_cache:
+                    _prediction_cache.put(key, demand[key])
+
+        lots = fetch_lots(conn)
     finally:
         conn.close()
 
+    results = []
+    for key, (hospital, month_num, month, current_stock, safety_buffer) in zip(keys, specs):
+        predictions, expiration_dates = demand[key]
+        medications = med_lists[hospital]
+        lot_view = _lot_projection(lots, hospital, medications, predictions, month_num)
+        results.append(
+            {
+                "hospital": hospital,
+                "month": month,
+                "safety_buffer": safety_buffer,
+                "recommendations": _order_lines(
+                    medications,
+                    predictions,
+                    expiration_dates,
+                    current_stock,
+                    safety_buffer,
+                    lot_view,
+                ),
+            }
+        )
     return results
 
 
+def forecast_horizon(
+    start_month: str,
+    months: int = 6,
+    model_dir: str | None = None,
+    db_path: str | None = None,
+    hospital: str | None = None,
+    use_cache: bool = True,
+) -> list[dict]:
+    """Forecast monthly demand for *months* months starting at *start_month*.
+
+    Lag and rolling features are rolled forward recursively from the
+    predictions, and all medications are scored together at every step.
+    Partition manifests and the prediction cache are shared with
+    ``recommend_orders``.
+
+    Returns one dict per medication (alphabetical) with keys:
+        medication, months (names), periods (YYYY-MM), predicted_demand
+        (list), total.
+    """
+    if months < 1:
+        raise ValueError(f"months must be >= 1, got {months}")
+    month_num = month_name_to_num(start_month)
+    hospital = (hospital or DEFAULT_HOSPITAL).upper()
+
+    conn = get_connection(db_path)
+    try:
+        medications = _hospital_medications(conn, hospital)
+        routes = _route_models(model_dir, hospital, medications)
+        key = _prediction_key(
+            _orders_watermark(conn), db_path, hospital, month_num, routes, "horizon", months
+        )
+        forecast = _prediction_cache.get(key) if use_cache else None
+        if forecast is None:
+            ensure_feature_store(conn)
+            depth = max(_history_depth(loaded.feature_cols) for loaded, _ in routes)
+            history = _fetch_recent_history(conn, depth, hospital)
+    finally:
+        conn.close()
+
+    if forecast is None:
+        forecast = np.empty((len(medications), months), dtype=np.float64)
+        for loaded, idx in routes:
+            forecast[idx] = _forecast_steps(
+                loaded, history, [medications[i] for i in idx], month_num, months
+            )
+        forecast.setflags(write=False)
+        if use_cache:
+            _prediction_cache.put(key, forecast)
+
+    names = [MONTH_NAMES[(month_num - 1 + k) % 12] for k in range(months)]
+    first = next_month_start(month_num).strftime("%Y-%m")
+    periods = [shift_period(first, k) for k in range(months)]
+    return [
+        {
+            "medication": med,
+            "months": names,
+            "periods": periods,
+            "predicted_demand": [round(float(v), 1) for v in forecast[i]],
+            "total": round(float(forecast[i].sum()), 1),
+        }
+        for i, med in enumerate(medications)
+    ]
+
+
+def get_prediction_cache() -> LRUCache:
+    """Return the process-wide demand prediction cache (for stats or clearing)."""
+    return _prediction_cache
+
+
 # ── CLI ──────────────────────────────────────────────────────────────
 
+def _print_horizon(forecast: list[dict]) -> None:
+    names = forecast[0]["months"]
+    print(f"\n{'='*72}")
+    print(f"  CHARM AI Copilot — {len(names)}-month demand forecast from {names[0]}")
+    print(f"{'='*72}\n")
+    print(f"  {'medication':<32s}" + "".join(f"{n[:3]:>8s}" for n in names) + f"{'total':>10s}")
+    for r in forecast:
+        print(
+            f"  {r['medication'][:32]:<32s}"
+            + "".join(f"{v:>8.0f}" for v in r["predicted_demand"])
+            + f"{r['total']:>10.0f}"
+        )
+    print(f"\n{'='*72}\n")
+
+
+def _print_recommendations(
+    recs: list[dict], month: str, safety: float, hospital: str | None = None
+) -> None:
+    title = f"Order Recommendations for {month}"
+    if hospital:
+        title += f" — hospital {hospital}"
+    print(f"\n{'='*72}")
+    print(f"  CHARM AI Copilot — {title}")
+    print(f"{'='*72}\n")
+
+    for i, r in enumerate(recs, 1):
+        warn_str = ", ".join(r["warnings"]) if r["warnings"] else "—"
+        print(
+            f"  {i:>2}. {r['medication']:<40s} "
+            f"demand={r['predicted_demand']:>8.1f}  "
+            f"stock={r['current_stock']:>5d}  "
+            f"ORDER → {r['recommended_order']:>5d}  "
+            f"⚠ {warn_str}"
+        )
+
+    print(f"\n{'='*72}")
+    print(f"  Safety buffer: {safety:.0%}  |  Medications: {len(recs)}")
+    print(f"{'='*72}\n")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         prog="charm.copilot",
@@ -245,8 +823,15 @@ def main() -> None:
     )
     parser.add_argument(
         "--stock-json",
-        required=True,
-        help="Path to JSON file mapping medication → current stock quantity.",
+        default=None,
+        help="Path to JSON file mapping medication → current stock quantity "
+             "(required unless --horizon or --stock-dir is given).",
+    )
+    parser.add_argument(
+        "--stock-dir",
+        default=None,
+        help="Directory of <hospital>.json stock files; recommends for every "
+             "hospital in one batch.",
     )
     parser.add_argument(
         "--safety",
@@ -264,8 +849,49 @@ def main() -> None:
         default=None,
         help="Path to SQLite database.",
     )
+    parser.add_argument(
+        "--hospital",
+        default=None,
+        help=f"Hospital code to recommend for (default: {DEFAULT_HOSPITAL}).",
+    )
+    parser.add_argument(
+        "--horizon",
+        type=int,
+        default=None,
+        help="Print an N-month demand forecast starting at --month instead of orders.",
+    )
     args = parser.parse_args()
 
+    if args.horizon:
+        _print_horizon(
+            forecast_horizon(
+                args.month, args.horizon, args.model_dir, args.db, hospital=args.hospital
+            )
+        )
+        return
+    if args.stock_dir is not None:
+        stock_files = sorted(Path(args.stock_dir).glob("*.json"))
+        if not stock_files:
+            raise FileNotFoundError(f"No <hospital>.json files in {args.stock_dir}")
+        requests = []
+        for path in stock_files:
+            with open(path) as f:
+                requests.append(
+                    {
+                        "hospital": path.stem,
+                        "next_month": args.month,
+                        "current_stock": json.load(f),
+                        "safety_buffer": args.safety,
+                    }
+                )
+        for batch in recommend_orders_batch(requests, args.model_dir, args.db):
+            _print_recommendations(
+                batch["recommendations"], args.month, args.safety, batch["hospital"]
+            )
+        return
+    if args.stock_json is None:
+        parser.error("--stock-json is required unless --horizon or --stock-dir is given")
+
     # Load current stock
     stock_path = Path(args.stock_json)
     if not stock_path.exists():
@@ -279,26 +905,10 @@ def main() -> None:
         safety_buffer=args.safety,
         model_dir=args.model_dir,
         db_path=args.db,
+        hospital=args.hospital,
     )
 
-    # Pretty-print
-    print(f"\n{'='*72}")
-    print(f"  CHARM AI Copilot — Order Recommendations for {args.month}")
-    print(f"{'='*72}\n")
-
-    for i, r in enumerate(recs, 1):
-        warn_str = ", ".join(r["warnings"]) if r["warnings"] else "—"
-        print(
-            f"  {i:>2}. {r['medication']:<40s} "
-            f"demand={r['predicted_demand']:>8.1f}  "
-            f"stock={r['current_stock']:>5d}  "
-            f"ORDER → {r['recommended_order']:>5d}  "
-            f"⚠ {warn_str}"
-        )
-
-    print(f"\n{'='*72}")
-    print(f"  Safety buffer: {args.safety:.0%}  |  Medications: {len(recs)}")
-    print(f"{'='*72}\n")
+    _print_recommendations(recs, args.month, args.safety, args.hospital)
 
 
 if __name__ == "__main__":
@@ -6,9 +6,13 @@ from __future__ import annotations
 
 import argparse
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
 
-from charm.config import DB_PATH
+from charm.config import DB_PATH, DEFAULT_HOSPITAL
+from charm.storage import sqlite_connection
 from charm.utils import setup_logging
 
 logger = setup_logging()
@@ -20,8 +24,10 @@ CREATE TABLE IF NOT EXISTS orders (
     id                    INTEGER PRIMARY KEY AUTOINCREMENT,
     source_file           TEXT,
     row_hash              TEXT UNIQUE,
+    hospital              TEXT    NOT NULL DEFAULT '{hospital}',
     order_month           TEXT    NOT NULL,
     month_num             INTEGER NOT NULL,
+    period                TEXT,
     medication            TEXT    NOT NULL,
     quantity              INTEGER NOT NULL,
     purchase_date         TEXT    NOT NULL,
@@ -29,41 +35,269 @@ CREATE TABLE IF NOT EXISTS orders (
     quantity_used         INTEGER NOT NULL,
     avg_daily_consumption REAL    NOT NULL
 );
+""".format(hospital=DEFAULT_HOSPITAL)
+
+CREATE_CHECKPOINTS_TABLE = """
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    source_path  TEXT PRIMARY KEY,
+    fingerprint  TEXT    NOT NULL,
+    rows_done    INTEGER NOT NULL,
+    chunks_done  INTEGER NOT NULL,
+    inserted     INTEGER NOT NULL,
+    skipped      INTEGER NOT NULL,
+    rejected     INTEGER NOT NULL,
+    updated_at   TEXT    NOT NULL
+);
+"""
+
+CREATE_FEATURES_TABLE = """
+CREATE TABLE IF NOT EXISTS features (
+    order_id              INTEGER PRIMARY KEY
+                          REFERENCES orders (id) ON DELETE CASCADE,
+    hospital              TEXT    NOT NULL DEFAULT '{hospital}',
+    medication            TEXT    NOT NULL,
+    month_num             INTEGER NOT NULL,
+    period                TEXT,
+    quantity              INTEGER NOT NULL,
+    quantity_used         INTEGER NOT NULL,
+    avg_daily_consumption REAL    NOT NULL,
+    lag_1_used            REAL    NOT NULL,
+    lag_1_ordered         REAL    NOT NULL,
+    rolling_mean_3_used   REAL    NOT NULL
+);
+""".format(hospital=DEFAULT_HOSPITAL)
+
+# (hospital, medication) series whose feature rows are out of date from
+# period ``since`` onwards; kept by the triggers below, drained by
+# charm.features.refresh_feature_store.
+CREATE_FEATURE_DIRTY_TABLE = """
+CREATE TABLE IF NOT EXISTS feature_dirty (
+    hospital              TEXT    NOT NULL,
+    medication            TEXT    NOT NULL,
+    since                 TEXT    NOT NULL,
+    PRIMARY KEY (hospital, medication)
+);
+"""
+
+# Bumped on every change to ``orders`` (see the triggers below). Part of
+# the charm.copilot prediction-cache key, so in-place updates of an order
+# invalidate cached predictions too, across processes.
+CREATE_ORDERS_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS orders_version (
+    id                    INTEGER PRIMARY KEY CHECK (id = 1),
+    version               INTEGER NOT NULL
+);
+"""
+
+SEED_ORDERS_VERSION = "INSERT OR IGNORE INTO orders_version (id, version) VALUES (1, 0);"
+
+CREATE_LOTS_TABLE = """
+CREATE TABLE IF NOT EXISTS lots (
+    id                    INTEGER PRIMARY KEY AUTOINCREMENT,
+    hospital              TEXT    NOT NULL DEFAULT '{hospital}',
+    medication            TEXT    NOT NULL,
+    quantity              INTEGER NOT NULL CHECK (quantity >= 0),
+    expiration_date       TEXT    NOT NULL,
+    received_date         TEXT
+);
+""".format(hospital=DEFAULT_HOSPITAL)
+
+
+
+def period_sql(row: str = "") -> str:
+    """SQL expression for an order's ``YYYY-MM`` period (see ``utils.order_period``).
+
+    *row* prefixes the column names, e.g. ``"NEW."`` inside a trigger.
+    """
+    purchase_month = f"CAST(substr({row}purchase_date, 6, 2) AS INTEGER)"
+    return (
+        f"printf('%04d-%02d', CAST(substr({row}purchase_date, 1, 4) AS INTEGER) + CASE "
+        f"WHEN {row}month_num - {purchase_month} > 6 THEN -1 "
+        f"WHEN {row}month_num - {purchase_month} < -6 THEN 1 ELSE 0 END, {row}month_num)"
+    )
+
+
+# Columns added after the first release: (table, column, definition, backfill).
+# Existing rows predate multi-hospital support and belong to the default;
+# periods are derived from purchase_date.
+MIGRATIONS = [
+    ("orders", "hospital", f"TEXT NOT NULL DEFAULT '{DEFAULT_HOSPITAL}'", None),
+    ("features", "hospital", f"TEXT NOT NULL DEFAULT '{DEFAULT_HOSPITAL}'", None),
+    (
+        "orders",
+        "period",
+        "TEXT",
+        f"UPDATE orders SET period = {period_sql()} WHERE period IS NULL;",
+    ),
+    (
+        "features",
+        "period",
+        "TEXT",
+        "UPDATE features SET period = "
+        "(SELECT o.period FROM orders AS o WHERE o.id = features.order_id) "
+        "WHERE period IS NULL;",
+    ),
+]
+
+
+def _mark_dirty_sql(row: str, when: str = "true") -> str:
+    """Trigger statement marking *row*'s series dirty from its period on.
+
+    A row without a period marks the whole series ('' sorts first).
+    """
+    return (
+        "INSERT INTO feature_dirty (hospital, medication, since) "
+        f"SELECT {row}hospital, {row}medication, COALESCE({row}period, '') WHERE {when} "
+        "ON CONFLICT (hospital, medication) DO UPDATE SET since = MIN(since, excluded.since);"
+    )
+
+
+# Rows inserted without a period (raw SQL, older import scripts) get one.
+# Inserts, feature-relevant updates and deletes mark their series dirty,
+# from the earliest period they touch; the period backfill above counts
+# as the insert of a period-less row. Every change bumps orders_version.
+CREATE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS trg_orders_period AFTER INSERT ON orders "
+    "WHEN NEW.period IS NULL BEGIN "
+    f"UPDATE orders SET period = {period_sql('NEW.')} WHERE id = NEW.id; END;",
+    "CREATE TRIGGER IF NOT EXISTS trg_orders_dirty_insert AFTER INSERT ON orders "
+    f"WHEN NEW.period IS NOT NULL BEGIN {_mark_dirty_sql('NEW.')} END;",
+    "CREATE TRIGGER IF NOT EXISTS trg_orders_dirty_update AFTER UPDATE OF "
+    "hospital, medication, month_num, period, quantity, quantity_used, "
+    "avg_daily_consumption ON orders BEGIN "
+    f"{_mark_dirty_sql('OLD.', 'OLD.period IS NOT NULL')} {_mark_dirty_sql('NEW.')} END;",
+    "CREATE TRIGGER IF NOT EXISTS trg_orders_dirty_delete AFTER DELETE ON orders BEGIN "
+    f"{_mark_dirty_sql('OLD.')} END;",
+    *(
+        f"CREATE TRIGGER IF NOT EXISTS trg_orders_version_{event.lower()} AFTER {event} "
+        "ON orders BEGIN UPDATE orders_version SET version = version + 1 WHERE id = 1; END;"
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ),
+]
+
+# A database created before feature_dirty existed: mark every series with
+# orders not yet in the store (a one-off anti-join).
+SEED_FEATURE_DIRTY = """
+INSERT OR IGNORE INTO feature_dirty (hospital, medication, since)
+SELECT o.hospital, o.medication, MIN(COALESCE(o.period, ''))
+FROM orders AS o
+LEFT JOIN features AS f ON f.order_id = o.id
+WHERE f.order_id IS NULL
+GROUP BY o.hospital, o.medication
 """
 
+# Superseded by the period-keyed indexes below.
+DROP_INDEXES = [
+    "DROP INDEX IF EXISTS idx_features_med_month;",
+    "DROP INDEX IF EXISTS idx_features_hospital_med_month;",
+    "DROP INDEX IF EXISTS idx_orders_hospital_med_month_exp;",
+]
+
 CREATE_INDEXES = [
     "CREATE INDEX IF NOT EXISTS idx_orders_medication_purchase_date "
     "ON orders (medication, purchase_date);",
     "CREATE INDEX IF NOT EXISTS idx_orders_month_med "
     "ON orders (month_num, medication);",
+    "CREATE INDEX IF NOT EXISTS idx_orders_period "
+    "ON orders (period);",
+    # Covers the per-request expiry lookup in charm.copilot (no table reads).
+    "CREATE INDEX IF NOT EXISTS idx_orders_hospital_med_period_exp "
+    "ON orders (hospital, medication, period, expiration_date);",
+    "CREATE INDEX IF NOT EXISTS idx_features_hospital_med_period "
+    "ON features (hospital, medication, period);",
+    "CREATE INDEX IF NOT EXISTS idx_features_period "
+    "ON features (period);",
+    "CREATE INDEX IF NOT EXISTS idx_lots_hospital_med_expiry "
+    "ON lots (hospital, medication, expiration_date);",
 ]
 
 
 # ── Public API ───────────────────────────────────────────────────────
 
+_schema_ready: set[str] = set()
+_schema_lock = threading.Lock()
+
+
+def _schema_key(db_path: str | None) -> str:
+    return str(Path(db_path or DB_PATH).resolve())
+
+
 def get_connection(db_path: str | None = None) -> sqlite3.Connection:
-    """Return a SQLite connection (WAL mode, foreign keys on)."""
-    path = db_path or DB_PATH
-    conn = sqlite3.connect(path)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA foreign_keys=ON;")
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return a SQLite connection (WAL mode, foreign keys on).
+
+    Connections are reused per thread (see ``charm.storage``); ``close()``
+    hands the connection back rather than closing it. The first connection
+    to a database in a process runs ``init_db``, so databases created by
+    older versions are migrated without a manual ``python -m charm.db init``.
+    """
+    if (db_path or DB_PATH) != ":memory:" and _schema_key(db_path) not in _schema_ready:
+        with _schema_lock:
+            if _schema_key(db_path) not in _schema_ready:
+                init_db(db_path)
+    return sqlite_connection(db_path)
+
+
+def _apply_migrations(conn: sqlite3.Connection) -> None:
+    """Add columns introduced after a database was first created."""
+    for table, column, definition, backfill in MIGRATIONS:
+        existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table});")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+            if backfill:
+                conn.execute(backfill)
+            logger.info("Migrated %s: added column '%s'.", table, column)
 
 
 def init_db(db_path: str | None = None) -> None:
-    """Create tables and indexes (idempotent)."""
-    conn = get_connection(db_path)
+    """Create tables and indexes and apply migrations (idempotent)."""
+    conn = sqlite_connection(db_path)
     try:
         conn.execute(CREATE_ORDERS_TABLE)
-        for idx_sql in CREATE_INDEXES:
-            conn.execute(idx_sql)
+        conn.execute(CREATE_CHECKPOINTS_TABLE)
+        conn.execute(CREATE_FEATURES_TABLE)
+        conn.execute(CREATE_LOTS_TABLE)
+        seed_dirty = not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'feature_dirty'"
+        ).fetchone()
+        conn.execute(CREATE_FEATURE_DIRTY_TABLE)
+        conn.execute(CREATE_ORDERS_VERSION_TABLE)
+        conn.execute(SEED_ORDERS_VERSION)
+        _apply_migrations(conn)
+        if seed_dirty:
+            conn.execute(SEED_FEATURE_DIRTY)
+        for sql in (*CREATE_TRIGGERS, *DROP_INDEXES, *CREATE_INDEXES):
+            conn.execute(sql)
         conn.commit()
+        _schema_ready.add(_schema_key(db_path))
         logger.info("Database initialised at %s", db_path or DB_PATH)
     finally:
         conn.close()
 
 
+@contextmanager
+def bulk_load_pragmas(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Temporarily tune *conn* for large loads, restoring settings afterwards.
+
+    WAL + ``synchronous=NORMAL`` is still crash-safe for the database file;
+    a larger page cache and in-memory temp store speed up staging tables.
+    """
+    tuned = {
+        "synchronous": "NORMAL",
+        "cache_size": "-65536",  # 64 MiB
+        "temp_store": "MEMORY",
+    }
+    previous = {
+        name: conn.execute(f"PRAGMA {name};").fetchone()[0] for name in tuned
+    }
+    for name, value in tuned.items():
+        conn.execute(f"PRAGMA {name}={value};")
+    try:
+        yield conn
+    finally:
+        for name, value in previous.items():
+            conn.execute(f"PRAGMA {name}={value};")
+
+
 # ── CLI ──────────────────────────────────────────────────────────────
 
 def main() -> None:
@@ -0,0 +1,102 @@
+"""
+CHARM Copilot medication encoders.
+
+The model sees a block of numeric base features followed by a medication
+encoding. Three encodings are supported:
+
+- ``onehot``  — dense ``med_<name>`` indicator columns (the original layout)
+- ``sparse``  — the same columns as a ``scipy.sparse`` CSR matrix
+- ``ordinal`` — a single ``medication_code`` column (index into the sorted
+  training medications; NaN when unseen), usable as a native categorical
+  feature by HistGradientBoostingRegressor
+
+The chosen encoding and its categories are saved in ``model_meta.json`` next
+to the model, so inference rebuilds the exact training layout.
+"""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+ENCODINGS = ("onehot", "sparse", "ordinal")
+DEFAULT_ENCODING = "onehot"
+MEDICATION_CODE_COLUMN = "medication_code"
+
+
+def check_encoding(encoding: str) -> str:
+    """Return *encoding* or raise ValueError if it is not supported."""
+    if encoding not in ENCODINGS:
+        raise ValueError(
+            f"Unknown encoding '{encoding}'. Valid encodings: {', '.join(ENCODINGS)}"
+        )
+    return encoding
+
+
+def feature_columns(
+    base_cols: Sequence[str],
+    medications: Sequence[str],
+    encoding: str = DEFAULT_ENCODING,
+) -> list[str]:
+    """Return the full ordered feature column list for *encoding*."""
+    check_encoding(encoding)
+    if encoding == "ordinal":
+        return [*base_cols, MEDICATION_CODE_COLUMN]
+    return [*base_cols, *sorted(f"med_{m}" for m in set(medications))]
+
+
+def base_columns(feature_cols: Sequence[str]) -> list[str]:
+    """Return the numeric (non-medication) prefix of *feature_cols*."""
+    return [
+        c for c in feature_cols
+        if not c.startswith("med_") and c != MEDICATION_CODE_COLUMN
+    ]
+
+
+def encode(
+    base: np.ndarray,
+    medications: Sequence[str],
+    feature_cols: Sequence[str],
+    encoding: str = DEFAULT_ENCODING,
+    categories: Sequence[str] | None = None,
+    col_index: dict[str, int] | None = None,
+) -> np.ndarray | sparse.csr_matrix:
+    """Assemble the model matrix from *base* features and medication names.
+
+    *base* holds the base columns in ``base_columns(feature_cols)`` order.
+    Unknown medications get an all-zero indicator block (one-hot/sparse)
+    or a NaN code (ordinal).
+    """
+    check_encoding(encoding)
+    n, n_base = base.shape
+
+    if encoding == "ordinal":
+        X = np.empty((n, n_base + 1), dtype=np.float64)
+        X[:, :n_base] = base
+        codes = pd.Index(categories or []).get_indexer(medications).astype(np.float64)
+        codes[codes < 0] = np.nan
+        X[:, n_base] = codes
+        return X
+
+    if col_index is None:
+        col_index = {c: i for i, c in enumerate(feature_cols)}
+    med_cols = np.array(
+        [col_index.get(f"med_{m}", -1) for m in medications], dtype=np.intp
+    )
+    rows = np.flatnonzero(med_cols >= 0)
+    cols = med_cols[rows]
+
+    if encoding == "sparse":
+        indicators = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols - n_base)),
+            shape=(n, len(feature_cols) - n_base),
+        )
+        return sparse.hstack([sparse.csr_matrix(base), indicators], format="csr")
+
+    X = np.zeros((n, len(feature_cols)), dtype=np.float64)
+    X[:, :n_base] = base
+    X[rows, cols] = 1.0
+    return X
@@ -2,73 +2,349 @@
 CHARM Copilot feature engineering.
 
 Builds a training-ready DataFrame from the orders table with:
-- month_num
+- month_num (series are ordered by ``period``, the order's YYYY-MM)
 - lag_1_used, lag_1_ordered
 - rolling_mean_3_used
 - avg_daily_consumption
 - medication one-hot columns
+
+Lag and rolling features are persisted in the ``features`` table (the
+feature store) and refreshed incrementally: only (hospital, medication)
+series with inserted, updated or deleted order rows are recomputed, from
+the earliest period touched onwards. Triggers on ``orders`` record those
+series in ``feature_dirty`` (see ``charm.db``), so neither the staleness
+check nor the refresh scans the order history.
 """
 
 from __future__ import annotations
 
+import re
 import sqlite3
+from typing import Sequence
 
+import numpy as np
 import pandas as pd
 
+from charm.config import DEFAULT_LAGS, DEFAULT_WINDOWS
 from charm.db import get_connection
 from charm.utils import setup_logging
 
 logger = setup_logging()
 
+SERIES_KEYS = ["hospital", "medication"]
+
+STORE_COLUMNS = [
+    "order_id",
+    "hospital",
+    "medication",
+    "month_num",
+    "period",
+    "quantity",
+    "quantity_used",
+    "avg_daily_consumption",
+    "lag_1_used",
+    "lag_1_ordered",
+    "rolling_mean_3_used",
+]
+
+
+# ── Vectorised lag / rolling kernels ─────────────────────────────────
+#
+# All kernels expect rows sorted so that each group is one contiguous
+# block in chronological order. Groups are located once from the key
+# boundaries; lags are plain shifted slices and rolling means are
+# differences of a single cumulative sum, so no Python runs per group.
+
+def group_bounds(df: pd.DataFrame, group_cols: Sequence[str]) -> np.ndarray:
+    """Return, for each row, the index of the first row of its group."""
+    n = len(df)
+    boundary = np.zeros(n, dtype=bool)
+    if n:
+        boundary[0] = True
+    for col in group_cols:
+        keys = df[col].to_numpy()
+        boundary[1:] |= keys[1:] != keys[:-1]
+    starts = np.flatnonzero(boundary)
+    return np.repeat(starts, np.diff(np.append(starts, n)))
+
+
+def grouped_lag(values: np.ndarray, group_start: np.ndarray, k: int) -> np.ndarray:
+    """Value *k* rows earlier within the same group (NaN where unavailable)."""
+    n = len(values)
+    out = np.full(n, np.nan)
+    if k < n:
+        out[k:] = values[: n - k]
+    out[np.arange(n) - group_start < k] = np.nan
+    return out
+
+
+def grouped_rolling_mean(
+    values: np.ndarray,
+    group_start: np.ndarray,
+    window: int,
+    shift: int = 1,
+) -> np.ndarray:
+    """Mean of up to *window* values ending *shift* rows back, per group.
+
+    Equivalent to ``s.shift(shift).rolling(window, min_periods=1).mean()``
+    within each group. Integer inputs are summed exactly in int64.
+    """
+    n = len(values)
+    acc = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+    csum = np.zeros(n + 1, dtype=acc)
+    np.cumsum(values, dtype=acc, out=csum[1:])
+
+    hi = np.arange(n) - shift + 1  # exclusive end of the window
+    lo = np.maximum(hi - window, group_start)
+    count = hi - lo
+    valid = count > 0
+    out = np.full(n, np.nan)
+    out[valid] = (csum[hi[valid]] - csum[lo[valid]]) / count[valid]
+    return out
+
+
+def lag_feature_names(
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+) -> list[str]:
+    """Names of the lag/rolling feature columns for a lag/window set."""
+    names: list[str] = []
+    for k in sorted(lags):
+        names += [f"lag_{k}_used", f"lag_{k}_ordered"]
+    names += [f"rolling_mean_{w}_used" for w in sorted(windows)]
+    return names
+
+
+def parse_lag_spec(columns: Sequence[str]) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """Recover the (lags, windows) set from feature column names."""
+    lags = sorted(
+        int(m.group(1)) for c in columns if (m := re.fullmatch(r"lag_(\d+)_used", c))
+    )
+    windows = sorted(
+        int(m.group(1)) for c in columns if (m := re.fullmatch(r"rolling_mean_(\d+)_used", c))
+    )
+    return tuple(lags), tuple(windows)
+
+
+def add_lag_features(
+    df: pd.DataFrame,
+    group_cols: Sequence[str] = ("medication",),
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+) -> pd.DataFrame:
+    """Add lag_<k>_used/ordered and rolling_mean_<w>_used columns to *df*.
+
+    *df* must be sorted by *group_cols* then chronologically. Missing lags
+    (a group's first rows) fall back to the row's own values.
+    """
+    group_start = group_bounds(df, group_cols)
+    used = df["quantity_used"].to_numpy()
+    ordered = df["quantity"].to_numpy()
+
+    new_cols: dict[str, np.ndarray] = {}
+    for k in sorted(lags):
+        lag_used = grouped_lag(used, group_start, k)
+        lag_ordered = grouped_lag(ordered, group_start, k)
+        new_cols[f"lag_{k}_used"] = np.where(np.isnan(lag_used), used, lag_used)
+        new_cols[f"lag_{k}_ordered"] = np.where(np.isnan(lag_ordered), ordered, lag_ordered)
+    for w in sorted(windows):
+        rolling = grouped_rolling_mean(used, group_start, w)
+        new_cols[f"rolling_mean_{w}_used"] = np.where(np.isnan(rolling), used, rolling)
+
+    return df.assign(**new_cols)
+
+
+def next_step_features(
+    used: np.ndarray,
+    ordered: np.ndarray,
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+) -> dict[str, np.ndarray]:
+    """Lag/rolling features for the step after the newest history column.
+
+    *used* and *ordered* are (n_series × depth) arrays with column 0 the
+    most recent observation and NaN where history is shorter. Mirrors the
+    training-time fill rules, using the newest value as the fallback.
+    """
+    depth = used.shape[1]
+    out: dict[str, np.ndarray] = {}
+    for k in sorted(lags):
+        lag_used = used[:, k - 1] if k <= depth else np.full(len(used), np.nan)
+        lag_ordered = ordered[:, k - 1] if k <= depth else np.full(len(used), np.nan)
+        out[f"lag_{k}_used"] = np.where(np.isnan(lag_used), used[:, 0], lag_used)
+        out[f"lag_{k}_ordered"] = np.where(np.isnan(lag_ordered), ordered[:, 0], lag_ordered)
+    for w in sorted(windows):
+        window = used[:, :w]
+        count = (~np.isnan(window)).sum(axis=1)
+        total = np.nansum(window, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"rolling_mean_{w}_used"] = np.where(count > 0, total / count, np.nan)
+    return out
+
+
+def _add_lag_features_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """Original pandas ``groupby().transform(lambda …)`` implementation.
+
+    Kept as the reference for ``python -m charm.bench features``.
+    """
+    by_med = df.groupby("medication")
+    df["lag_1_used"] = by_med["quantity_used"].shift(1)
+    df["lag_1_ordered"] = by_med["quantity"].shift(1)
+    df["rolling_mean_3_used"] = by_med["quantity_used"].transform(
+        lambda s: s.shift(1).rolling(window=3, min_periods=1).mean()
+    )
+    df["lag_1_used"] = df["lag_1_used"].fillna(df["quantity_used"])
+    df["lag_1_ordered"] = df["lag_1_ordered"].fillna(df["quantity"])
+    df["rolling_mean_3_used"] = df["rolling_mean_3_used"].fillna(df["quantity_used"])
+    return df
+
+
+def is_feature_store_stale(conn: sqlite3.Connection) -> bool:
+    """Cheap staleness check: is any series marked dirty since the last refresh?"""
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM feature_dirty)").fetchone()[0] == 1
+
+
+def refresh_feature_store(conn: sqlite3.Connection, max_series: int | None = None) -> int:
+    """Recompute store rows of the series marked in ``feature_dirty``.
+
+    Each dirty (hospital, medication) series is recomputed from its
+    ``since`` period onwards; untouched series are not read. With
+    *max_series*, only that many dirty series are handled (and unmarked),
+    bounding the history loaded at once. Returns the number of feature
+    rows written. The caller commits.
+    """
+    began = not conn.in_transaction
+    if began:
+        # Hold the write lock from reading the marks until the caller
+        # commits, so orders written meanwhile cannot lose their mark.
+        conn.execute("BEGIN IMMEDIATE")
+    # The write lock keeps this batch stable between the reads and the delete.
+    batch = "SELECT * FROM feature_dirty ORDER BY hospital, medication LIMIT ?"
+    limit = (-1 if max_series is None else max_series,)
+    dirty = conn.execute(f"SELECT COUNT(*) FROM ({batch})", limit).fetchone()[0]
+    if not dirty:
+        if began:
+            conn.rollback()
+        return 0
 
-def _load_orders(conn: sqlite3.Connection) -> pd.DataFrame:
-    """Load all rows from the orders table, sorted chronologically."""
     df = pd.read_sql_query(
-        "SELECT * FROM orders ORDER BY medication, month_num",
+        f"""
+        SELECT o.id AS order_id, o.hospital, o.medication, o.month_num, o.period,
+               o.quantity, o.quantity_used, o.avg_daily_consumption, d.since
+        FROM orders AS o
+        JOIN ({batch}) AS d
+          ON d.hospital = o.hospital AND d.medication = o.medication
+        ORDER BY o.hospital, o.medication, o.period, o.id
+        """,
         conn,
+        params=limit,
     )
-    return df
+    conn.execute(
+        f"DELETE FROM feature_dirty WHERE (hospital, medication) IN "
+        f"(SELECT hospital, medication FROM ({batch}))",
+        limit,
+    )
+
+    df = add_lag_features(df, group_cols=SERIES_KEYS)
+    df = df[df["period"] >= df["since"]]
+
+    conn.executemany(
+        f"""
+        INSERT OR REPLACE INTO features ({", ".join(STORE_COLUMNS)})
+        VALUES ({", ".join("?" for _ in STORE_COLUMNS)})
+        """,
+        list(zip(*(df[c].tolist() for c in STORE_COLUMNS))),
+    )
+    logger.info(
+        "Feature store refreshed: %d rows across %d series.",
+        len(df),
+        dirty,
+    )
+    return len(df)
+
+
+def ensure_feature_store(conn: sqlite3.Connection, max_series: int | None = None) -> None:
+    """Refresh the feature store if new orders arrived, committing the result.
+
+    With *max_series*, dirty series are refreshed and committed in batches
+    of that size instead of all at once.
+    """
+    while is_feature_store_stale(conn):
+        refresh_feature_store(conn, max_series)
+        conn.commit()
 
 
 def build_features(
     conn: sqlite3.Connection | None = None,
     db_path: str | None = None,
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+    one_hot: bool = True,
+    hospitals: Sequence[str] | None = None,
+    since: str | None = None,
+    until: str | None = None,
 ) -> pd.DataFrame:
     """Build the feature matrix for model training.
 
-    Returns a DataFrame with one row per (medication, month) and columns:
-        medication, month_num, quantity, quantity_used, avg_daily_consumption,
-        lag_1_used, lag_1_ordered, rolling_mean_3_used,
-        plus one-hot medication columns (med_<name>).
+    Returns a DataFrame with one row per (hospital, medication, period),
+    optionally restricted to *hospitals* and to periods in [*since*,
+    *until*] (``YYYY-MM``, inclusive), and columns:
+        hospital, medication, month_num, period, quantity, quantity_used, avg_daily_consumption,
+        lag_<k>_used, lag_<k>_ordered, rolling_mean_<w>_used,
+        plus one-hot medication columns (med_<name>) unless ``one_hot=False``
+        (see ``charm.encoding`` for the alternatives).
+
+    The default lag/window set is read from the feature store; other sets
+    are computed on the fly from the orders table.
     """
     own_conn = conn is None
     if own_conn:
         conn = get_connection(db_path)
 
+    custom = (tuple(sorted(lags)), tuple(sorted(windows))) != (DEFAULT_LAGS, DEFAULT_WINDOWS)
+    conditions, params = [], []
+    if hospitals:
+        conditions.append(f"hospital IN ({', '.join('?' for _ in hospitals)})")
+        params.extend(hospitals)
+    # Lags need earlier rows, so on-the-fly sets filter periods afterwards.
+    if not custom:
+        if since:
+            conditions.append("period >= ?")
+            params.append(since)
+        if until:
+            conditions.append("period <= ?")
+            params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
-        df = _load_orders(conn)
+        if custom:
+            df = pd.read_sql_query(
+                f"SELECT * FROM orders {where} ORDER BY hospital, medication, period, id",
+                conn,
+                params=params,
+            )
+        else:
+            ensure_feature_store(conn)
+            df = pd.read_sql_query(
+                f"SELECT * FROM features {where} "
+                "ORDER BY hospital, medication, period, order_id",
+                conn,
+                params=params,
+            )
     finally:
         if own_conn:
             conn.close()
 
     if df.empty:
         raise RuntimeError("No data in orders table — run ingestion first.")
+    if custom:
+        df = add_lag_features(df, group_cols=SERIES_KEYS, lags=lags, windows=windows)
+        if since or until:
+            keep = df["period"].between(since or "", until or "9999-99")
+            df = df[keep].reset_index(drop=True)
 
-    # Sort to guarantee chronological order within each medication
-    df = df.sort_values(["medication", "month_num"]).reset_index(drop=True)
-
-    # ── Lag & rolling features (per medication) ──────────────────────
-    df["lag_1_used"] = df.groupby("medication")["quantity_used"].shift(1)
-    df["lag_1_ordered"] = df.groupby("medication")["quantity"].shift(1)
-    df["rolling_mean_3_used"] = (
-        df.groupby("medication")["quantity_used"]
-        .transform(lambda s: s.shift(1).rolling(window=3, min_periods=1).mean())
-    )
-
-    # Fill NaN lags for the first month with the row's own values
-    df["lag_1_used"] = df["lag_1_used"].fillna(df["quantity_used"])
-    df["lag_1_ordered"] = df["lag_1_ordered"].fillna(df["quantity"])
-    df["rolling_mean_3_used"] = df["rolling_mean_3_used"].fillna(df["quantity_used"])
+    if not one_hot:
+        logger.info("Feature matrix built: %d rows × %d cols.", len(df), len(df.columns))
+        return df
 
     # ── One-hot encode medication ────────────────────────────────────
     med_dummies = pd.get_dummies(df["medication"], prefix="med")
@@ -84,14 +360,14 @@ def build_features(
     return df
 
 
+def get_base_feature_columns(df: pd.DataFrame) -> list[str]:
+    """Return the numeric feature columns (everything but the medication encoding)."""
+    lags, windows = parse_lag_spec(df.columns)
+    return ["month_num", *lag_feature_names(lags, windows), "avg_daily_consumption"]
+
+
 def get_feature_columns(df: pd.DataFrame) -> list[str]:
     """Return the list of feature column names (X columns) for the model."""
-    base_features = [
-        "month_num",
-        "lag_1_used",
-        "lag_1_ordered",
-        "rolling_mean_3_used",
-        "avg_daily_consumption",
-    ]
+    base_features = get_base_feature_columns(df)
     med_cols = [c for c in df.columns if c.startswith("med_")]
     return base_features + sorted(med_cols)
@@ -3,89 +3,389 @@ CHARM Copilot ingestion — CSV → validated → SQLite.
 
 CLI:
     python -m charm.ingest --csv data/nene_tereza_synthetic_orders_2025_with_consumption.csv
+    python -m charm.ingest --csv big_export.csv --mode stream --chunksize 100000
 """
 
 from __future__ import annotations
 
 import argparse
 import hashlib
+import sqlite3
+from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
 
-from charm.config import MONTH_NAME_TO_NUM
-from charm.db import get_connection, init_db
+from charm.config import (
+    DEFAULT_HOSPITAL,
+    FEATURE_REFRESH_SERIES,
+    INGEST_CHUNK_ROWS,
+    MONTH_NAME_TO_NUM,
+)
+from charm.db import bulk_load_pragmas, get_connection, init_db
+from charm.features import ensure_feature_store
 from charm.schema import validate_dataframe
 from charm.utils import setup_logging
 
 logger = setup_logging()
 
 
-def _row_hash(order_month: str, medication: str, purchase_date: str) -> str:
-    """Compute a SHA-256 hash of the natural key to ensure idempotency."""
+INGEST_MODES = ("bulk", "row", "stream")
+
+ORDER_COLUMNS = [
+    "source_file",
+    "row_hash",
+    "hospital",
+    "order_month",
+    "month_num",
+    "period",
+    "medication",
+    "quantity",
+    "purchase_date",
+    "expiration_date",
+    "quantity_used",
+    "avg_daily_consumption",
+]
+
+_INSERT_SQL = f"""
+INSERT INTO orders ({", ".join(ORDER_COLUMNS)})
+VALUES ({", ".join("?" for _ in ORDER_COLUMNS)})
+"""
+
+_CREATE_STAGING = f"""
+CREATE TEMP TABLE IF NOT EXISTS orders_staging (
+    {", ".join(ORDER_COLUMNS)}
+);
+"""
+
+# Columns declared NOT NULL on the orders table.
+_NOT_NULL_COLUMNS = [
+    c for c in ORDER_COLUMNS if c not in ("source_file", "row_hash", "period")
+]
+
+
+def _row_hash(
+    order_month: str,
+    medication: str,
+    purchase_date: str,
+    hospital: str = DEFAULT_HOSPITAL,
+) -> str:
+    """Compute a SHA-256 hash of the natural key to ensure idempotency.
+
+    Rows of the default hospital keep the original three-part key, so
+    databases created before multi-hospital support stay idempotent.
+    """
     key = f"{order_month}|{medication}|{purchase_date}"
+    if hospital != DEFAULT_HOSPITAL:
+        key += f"|{hospital}"
     return hashlib.sha256(key.encode()).hexdigest()
 
 
-def ingest_csv(csv_path: str, db_path: str | None = None) -> int:
+def _row_hashes(df: pd.DataFrame, hospitals: list[str]) -> list[str]:
+    """Column-wise equivalent of :func:`_row_hash` for a whole frame."""
+    keys = [
+        f"{m}|{med}|{pd_}" if h == DEFAULT_HOSPITAL else f"{m}|{med}|{pd_}|{h}"
+        for m, med, pd_, h in zip(
+            df["order_month"].tolist(),
+            df["medication"].tolist(),
+            df["purchase_date"].tolist(),
+            hospitals,
+        )
+    ]
+    return [hashlib.sha256(k.encode()).hexdigest() for k in keys]
+
+
+def _hospital_column(df: pd.DataFrame, hospital: str) -> list[str]:
+    """Per-row hospital codes: the CSV's ``hospital`` column, else *hospital*."""
+    if "hospital" in df.columns:
+        return df["hospital"].astype(str).str.strip().str.upper().tolist()
+    return [hospital] * len(df)
+
+
+def _periods(month_num: pd.Series, purchase_date: pd.Series) -> list[str | None]:
+    """Column-wise ``utils.order_period``; None where the date is unusable."""
+    purchase = purchase_date.astype(str)
+    year = pd.to_numeric(purchase.str[:4], errors="coerce")
+    delta = month_num - pd.to_numeric(purchase.str[5:7], errors="coerce")
+    year = year - (delta > 6) + (delta < -6)
+    return [
+        f"{int(y):04d}-{m:02d}" if y == y and 1 <= m <= 12 else None
+        for y, m in zip(year.tolist(), month_num.tolist())
+    ]
+
+
+def _prepare_rows(
+    df: pd.DataFrame, source_file: str, hospital: str = DEFAULT_HOSPITAL
+) -> list[tuple]:
+    """Return validated rows as plain-Python tuples in ORDER_COLUMNS order."""
+    month_num = (
+        df["order_month"].str.strip().str.capitalize()
+        .map(MONTH_NAME_TO_NUM).fillna(0).astype(int)
+    )
+    hospitals = _hospital_column(df, hospital)
+    columns = {
+        "source_file": [source_file] * len(df),
+        "row_hash": _row_hashes(df, hospitals),
+        "hospital": hospitals,
+        "order_month": df["order_month"].tolist(),
+        "month_num": month_num.tolist(),
+        "period": _periods(month_num, df["purchase_date"]),
+        "medication": df["medication"].tolist(),
+        "quantity": df["quantity"].astype(int).tolist(),
+        "purchase_date": df["purchase_date"].tolist(),
+        "expiration_date": df["expiration_date"].tolist(),
+        "quantity_used": df["quantity_used"].astype(int).tolist(),
+        "avg_daily_consumption": df["avg_daily_consumption"].astype(float).tolist(),
+    }
+    return list(zip(*(columns[c] for c in ORDER_COLUMNS)))
+
+
+def _is_duplicate(exc: sqlite3.IntegrityError) -> bool:
+    return "orders.row_hash" in str(exc)
+
+
+def _insert_row_by_row(
+    conn: sqlite3.Connection, rows: list[tuple]
+) -> tuple[int, int, int]:
+    """Insert one row at a time. Returns (inserted, skipped, rejected)."""
+    inserted = skipped = rejected = 0
+    for row in rows:
+        try:
+            conn.execute(_INSERT_SQL, row)
+            inserted += 1
+        except sqlite3.IntegrityError as exc:
+            if _is_duplicate(exc):
+                skipped += 1
+            else:
+                rejected += 1
+                logger.warning("Rejected row %s: %s", row[1][:12], exc)
+    return inserted, skipped, rejected
+
+
+def _insert_bulk(
+    conn: sqlite3.Connection, rows: list[tuple]
+) -> tuple[int, int, int]:
+    """Stage rows with one executemany and dedupe in SQL.
+
+    Duplicates (row_hash already in ``orders`` or repeated within the
+    batch) are skipped; rows violating a NOT NULL constraint are rejected
+    and counted separately. Returns (inserted, skipped, rejected).
+    """
+    conn.execute(_CREATE_STAGING)
+    conn.execute("DELETE FROM orders_staging;")
+    conn.executemany(
+        f"INSERT INTO orders_staging VALUES ({', '.join('?' for _ in ORDER_COLUMNS)})",
+        rows,
+    )
+
+    null_check = " OR ".join(f"{c} IS NULL" for c in _NOT_NULL_COLUMNS)
+    rejected = conn.execute(
+        f"DELETE FROM orders_staging WHERE {null_check};"
+    ).rowcount
+    if rejected:
+        logger.warning("Rejected %d rows violating NOT NULL constraints.", rejected)
+
+    cols = ", ".join(ORDER_COLUMNS)
+    inserted = conn.execute(
+        f"""
+        INSERT INTO orders ({cols})
+        SELECT {cols} FROM orders_staging AS s
+        WHERE s.rowid IN (
+                SELECT MIN(rowid) FROM orders_staging GROUP BY row_hash
+            )
+          AND NOT EXISTS (
+                SELECT 1 FROM orders AS o WHERE o.row_hash = s.row_hash
+            )
+        ORDER BY s.rowid
+        """
+    ).rowcount
+    conn.execute("DELETE FROM orders_staging;")
+
+    skipped = len(rows) - rejected - inserted
+    return inserted, skipped, rejected
+
+
+def _fingerprint(path: Path) -> str:
+    """Identify a file version by size and mtime (cheap, no full read)."""
+    st = path.stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _load_checkpoint(conn: sqlite3.Connection, source_path: str, fingerprint: str):
+    """Return the checkpoint row for *source_path* if it matches *fingerprint*."""
+    row = conn.execute(
+        "SELECT * FROM ingest_checkpoints WHERE source_path = ?",
+        (source_path,),
+    ).fetchone()
+    if row is None:
+        return None
+    if row["fingerprint"] != fingerprint:
+        logger.warning(
+            "%s changed since the last interrupted ingest; starting over.",
+            source_path,
+        )
+        return None
+    return row
+
+
+def _save_checkpoint(
+    conn: sqlite3.Connection,
+    source_path: str,
+    fingerprint: str,
+    rows_done: int,
+    chunks_done: int,
+    counts: list[int],
+) -> None:
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO ingest_checkpoints
+            (source_path, fingerprint, rows_done, chunks_done,
+             inserted, skipped, rejected, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            source_path,
+            fingerprint,
+            rows_done,
+            chunks_done,
+            *counts,
+            datetime.now().isoformat(timespec="seconds"),
+        ),
+    )
+
+
+def _ingest_stream(
+    conn: sqlite3.Connection,
+    path: Path,
+    chunksize: int,
+    hospital: str = DEFAULT_HOSPITAL,
+) -> tuple[int, int, int]:
+    """Ingest *path* chunk by chunk, one transaction + checkpoint per chunk.
+
+    An interrupted run resumes after the last committed chunk of the same
+    (unchanged) file. Returns this run's (inserted, skipped, rejected).
+    """
+    source_path = str(path.resolve())
+    fingerprint = _fingerprint(path)
+    checkpoint = _load_checkpoint(conn, source_path, fingerprint)
+
+    rows_done = chunks_done = 0
+    totals = [0, 0, 0]
+    if checkpoint is not None:
+        rows_done = checkpoint["rows_done"]
+        chunks_done = checkpoint["chunks_done"]
+        totals = [checkpoint["inserted"], checkpoint["skipped"], checkpoint["rejected"]]
+        logger.info(
+            "Resuming %s after %d committed chunks (%d rows).",
+            path.name,
+            chunks_done,
+            rows_done,
+        )
+
+    # rows_done counts records as the parser emits them, so committed rows
+    # are skipped by that same count rather than by line (skiprows), which
+    # disagrees with it on quoted newlines and blank lines.
+    skip = rows_done
+    run = [0, 0, 0]
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if skip:
+            if len(chunk) <= skip:
+                skip -= len(chunk)
+                continue
+            chunk, skip = chunk.iloc[skip:], 0
+        n_raw = len(chunk)
+        df = validate_dataframe(chunk, copy=False)
+        counts = _insert_bulk(conn, _prepare_rows(df, path.name, hospital))
+
+        rows_done += n_raw
+        chunks_done += 1
+        run = [a + b for a, b in zip(run, counts)]
+        totals = [a + b for a, b in zip(totals, counts)]
+        _save_checkpoint(conn, source_path, fingerprint, rows_done, chunks_done, totals)
+        conn.commit()
+        logger.info(
+            "Chunk %d committed (%d rows read, %d inserted so far).",
+            chunks_done,
+            rows_done,
+            totals[0],
+        )
+
+    conn.execute(
+        "DELETE FROM ingest_checkpoints WHERE source_path = ?", (source_path,)
+    )
+    conn.commit()
+    if checkpoint is not None:
+        logger.info(
+            "File totals across resumed runs — %d inserted, %d skipped, %d rejected.",
+            *totals,
+        )
+    return run[0], run[1], run[2]
+
+
+def ingest_csv(
+    csv_path: str,
+    db_path: str | None = None,
+    mode: str = "bulk",
+    chunksize: int = INGEST_CHUNK_ROWS,
+    hospital: str | None = None,
+) -> int:
     """Read, validate, and insert CSV rows into the orders table.
 
+    Rows are attributed to the CSV's ``hospital`` column when present,
+    otherwise to *hospital* (default ``DEFAULT_HOSPITAL``).
+
+    *mode* is one of:
+
+    - ``"bulk"`` (default) — staged executemany + in-SQL dedup, one transaction.
+    - ``"row"`` — one INSERT per row.
+    - ``"stream"`` — read *chunksize* rows at a time, committing each chunk
+      with a checkpoint; memory stays bounded and an interrupted run resumes
+      from the last committed chunk.
+
+    All modes produce identical results.
+
     Returns the number of **new** rows inserted (skips duplicates).
     """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode '{mode}'. Valid modes: {', '.join(INGEST_MODES)}")
+
     path = Path(csv_path)
     if not path.exists():
         raise FileNotFoundError(f"CSV file not found: {csv_path}")
+    hospital = (hospital or DEFAULT_HOSPITAL).strip().upper()
 
-    logger.info("Reading CSV from %s", csv_path)
-    df = pd.read_csv(csv_path)
+    rows: list[tuple] = []
+    if mode != "stream":
+        logger.info("Reading CSV from %s", csv_path)
+        df = pd.read_csv(csv_path)
 
-    logger.info("Validating schema (%d rows) …", len(df))
-    df = validate_dataframe(df)
+        logger.info("Validating schema (%d rows) …", len(df))
+        df = validate_dataframe(df)
+        rows = _prepare_rows(df, path.name, hospital)
+    else:
+        logger.info("Streaming CSV from %s in chunks of %d rows", csv_path, chunksize)
 
     # Ensure DB tables exist
     init_db(db_path)
     conn = get_connection(db_path)
 
-    inserted = 0
-    skipped = 0
-
     try:
-        for _, row in df.iterrows():
-            rh = _row_hash(row["order_month"], row["medication"], row["purchase_date"])
-            month_num = MONTH_NAME_TO_NUM.get(row["order_month"].strip().capitalize(), 0)
-
-            try:
-                conn.execute(
-                    """
-                    INSERT INTO orders
-                        (source_file, row_hash, order_month, month_num,
-                         medication, quantity, purchase_date, expiration_date,
-                         quantity_used, avg_daily_consumption)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        path.name,
-                        rh,
-                        row["order_month"],
-                        month_num,
-                        row["medication"],
-                        int(row["quantity"]),
-                        row["purchase_date"],
-                        row["expiration_date"],
-                        int(row["quantity_used"]),
-                        float(row["avg_daily_consumption"]),
-                    ),
-                )
-                inserted += 1
-            except Exception:
-                # row_hash UNIQUE constraint → duplicate, skip
-                skipped += 1
-
-        conn.commit()
+        if mode == "stream":
+            with bulk_load_pragmas(conn):
+                inserted, skipped, rejected = _ingest_stream(conn, path, chunksize, hospital)
+        elif mode == "bulk":
+            with bulk_load_pragmas(conn):
+                inserted, skipped, rejected = _insert_bulk(conn, rows)
+                conn.commit()
+        else:
+            inserted, skipped, rejected = _insert_row_by_row(conn, rows)
+            conn.commit()
+        ensure_feature_store(conn, max_series=FEATURE_REFRESH_SERIES)
         logger.info(
-            "Ingestion complete — %d inserted, %d skipped (duplicates).",
+            "Ingestion complete — %d inserted, %d skipped (duplicates), %d rejected.",
             inserted,
             skipped,
+            rejected,
         )
     finally:
         conn.close()
@@ -110,8 +410,31 @@ def main() -> None:
         default=None,
         help="Path to SQLite database (default: CHARM_DB_PATH env or charm.db).",
     )
+    parser.add_argument(
+        "--mode",
+        choices=INGEST_MODES,
+        default="bulk",
+        help="Insert strategy (default: bulk). 'stream' reads in resumable chunks.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=INGEST_CHUNK_ROWS,
+        help=f"Rows per chunk/transaction in stream mode (default {INGEST_CHUNK_ROWS}).",
+    )
+    parser.add_argument(
+        "--hospital",
+        default=None,
+        help=f"Hospital code for CSVs without a 'hospital' column (default: {DEFAULT_HOSPITAL}).",
+    )
     args = parser.parse_args()
-    ingest_csv(args.csv, args.db)
+    ingest_csv(
+        args.csv,
+        args.db,
+        mode=args.mode,
+        chunksize=args.chunksize,
+        hospital=args.hospital,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+"""
+CHARM Copilot background jobs — run recommendations off the request thread.
+
+``JobQueue`` runs callables on a local thread pool and hands back a job id
+to poll. Threads (rather than processes) share the resident model registry
+and the prediction cache, and NumPy/SQLite release the GIL for the heavy
+parts. Submissions carry a key built from the request parameters; while a
+job with the same key is queued or running, further submissions return
+that job instead of starting another one. Finished jobs are kept for
+``JOB_RESULT_TTL`` seconds so late pollers can still collect the result.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from charm.config import JOB_RESULT_TTL, JOB_WORKERS
+from charm.utils import setup_logging
+
+logger = setup_logging()
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+@dataclass
+class Job:
+    """State of one submitted computation."""
+
+    id: str
+    key: str
+    status: str = QUEUED
+    result: Any = None
+    error: str | None = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    def to_dict(self) -> dict:
+        out = {"job_id": self.id, "status": self.status, "submitted_at": self.submitted_at}
+        if self.status == DONE:
+            out["result"] = self.result
+        elif self.status == FAILED:
+            out["error"] = self.error
+        if self.finished_at is not None:
+            out["finished_at"] = self.finished_at
+        return out
+
+
+def job_key(name: str, **params: Any) -> str:
+    """Canonical key for *name* called with *params* (order-insensitive)."""
+    return json.dumps([name, params], sort_keys=True, default=str)
+
+
+class JobQueue:
+    """Thread-pool job runner with in-flight deduplication."""
+
+    def __init__(self, workers: int = JOB_WORKERS, result_ttl: float = JOB_RESULT_TTL) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="charm-job")
+        self._result_ttl = result_ttl
+        self._jobs: dict[str, Job] = {}
+        self._inflight: dict[str, str] = {}  # key → job id
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.deduplicated = 0
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Job:
+        """Run ``fn(*args, **kwargs)`` in the pool, or join the in-flight job for *key*."""
+        with self._lock:
+            self._prune()
+            job_id = self._inflight.get(key)
+            if job_id is not None:
+                self.deduplicated += 1
+                return self._jobs[job_id]
+            job = Job(id=uuid.uuid4().hex, key=key)
+            self._jobs[job.id] = job
+            self._inflight[key] = job.id
+            self.submitted += 1
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Return the job with *job_id*, or None if unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        """Return submission counters and jobs per status."""
+        with self._lock:
+            by_status: dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "jobs": by_status,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        job.status = RUNNING
+        try:
+            result, status, error = fn(*args, **kwargs), DONE, None
+        except Exception as e:  # surfaced to the poller, not raised in the pool
+            logger.exception("Job %s failed", job.id)
+            result, status, error = None, FAILED, str(e)
+        with self._lock:
+            job.result, job.error = result, error
+            job.finished_at = time.time()
+            job.status = status
+            if self._inflight.get(job.key) == job.id:
+                del self._inflight[job.key]
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self._result_ttl
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_queue: JobQueue | None = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, starting its pool on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
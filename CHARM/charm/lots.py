@@ -0,0 +1,377 @@
+"""
+CHARM Copilot lot-level inventory — FEFO consumption and projected waste.
+
+Stock is tracked per lot (batch): remaining quantity and expiry date, in the
+``lots`` table. The simulator consumes predicted demand first-expired-first-
+out and reports the units that will expire unused. It steps month by month
+but is vectorised over every lot of every hospital at once.
+
+Within a month, demand is spread evenly over the days, so a lot expiring on
+the 10th can only cover the demand of the days before it expires; whatever
+is left of a lot when it expires is waste.
+
+CLI:
+    python -m charm.lots load --csv lots.csv --hospital A
+    python -m charm.lots sync [--hospital A]       # from Mongo inventory_<h>
+    python -m charm.lots project --month April --months 6
+"""
+
+from __future__ import annotations
+
+import argparse
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from charm.config import DEFAULT_HOSPITAL
+from charm.db import get_connection, init_db
+from charm.features import SERIES_KEYS
+from charm.utils import month_name_to_num, next_month_start, setup_logging
+
+logger = setup_logging()
+
+LOT_COLUMNS = ["hospital", "medication", "quantity", "expiration_date", "received_date"]
+
+
+# ── Loading ──────────────────────────────────────────────────────────
+
+def lots_from_inventory(docs: Iterable[dict], hospital: str) -> pd.DataFrame:
+    """Convert Mongo ``inventory_<h>`` documents into a lots frame.
+
+    Each inventory item (``name``, ``quantity``, ``expiry_date``,
+    ``date_added``) is one lot.
+    """
+    rows = [
+        {
+            "hospital": hospital.upper(),
+            "medication": d.get("name"),
+            "quantity": d.get("quantity"),
+            "expiration_date": d.get("expiry_date"),
+            "received_date": d.get("date_added"),
+        }
+        for d in docs
+    ]
+    return pd.DataFrame(rows, columns=LOT_COLUMNS)
+
+
+def _normalise_lots(lots: pd.DataFrame, hospital: str) -> pd.DataFrame:
+    df = lots.copy()
+    if "hospital" in df.columns:
+        df["hospital"] = df["hospital"].fillna(hospital).astype(str).str.strip().str.upper()
+    else:
+        df["hospital"] = hospital
+    if "received_date" not in df.columns:
+        df["received_date"] = None
+    df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce")
+    expires = pd.to_datetime(df["expiration_date"], errors="coerce")
+    df["expiration_date"] = expires.dt.strftime("%Y-%m-%d")
+    received = pd.to_datetime(df["received_date"], errors="coerce")
+    df["received_date"] = received.dt.strftime("%Y-%m-%d").where(received.notna(), None)
+
+    valid = df["medication"].notna() & df["quantity"].notna() & expires.notna()
+    valid &= df["quantity"] >= 0
+    if (~valid).any():
+        logger.warning(
+            "Rejected %d lot row(s) with missing or invalid fields.", int((~valid).sum())
+        )
+    df = df[valid]
+    df["quantity"] = df["quantity"].astype(np.int64)
+    return df[LOT_COLUMNS]
+
+
+def load_lots(
+    lots: pd.DataFrame,
+    db_path: str | None = None,
+    hospital: str | None = None,
+    replace: bool = True,
+) -> int:
+    """Insert *lots* into the ``lots`` table; returns the number of lots stored.
+
+    Rows without a ``hospital`` column belong to *hospital* (default
+    ``DEFAULT_HOSPITAL``). With *replace*, the existing lots of every
+    hospital present in *lots* are dropped first, so a full stock count
+    can be reloaded as-is.
+    """
+    df = _normalise_lots(lots, (hospital or DEFAULT_HOSPITAL).strip().upper())
+    init_db(db_path)
+    conn = get_connection(db_path)
+    try:
+        if replace:
+            conn.executemany(
+                "DELETE FROM lots WHERE hospital = ?",
+                [(h,) for h in df["hospital"].unique().tolist()],
+            )
+        conn.executemany(
+            f"INSERT INTO lots ({', '.join(LOT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            list(df.itertuples(index=False, name=None)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info("Loaded %d lot(s) for %s.", len(df), ", ".join(sorted(df["hospital"].unique())))
+    return len(df)
+
+
+def sync_lots_from_inventory(
+    db_path: str | None = None,
+    hospital: str | None = None,
+    database: str | None = None,
+) -> int:
+    """Replace the ``lots`` table with the stock in Mongo ``inventory_<h>``.
+
+    Syncs *hospital*, or every ``inventory_*`` collection in *database*
+    (default ``MONGO_DB``). Each synced hospital's lots are replaced
+    wholesale, so items used up or deleted in Mongo drop out here too.
+    Returns the number of lots stored.
+    """
+    from charm.storage import get_mongo_db
+
+    mongo = get_mongo_db(database)
+    if hospital:
+        names = [f"inventory_{hospital.strip().lower()}"]
+    else:
+        names = sorted(mongo.list_collection_names(filter={"name": {"$regex": "^inventory_"}}))
+
+    stored = 0
+    for name in names:
+        hosp = name[len("inventory_"):].upper()
+        docs = mongo[name].find({}, {"name": 1, "quantity": 1, "expiry_date": 1, "date_added": 1})
+        lots = lots_from_inventory(docs, hosp)
+        if lots.empty:
+            init_db(db_path)
+            conn = get_connection(db_path)
+            try:
+                conn.execute("DELETE FROM lots WHERE hospital = ?", (hosp,))
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info("No inventory for %s; cleared its lots.", hosp)
+            continue
+        stored += load_lots(lots, db_path, hospital=hosp)
+    return stored
+
+
+def fetch_lots(conn, hospital: str | None = None) -> pd.DataFrame:
+    """Lots with stock left, sorted by hospital, medication and expiry (FEFO order)."""
+    where, params = "WHERE quantity > 0", ()
+    if hospital is not None:
+        where += " AND hospital = ?"
+        params = (hospital,)
+    return pd.read_sql_query(
+        f"""
+        SELECT id, hospital, medication, quantity, expiration_date
+        FROM lots
+        {where}
+        ORDER BY hospital, medication, expiration_date, id
+        """,
+        conn,
+        params=params,
+    )
+
+
+# ── FEFO simulation ──────────────────────────────────────────────────
+
+def fefo_kernel(
+    series: np.ndarray,
+    expiry_day: np.ndarray,
+    quantity: np.ndarray,
+    demand: np.ndarray,
+    month_start: np.ndarray,
+    month_days: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Consume *demand* from lots first-expired-first-out.
+
+    Lots must be sorted by (*series*, *expiry_day*). *expiry_day* and
+    *month_start* are day offsets from a common origin; *demand* is
+    (n_series × n_months). Returns per-lot ``consumed`` and ``wasted``
+    units and the per-series ``shortfall`` (demand the lots could not
+    cover), each summed over the horizon.
+    """
+    n_series, n_months = demand.shape
+    remaining = quantity.astype(np.float64).copy()
+    consumed = np.zeros_like(remaining)
+    wasted = np.zeros_like(remaining)
+    if not len(series):
+        return consumed, wasted, demand.sum(axis=1).astype(np.float64)
+    shortfall = np.zeros(n_series)
+
+    is_first = np.r_[True, series[1:] != series[:-1]]
+    first = np.flatnonzero(is_first)
+    group = np.cumsum(is_first) - 1
+
+    for m in range(n_months):
+        start, days = month_start[m], month_days[m]
+        usable_days = np.clip(expiry_day - start, 0, days)
+        supply = np.where(usable_days > 0, remaining, 0.0)
+
+        # Demand arriving before each lot expires (non-decreasing in FEFO order).
+        reach = demand[series, m] * usable_days / days
+        # Cumulative supply up to and including each lot, within its series.
+        cum_supply = np.cumsum(supply)
+        cum_supply -= (cum_supply - supply)[first][group]
+        # Units drawn from a series' first i lots: T_i = min(T_{i-1} + s_i, R_i),
+        # i.e. S_i + min(0, min_{k<=i} (R_k - S_k)).
+        slack = pd.Series(reach - cum_supply).groupby(group).cummin().to_numpy()
+        drawn = cum_supply + np.minimum(0.0, slack)
+        take = np.diff(drawn, prepend=0.0)
+        take[first] = drawn[first]
+
+        remaining -= take
+        consumed += take
+
+        expiring = (expiry_day < start + days) & (remaining > 0)
+        wasted[expiring] += remaining[expiring]
+        remaining[expiring] = 0.0
+
+        covered = np.bincount(series, weights=take, minlength=n_series)
+        shortfall += np.maximum(0.0, demand[:, m] - covered)
+
+    return consumed, wasted, shortfall
+
+
+def project_waste(
+    lots: pd.DataFrame,
+    demand: pd.DataFrame,
+    start: date,
+) -> pd.DataFrame:
+    """Project FEFO consumption and waste from *start* over *demand*'s months.
+
+    *lots* is a ``fetch_lots`` frame; *demand* is indexed by (hospital,
+    medication) with one column per month starting at *start*. Returns a
+    frame indexed like *demand* (plus any series that only has lots) with
+    ``on_hand``, ``consumed``, ``projected_waste`` and ``shortfall``.
+    """
+    lots = lots.sort_values([*SERIES_KEYS, "expiration_date"], kind="stable")
+    keys = pd.MultiIndex.from_frame(lots[SERIES_KEYS])
+    index = demand.index.append(keys.difference(demand.index)).unique()
+    index.names = SERIES_KEYS
+    demand = demand.reindex(index).fillna(0.0)
+    n_months = demand.shape[1]
+
+    origin = pd.Timestamp(start)
+    months = pd.date_range(origin, periods=n_months + 1, freq="MS")
+    month_start = (months[:-1] - origin).days.to_numpy()
+    month_days = np.diff((months - origin).days.to_numpy())
+
+    series = index.get_indexer(keys)
+    expiry_day = (pd.to_datetime(lots["expiration_date"]) - origin).dt.days.to_numpy()
+    consumed, wasted, shortfall = fefo_kernel(
+        series,
+        expiry_day,
+        lots["quantity"].to_numpy(),
+        demand.to_numpy(dtype=np.float64),
+        month_start,
+        month_days,
+    )
+
+    n = len(index)
+    return pd.DataFrame(
+        {
+            "on_hand": np.bincount(series, weights=lots["quantity"].to_numpy(), minlength=n),
+            "consumed": np.bincount(series, weights=consumed, minlength=n),
+            "projected_waste": np.bincount(series, weights=wasted, minlength=n),
+            "shortfall": shortfall,
+        },
+        index=index,
+    )
+
+
+def recent_demand(conn, hospital: str | None = None, window: int = 3) -> pd.Series:
+    """Mean monthly usage over each series' last *window* feature-store rows."""
+    where, params = "", (window,)
+    if hospital is not None:
+        where, params = "WHERE hospital = ?", (hospital, window)
+    df = pd.read_sql_query(
+        f"""
+        SELECT hospital, medication, AVG(quantity_used) AS demand
+        FROM (
+            SELECT hospital, medication, quantity_used,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY hospital, medication
+                       ORDER BY period DESC, order_id DESC
+                   ) AS rn
+            FROM features
+            {where}
+        )
+        WHERE rn <= ?
+        GROUP BY hospital, medication
+        """,
+        conn,
+        params=params,
+    )
+    return df.set_index(SERIES_KEYS)["demand"]
+
+
+# ── CLI ──────────────────────────────────────────────────────────────
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="charm.lots",
+        description="Lot-level inventory: load or sync lots and project FEFO waste.",
+    )
+    parser.add_argument("--db", default=None, help="Path to SQLite database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_load = sub.add_parser("load", help="Load lots from a CSV.")
+    p_load.add_argument(
+        "--csv",
+        required=True,
+        help="CSV with medication, quantity, expiration_date "
+             "[, hospital, received_date] columns.",
+    )
+    p_load.add_argument("--hospital", default=None, help="Hospital for rows without one.")
+    p_load.add_argument(
+        "--append",
+        action="store_true",
+        help="Add to the existing lots instead of replacing the hospital's lots.",
+    )
+
+    p_sync = sub.add_parser("sync", help="Replace lots with the Mongo inventory stock.")
+    p_sync.add_argument("--hospital", default=None, help="Only sync this hospital (default: all).")
+
+    p_proj = sub.add_parser("project", help="Project units expiring unused.")
+    p_proj.add_argument("--month", required=True, help="First month to project (e.g. 'April').")
+    p_proj.add_argument("--months", type=int, default=6, help="Months to project (default 6).")
+    p_proj.add_argument("--hospital", default=None, help="Limit to one hospital.")
+
+    args = parser.parse_args()
+    if args.command == "load":
+        path = Path(args.csv)
+        if not path.exists():
+            raise FileNotFoundError(f"CSV file not found: {args.csv}")
+        load_lots(pd.read_csv(path), args.db, hospital=args.hospital, replace=not args.append)
+        return
+    if args.command == "sync":
+        sync_lots_from_inventory(args.db, hospital=args.hospital)
+        return
+
+    hospital = args.hospital.upper() if args.hospital else None
+    start = next_month_start(month_name_to_num(args.month))
+    conn = get_connection(args.db)
+    try:
+        lots = fetch_lots(conn, hospital)
+        demand = recent_demand(conn, hospital)
+    finally:
+        conn.close()
+    # Hold each series' recent mean usage flat over the horizon.
+    demand = pd.DataFrame(
+        np.repeat(demand.to_numpy()[:, None], args.months, axis=1), index=demand.index
+    )
+    result = project_waste(lots, demand, start)
+    result = result[result["on_hand"] > 0].sort_values("projected_waste", ascending=False)
+
+    print(f"\n{'='*72}")
+    print(f"  FEFO projection — {args.months} month(s) from {start:%B %Y}")
+    print(f"{'='*72}\n")
+    for (hosp, med), r in result.iterrows():
+        print(f"  {hosp:<3s} {med:<40s} on hand {r.on_hand:>7.0f}  "
+              f"waste {r.projected_waste:>7.0f}  short {r.shortfall:>7.0f}")
+    print(f"\n  Total projected waste: {result['projected_waste'].sum():,.0f} units")
+    print(f"{'='*72}\n")
+
+
+if __name__ == "__main__":
+    main()
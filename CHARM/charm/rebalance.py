@@ -0,0 +1,379 @@
+"""
+CHARM Copilot network rebalancing — propose stock transfers between hospitals.
+
+Each (hospital, medication) position compares current stock with the
+copilot's predicted demand plus the safety buffer: stock above that is
+surplus, stock below it is a deficit. Surplus is matched to deficits of
+the same medication as a transportation problem:
+
+- ``lp``     — linear program (SciPy HiGHS, sparse constraint matrix) over
+  every surplus × deficit pair. Maximises the value of covered demand
+  minus per-unit transfer cost; surplus that expires sooner is worth more
+  to move, so it is shipped first.
+- ``greedy`` — vectorised matching across all medications at once: the
+  soonest-expiring surplus covers the largest deficits first. Ignores
+  transfer costs, but scales to any network size.
+- ``auto``   — ``lp`` while the pair count stays under ``LP_MAX_PAIRS``,
+  otherwise ``greedy``.
+
+CLI:
+    python -m charm.rebalance --month April
+    python -m charm.rebalance --month April --method greedy --out plan.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+from charm.config import DEFAULT_SAFETY_BUFFER, EXPIRY_WARNING_DAYS
+from charm.copilot import recommend_orders_batch
+from charm.db import get_connection
+from charm.features import SERIES_KEYS
+from charm.lots import fetch_lots
+from charm.utils import month_name_to_num, next_month_start, setup_logging
+
+logger = setup_logging()
+
+METHODS = ("auto", "lp", "greedy")
+LP_MAX_PAIRS = 2_000_000  # above this many surplus × deficit pairs, "auto" goes greedy
+TRANSFER_COLUMNS = ["medication", "source", "target", "units", "source_days_left", "unit_cost"]
+
+
+# ── Positions ────────────────────────────────────────────────────────
+
+def network_positions(
+    month: str,
+    hospitals: list[str] | None = None,
+    current_stock: dict[str, dict[str, int]] | None = None,
+    model_dir: str | None = None,
+    db_path: str | None = None,
+) -> pd.DataFrame:
+    """Stock, predicted demand and days to earliest lot expiry per position.
+
+    *current_stock* maps hospital → medication → units; positions without
+    an entry use their on-hand lot quantity (0 when no lots are tracked),
+    as in ``recommend_orders``. *hospitals* defaults to every hospital in
+    the database.
+    """
+    conn = get_connection(db_path)
+    try:
+        if hospitals is None:
+            hospitals = [
+                r["hospital"]
+                for r in conn.execute("SELECT DISTINCT hospital FROM orders ORDER BY hospital")
+            ]
+        hospitals = [h.upper() for h in hospitals]
+        lots = fetch_lots(conn)
+    finally:
+        conn.close()
+
+    current_stock = {h.upper(): s for h, s in (current_stock or {}).items()}
+    batch = recommend_orders_batch(
+        [
+            {"hospital": h, "next_month": month, "current_stock": current_stock.get(h, {})}
+            for h in hospitals
+        ],
+        model_dir=model_dir,
+        db_path=db_path,
+    )
+    positions = pd.DataFrame(
+        [
+            {
+                "hospital": b["hospital"],
+                "medication": r["medication"],
+                "stock": r["current_stock"],
+                "demand": r["predicted_demand"],
+            }
+            for b in batch
+            for r in b["recommendations"]
+        ],
+        columns=[*SERIES_KEYS, "stock", "demand"],
+    )
+
+    start = pd.Timestamp(next_month_start(month_name_to_num(month)))
+    earliest = lots.groupby(SERIES_KEYS)["expiration_date"].min()
+    days_left = (pd.to_datetime(earliest) - start).dt.days.rename("days_left")
+    return positions.join(days_left, on=SERIES_KEYS)
+
+
+def surplus_deficit(
+    positions: pd.DataFrame, safety_buffer: float = DEFAULT_SAFETY_BUFFER
+) -> tuple[np.ndarray, np.ndarray]:
+    """Whole units each position can give away and needs, given the buffer."""
+    need = positions["demand"].to_numpy(dtype=np.float64) * (1 + safety_buffer)
+    stock = positions["stock"].to_numpy(dtype=np.float64)
+    surplus = np.floor(np.maximum(0.0, stock - need))
+    deficit = np.ceil(np.maximum(0.0, need - stock))
+    return surplus, deficit
+
+
+def _urgency(days_left: np.ndarray, horizon_days: float) -> np.ndarray:
+    """0 (no expiry pressure) … 1 (expires now); NaN days count as 0."""
+    urgency = 1.0 - np.asarray(days_left, dtype=np.float64) / horizon_days
+    return np.nan_to_num(np.clip(urgency, 0.0, 1.0), nan=0.0)
+
+
+# ── Solvers ──────────────────────────────────────────────────────────
+
+def solve_greedy(
+    med: np.ndarray,
+    supply: np.ndarray,
+    priority: np.ndarray,
+    demand: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Match supply to demand per medication code *med*, highest *priority* first.
+
+    *supply* and *demand* are per-position unit arrays; a position's
+    supply is served in order of *priority* and deficits largest first.
+    Returns (source, target, units) position indices. Every medication is
+    matched at once: supply and demand are laid out as consecutive
+    intervals on one shared axis (offset per medication), and each
+    segment between interval ends is one transfer.
+    """
+    donors = np.flatnonzero(supply > 0)
+    takers = np.flatnonzero(demand > 0)
+    donors = donors[np.lexsort((-priority[donors], med[donors]))]
+    takers = takers[np.lexsort((-demand[takers], med[takers]))]
+
+    n_meds = int(med.max()) + 1 if len(med) else 0
+    moved = np.minimum(
+        np.bincount(med[donors], weights=supply[donors], minlength=n_meds),
+        np.bincount(med[takers], weights=demand[takers], minlength=n_meds),
+    )
+    offset = np.concatenate([[0.0], np.cumsum(moved)[:-1]])
+
+    def _ends(idx: np.ndarray, qty: np.ndarray) -> np.ndarray:
+        groups = med[idx]
+        total = np.cumsum(qty[idx])
+        is_first = np.r_[True, groups[1:] != groups[:-1]] if len(idx) else np.array([], bool)
+        first = np.flatnonzero(is_first)
+        within = total - (total - qty[idx])[first][np.cumsum(is_first) - 1]
+        return offset[groups] + np.minimum(within, moved[groups])
+
+    d_end, t_end = _ends(donors, supply), _ends(takers, demand)
+    breaks = np.unique(np.concatenate([d_end, t_end, [0.0]]))
+    starts, units = breaks[:-1], np.diff(breaks)
+    mid = starts + units / 2
+    source = donors[np.searchsorted(d_end, mid, side="right")]
+    target = takers[np.searchsorted(t_end, mid, side="right")]
+    return source, target, units
+
+
+def solve_lp(
+    source: np.ndarray,
+    target: np.ndarray,
+    gain: np.ndarray,
+    supply: np.ndarray,
+    demand: np.ndarray,
+) -> np.ndarray:
+    """Units per candidate pair maximising total *gain*, within supply and demand.
+
+    *source*/*target* index positions; constraints are one row per
+    position (supply and demand) in a sparse CSR matrix, solved with HiGHS.
+    """
+    n_pairs, n_pos = len(source), len(supply)
+    if not n_pairs:
+        return np.zeros(0)
+    cols = np.arange(n_pairs)
+    A = sparse.vstack(
+        [
+            sparse.csr_matrix((np.ones(n_pairs), (source, cols)), shape=(n_pos, n_pairs)),
+            sparse.csr_matrix((np.ones(n_pairs), (target, cols)), shape=(n_pos, n_pairs)),
+        ],
+        format="csr",
+    )
+    b = np.concatenate([supply, demand])
+    keep = A.getnnz(axis=1) > 0
+    result = linprog(-gain, A_ub=A[keep], b_ub=b[keep], bounds=(0, None), method="highs")
+    if result.status != 0:
+        raise RuntimeError(f"Rebalancing LP failed: {result.message}")
+    # Transportation LPs with integral bounds have integral vertices;
+    # flooring only guards against solver round-off.
+    return np.floor(result.x + 1e-6)
+
+
+def _candidate_pairs(
+    med: np.ndarray,
+    hospital: np.ndarray,
+    supply: np.ndarray,
+    demand: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Every (surplus position, deficit position) pair sharing a medication."""
+    donors = pd.DataFrame({"med": med, "source": np.arange(len(med))})[supply > 0]
+    takers = pd.DataFrame({"med": med, "target": np.arange(len(med))})[demand > 0]
+    pairs = donors.merge(takers, on="med")
+    pairs = pairs[hospital[pairs["source"]] != hospital[pairs["target"]]]
+    return pairs["source"].to_numpy(), pairs["target"].to_numpy()
+
+
+def _pair_costs(
+    hospital: np.ndarray,
+    source: np.ndarray,
+    target: np.ndarray,
+    transfer_costs: pd.DataFrame | None,
+    default_cost: float,
+) -> np.ndarray:
+    """Per-unit cost of each pair; *transfer_costs* rows override *default_cost*."""
+    cost = np.full(len(source), float(default_cost))
+    if transfer_costs is None or not len(source):
+        return cost
+    lookup = transfer_costs.set_index(["source", "target"])["cost"]
+    found = lookup.reindex(pd.MultiIndex.from_arrays([hospital[source], hospital[target]]))
+    return np.where(found.isna(), cost, found.to_numpy(dtype=np.float64))
+
+
+def plan_transfers(
+    positions: pd.DataFrame,
+    method: str = "auto",
+    safety_buffer: float = DEFAULT_SAFETY_BUFFER,
+    transfer_costs: pd.DataFrame | None = None,
+    default_cost: float = 1.0,
+    shortage_value: float = 10.0,
+    expiry_weight: float = 1.0,
+    horizon_days: float = EXPIRY_WARNING_DAYS,
+    min_units: int = 1,
+) -> pd.DataFrame:
+    """Solve a transfer plan over *positions*.
+
+    *positions* has hospital, medication, stock, demand and optionally
+    days_left (see ``network_positions``). In the LP each unit moved is
+    worth ``shortage_value * (1 + expiry_weight * urgency)`` minus its
+    transfer cost, where urgency grows from 0 to 1 as the source's
+    earliest lot comes within *horizon_days* of expiry. *transfer_costs*
+    (columns source, target, cost) overrides *default_cost* per hospital
+    pair. Transfers below *min_units* are dropped.
+
+    Returns one row per transfer with columns ``TRANSFER_COLUMNS``, largest
+    first.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'; expected one of {METHODS}")
+    supply, demand = surplus_deficit(positions, safety_buffer)
+    med_codes, meds = pd.factorize(positions["medication"])
+    hospital = positions["hospital"].to_numpy()
+    days_left = (
+        positions["days_left"].to_numpy(dtype=np.float64)
+        if "days_left" in positions.columns
+        else np.full(len(positions), np.nan)
+    )
+    urgency = _urgency(days_left, horizon_days)
+
+    if method == "auto":
+        n_pairs = int(
+            (
+                np.bincount(med_codes, weights=supply > 0, minlength=len(meds))
+                * np.bincount(med_codes, weights=demand > 0, minlength=len(meds))
+            ).sum()
+        )
+        method = "lp" if n_pairs <= LP_MAX_PAIRS else "greedy"
+
+    t0 = time.perf_counter()
+    if method == "greedy":
+        source, target, units = solve_greedy(med_codes, supply, urgency, demand)
+        cost = _pair_costs(hospital, source, target, transfer_costs, default_cost)
+    else:
+        source, target = _candidate_pairs(med_codes, hospital, supply, demand)
+        cost = _pair_costs(hospital, source, target, transfer_costs, default_cost)
+        gain = shortage_value * (1 + expiry_weight * urgency[source]) - cost
+        worthwhile = gain > 0
+        source, target, cost = source[worthwhile], target[worthwhile], cost[worthwhile]
+        units = solve_lp(source, target, gain[worthwhile], supply, demand)
+    logger.info(
+        "Solved %s rebalancing over %d positions in %.2fs.",
+        method, len(positions), time.perf_counter() - t0,
+    )
+
+    plan = pd.DataFrame(
+        {
+            "medication": np.asarray(meds)[med_codes[source]],
+            "source": hospital[source],
+            "target": hospital[target],
+            "units": units.astype(np.int64),
+            "source_days_left": days_left[source],
+            "unit_cost": cost,
+        },
+        columns=TRANSFER_COLUMNS,
+    )
+    # Greedy segments of one pair are adjacent on the shared axis; merge them.
+    plan = plan.groupby(["medication", "source", "target"], as_index=False, sort=False).agg(
+        units=("units", "sum"),
+        source_days_left=("source_days_left", "first"),
+        unit_cost=("unit_cost", "first"),
+    )
+    plan = plan[plan["units"] >= max(1, min_units)]
+    return plan.sort_values("units", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def rebalance(
+    month: str,
+    method: str = "auto",
+    hospitals: list[str] | None = None,
+    current_stock: dict[str, dict[str, int]] | None = None,
+    model_dir: str | None = None,
+    db_path: str | None = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Predict demand for *month* across the network and plan transfers.
+
+    Extra keyword arguments are passed to ``plan_transfers``.
+    """
+    positions = network_positions(month, hospitals, current_stock, model_dir, db_path)
+    return plan_transfers(positions, method=method, **kwargs)
+
+
+# ── CLI ──────────────────────────────────────────────────────────────
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="charm.rebalance",
+        description="Propose stock transfers between hospitals from predicted demand.",
+    )
+    parser.add_argument("--month", required=True, help="Target month name (e.g. 'April').")
+    parser.add_argument("--method", choices=METHODS, default="auto", help="Solver (default auto).")
+    parser.add_argument("--hospitals", nargs="+", default=None, help="Limit to these hospitals.")
+    parser.add_argument(
+        "--safety",
+        type=float,
+        default=DEFAULT_SAFETY_BUFFER,
+        help=f"Safety buffer fraction (default {DEFAULT_SAFETY_BUFFER}).",
+    )
+    parser.add_argument("--costs", default=None, help="CSV of per-unit source,target,cost.")
+    parser.add_argument("--min-units", type=int, default=1, help="Smallest transfer to propose.")
+    parser.add_argument("--model-dir", default=None, help="Directory containing model artifacts.")
+    parser.add_argument("--db", default=None, help="Path to SQLite database.")
+    parser.add_argument("--out", default=None, help="Write the plan to this CSV.")
+    args = parser.parse_args()
+
+    plan = rebalance(
+        args.month,
+        method=args.method,
+        hospitals=args.hospitals,
+        model_dir=args.model_dir,
+        db_path=args.db,
+        safety_buffer=args.safety,
+        transfer_costs=pd.read_csv(args.costs) if args.costs else None,
+        min_units=args.min_units,
+    )
+    if args.out:
+        plan.to_csv(args.out, index=False)
+        logger.info("Wrote %d transfer(s) to %s", len(plan), args.out)
+
+    print(f"\n{'='*72}")
+    print(f"  CHARM AI Copilot — Rebalancing plan for {args.month}")
+    print(f"{'='*72}\n")
+    for r in plan.itertuples(index=False):
+        expiry = "—" if np.isnan(r.source_days_left) else f"{r.source_days_left:.0f}d"
+        print(f"  {r.medication:<40s} {r.source:>3s} → {r.target:<3s} {r.units:>7d}  "
+              f"expiry {expiry}")
+    print(f"\n  Transfers: {len(plan)}  |  Units moved: {int(plan['units'].sum()):,}")
+    print(f"{'='*72}\n")
+
+
+if __name__ == "__main__":
+    main()
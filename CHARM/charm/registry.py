@@ -0,0 +1,234 @@
+"""
+CHARM Copilot model registry — process-wide cache of trained artifacts.
+
+Unpickling ``model.joblib`` on every request dominates copilot latency, so
+loaded models are kept resident per model directory and only reloaded when
+the artifacts on disk actually change (mtime/size first, then a content
+hash). A reload builds a fresh ``LoadedModel`` and swaps it in with a single
+assignment; callers holding the previous instance keep using it untouched.
+
+Training replaces the three artifact files one at a time (model first,
+``model_meta.json`` last) and records the SHA-256 of the model and column
+files in the meta. A reload that catches the files mid-update sees the
+hashes disagree and keeps serving the previous model, so a new column
+order is never paired with an old model.
+
+Partitioned training (``charm.train.train_partitioned``) writes one artifact
+directory per partition under ``<model_dir>/partitions/`` plus a
+``manifest.json`` describing them; each partition is an ordinary registry
+entry.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any
+
+import joblib
+
+from charm.config import MODEL_DIR
+from charm.utils import setup_logging
+
+logger = setup_logging()
+
+MODEL_FILE = "model.joblib"
+COLUMNS_FILE = "columns.joblib"
+META_FILE = "model_meta.json"
+MANIFEST_FILE = "manifest.json"
+PARTITIONS_DIR = "partitions"
+
+# Meta key holding {file name: sha256} of the model and column files.
+ARTIFACT_HASHES = "artifacts"
+# A mid-update reload is retried this many times before giving up.
+CONSISTENT_READ_ATTEMPTS = 5
+
+# Artifacts written before model_meta.json existed were dense one-hot.
+DEFAULT_META: dict = {"encoding": "onehot"}
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """An immutable snapshot of one model directory's artifacts."""
+
+    model: Any
+    feature_cols: list[str]
+    col_index: dict[str, int]
+    meta: dict
+    version: str
+    stamp: tuple = field(repr=False)
+
+
+def _artifact_paths(model_dir: Path) -> list[Path]:
+    paths = [model_dir / MODEL_FILE, model_dir / COLUMNS_FILE]
+    if (model_dir / META_FILE).exists():
+        paths.append(model_dir / META_FILE)
+    return paths
+
+
+def _stamp(paths: list[Path]) -> tuple:
+    """Cheap change detector: (mtime_ns, size) of every artifact."""
+    stats = [p.stat() for p in paths]
+    return tuple((s.st_mtime_ns, s.st_size) for s in stats)
+
+
+def _content_hash(blobs: list[bytes]) -> str:
+    """SHA-256 over the artifact bytes, used as the model version."""
+    h = hashlib.sha256()
+    for blob in blobs:
+        h.update(blob)
+    return h.hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 of one artifact file, as recorded under ``ARTIFACT_HASHES``."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_consistent(paths: list[Path]) -> tuple[list[bytes], dict] | None:
+    """Read the artifacts; None if they are from different training runs.
+
+    Meta written before hashes were recorded is taken as consistent.
+    """
+    blobs = [p.read_bytes() for p in paths]
+    meta = dict(DEFAULT_META)
+    if len(blobs) > 2:
+        meta.update(json.loads(blobs[2]))
+    expected = meta.pop(ARTIFACT_HASHES, None)
+    if expected is not None:
+        actual = {
+            paths[0].name: hashlib.sha256(blobs[0]).hexdigest(),
+            paths[1].name: hashlib.sha256(blobs[1]).hexdigest(),
+        }
+        if expected != actual:
+            return None
+    return blobs, meta
+
+
+class ModelRegistry:
+    """Thread-safe, process-wide cache of loaded models keyed by directory."""
+
+    def __init__(self) -> None:
+        self._entries: dict[str, LoadedModel] = {}
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.hits = 0
+        self.revalidations = 0
+
+    def get(self, model_dir: str | None = None) -> LoadedModel:
+        """Return the resident model for *model_dir*, reloading if changed."""
+        md = Path(model_dir or MODEL_DIR).resolve()
+        key = str(md)
+        paths = _artifact_paths(md)
+
+        if not paths[0].exists():
+            raise FileNotFoundError(
+                f"Trained model not found at {paths[0]}. Run `python -m charm.train` first."
+            )
+
+        stamp = _stamp(paths)
+        entry = self._entries.get(key)
+        if entry is not None and entry.stamp == stamp:
+            self._count("hits")
+            return entry
+
+        with self._load_lock(key):
+            # Another thread may have reloaded while we waited.
+            entry = self._entries.get(key)
+            paths = _artifact_paths(md)
+            stamp = _stamp(paths)
+            if entry is not None and entry.stamp == stamp:
+                self._count("hits")
+                return entry
+
+            for attempt in range(CONSISTENT_READ_ATTEMPTS):
+                read = _read_consistent(paths)
+                if read is not None:
+                    break
+                time.sleep(0.05 * (attempt + 1))  # training is still swapping files
+                paths = _artifact_paths(md)
+                stamp = _stamp(paths)
+            else:
+                if entry is not None:
+                    logger.warning("Artifacts in %s are mid-update; serving %s", md,
+                                   entry.version[:12])
+                    return entry
+                raise RuntimeError(f"Model artifacts in {md} do not match their model_meta.json")
+            blobs, meta = read
+
+            version = _content_hash(blobs)
+            if entry is not None and entry.version == version:
+                # Touched but identical (e.g. re-copied artifacts): keep model.
+                entry = replace(entry, stamp=stamp)
+                self._entries[key] = entry
+                self._count("revalidations")
+                return entry
+
+            model = joblib.load(io.BytesIO(blobs[0]))
+            feature_cols: list[str] = joblib.load(io.BytesIO(blobs[1]))
+            entry = LoadedModel(
+                model=model,
+                feature_cols=feature_cols,
+                col_index={c: i for i, c in enumerate(feature_cols)},
+                meta=meta,
+                version=version,
+                stamp=stamp,
+            )
+            self._entries[key] = entry
+            self._count("loads")
+            logger.info("Loaded model %s from %s", version[:12], md)
+            return entry
+
+    def stats(self) -> dict:
+        """Return load/hit counters and the resident model versions."""
+        return {
+            "loads": self.loads,
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "models": {k: e.version for k, e in self._entries.items()},
+        }
+
+    def clear(self) -> None:
+        """Drop all resident models and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self.loads = self.hits = self.revalidations = 0
+
+    def _load_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+_registry = ModelRegistry()
+
+
+def load_manifest(model_dir: str | None = None) -> dict | None:
+    """Return the partition manifest of *model_dir*, or None if it has none."""
+    path = Path(model_dir or MODEL_DIR) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def get_registry() -> ModelRegistry:
+    """Return the process-wide model registry."""
+    return _registry
+
+
+def get_model(model_dir: str | None = None) -> LoadedModel:
+    """Shortcut for ``get_registry().get(model_dir)``."""
+    return _registry.get(model_dir)
@@ -26,9 +26,13 @@ def validate_columns(df: pd.DataFrame) -> None:
         raise SchemaError(f"Missing required columns: {sorted(missing)}")
 
 
-def coerce_dtypes(df: pd.DataFrame) -> pd.DataFrame:
-    """Coerce columns to expected types, raising SchemaError on failure."""
-    df = df.copy()
+def coerce_dtypes(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    """Coerce columns to expected types, raising SchemaError on failure.
+
+    With ``copy=False`` the frame is modified in place (for callers that own it).
+    """
+    if copy:
+        df = df.copy()
     try:
         df["quantity"] = pd.to_numeric(df["quantity"], errors="raise").astype(int)
         df["quantity_used"] = pd.to_numeric(df["quantity_used"], errors="raise").astype(int)
@@ -40,9 +44,10 @@ def coerce_dtypes(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def normalize_dates(df: pd.DataFrame) -> pd.DataFrame:
+def normalize_dates(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """Normalise purchase_date and expiration_date to YYYY-MM-DD strings."""
-    df = df.copy()
+    if copy:
+        df = df.copy()
     for col in ("purchase_date", "expiration_date"):
         try:
             df[col] = pd.to_datetime(df[col]).dt.strftime("%Y-%m-%d")
@@ -86,10 +91,14 @@ def clean_rows(df: pd.DataFrame) -> pd.DataFrame:
     return df.reset_index(drop=True)
 
 
-def validate_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    """Full validation pipeline: columns → dtypes → dates → cleaning."""
+def validate_dataframe(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    """Full validation pipeline: columns → dtypes → dates → cleaning.
+
+    Pass ``copy=False`` when *df* is a throwaway (e.g. a streamed chunk) to
+    avoid duplicating it during coercion.
+    """
     validate_columns(df)
-    df = coerce_dtypes(df)
-    df = normalize_dates(df)
+    df = coerce_dtypes(df, copy=copy)
+    df = normalize_dates(df, copy=False)
     df = clean_rows(df)
     return df
@@ -0,0 +1,218 @@
+"""
+CHARM storage access layer — shared, lazily created database clients.
+
+MongoDB: one ``MongoClient`` per process, created on first use with the
+pool size and timeouts from ``charm.config``. A client created before a
+fork (e.g. ``gunicorn --preload``) is not reused in the child; each worker
+builds its own. Modules hold ``lazy_database()`` / ``lazy_collection()``
+proxies at import time, which resolve through the shared client on every
+access, so importing them never opens a connection.
+
+SQLite: ``sqlite_connection`` hands out one connection per thread and
+database file, set up (WAL, foreign keys, busy timeout) once. ``close()``
+on such a connection only rolls back an open transaction and resets
+per-use state, so the usual ``conn = get_connection(); ...; conn.close()``
+pattern keeps working while the connection is reused. Handouts nest: only
+the outermost ``close()`` rolls back. A connection whose file was deleted
+or replaced is dropped and reopened.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+from charm.config import (
+    DB_PATH,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_DB,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_URI,
+    SQLITE_MAX_CACHED,
+    SQLITE_REUSE_CONNECTIONS,
+    SQLITE_TIMEOUT,
+)
+
+# ── MongoDB ──────────────────────────────────────────────────────────
+
+_mongo_lock = threading.Lock()
+_mongo_client = None
+_mongo_pid: int | None = None
+
+
+def get_mongo_client():
+    """Return the process-wide pooled ``MongoClient``, creating it on first use."""
+    global _mongo_client, _mongo_pid
+    pid = os.getpid()
+    if _mongo_client is not None and _mongo_pid == pid:
+        return _mongo_client
+    with _mongo_lock:
+        if _mongo_client is None or _mongo_pid != pid:
+            from pymongo import MongoClient
+
+            # A client inherited across fork is unusable; don't close it,
+            # its sockets belong to the parent.
+            _mongo_client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connect=False,
+            )
+            _mongo_pid = pid
+        return _mongo_client
+
+
+def get_mongo_db(name: str | None = None):
+    """Return database *name* (default ``MONGO_DB``) on the shared client."""
+    return get_mongo_client()[name or MONGO_DB]
+
+
+class _Lazy:
+    """Proxy that resolves its target on every attribute or item access."""
+
+    __slots__ = ("_resolve",)
+
+    def __init__(self, resolve: Callable[[], Any]) -> None:
+        object.__setattr__(self, "_resolve", resolve)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._resolve()[key]
+
+    def __repr__(self) -> str:
+        return f"<lazy {self._resolve()!r}>"
+
+
+def lazy_database(name: str | None = None) -> Any:
+    """Import-time handle for database *name*; connects on first use."""
+    return _Lazy(lambda: get_mongo_db(name))
+
+
+def lazy_collection(collection: str, database: str | None = None) -> Any:
+    """Import-time handle for *collection* in *database*; connects on first use."""
+    return _Lazy(lambda: get_mongo_db(database)[collection])
+
+
+def close_mongo() -> None:
+    """Close the shared client (it is recreated on next use)."""
+    global _mongo_client
+    with _mongo_lock:
+        if _mongo_client is not None and _mongo_pid == os.getpid():
+            _mongo_client.close()
+        _mongo_client = None
+
+
+# ── SQLite ───────────────────────────────────────────────────────────
+
+class ReusableConnection(sqlite3.Connection):
+    """A per-thread SQLite connection whose ``close()`` returns it for reuse.
+
+    Each handout by ``sqlite_connection`` is counted; only the outermost
+    ``close()`` rolls back and resets, so a nested get/close inside a
+    caller's transaction leaves that transaction alone.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._holders = 0
+        self._retired = False
+
+    def close(self) -> None:
+        if self._holders > 1:
+            self._holders -= 1
+            return
+        self._holders = 0
+        if self._retired:
+            self.dispose()
+            return
+        if self.in_transaction:
+            self.rollback()
+        self.set_trace_callback(None)
+        self.row_factory = sqlite3.Row
+
+    def dispose(self) -> None:
+        """Really close the underlying connection."""
+        super().close()
+
+    def _retire(self) -> None:
+        """Dispose now if unused, otherwise when its last holder closes it."""
+        if self._holders:
+            self._retired = True
+        else:
+            self.dispose()
+
+
+_local = threading.local()
+
+
+def _file_id(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _connect(path: str, factory: type[sqlite3.Connection]) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, factory=factory)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def sqlite_connection(db_path: str | None = None) -> sqlite3.Connection:
+    """Return this thread's connection to *db_path* (default ``DB_PATH``).
+
+    With ``SQLITE_REUSE_CONNECTIONS`` off, or for ``:memory:``, every call
+    opens a fresh connection.
+    """
+    path = db_path or DB_PATH
+    if not SQLITE_REUSE_CONNECTIONS or path == ":memory:":
+        return _connect(path, sqlite3.Connection)
+
+    cache: OrderedDict[str, tuple[ReusableConnection, tuple | None]] | None = getattr(
+        _local, "connections", None
+    )
+    if cache is None or _local.pid != os.getpid():
+        # Connections inherited across fork must not be used (or closed) here.
+        cache = _local.connections = OrderedDict()
+        _local.pid = os.getpid()
+    key = str(Path(path).resolve())
+    entry = cache.get(key)
+    if entry is not None:
+        conn, file_id = entry
+        if file_id is not None and _file_id(key) == file_id:
+            cache.move_to_end(key)
+            conn._holders += 1
+            return conn
+        del cache[key]
+        conn._retire()
+
+    conn = _connect(key, ReusableConnection)
+    cache[key] = (conn, _file_id(key))
+    while len(cache) > SQLITE_MAX_CACHED:
+        _, (old, _) = cache.popitem(last=False)
+        old._retire()
+    conn._holders += 1
+    return conn
+
+
+def close_sqlite() -> None:
+    """Dispose of this thread's cached SQLite connections."""
+    cache = getattr(_local, "connections", None)
+    if cache is None or _local.pid != os.getpid():
+        return
+    while cache:
+        _, (conn, _) = cache.popitem()
+        conn.dispose()
@@ -1,38 +1,190 @@
 """
-CHARM Copilot model training — global GradientBoostingRegressor.
+CHARM Copilot model training — global or partitioned gradient boosting.
 
 CLI:
     python -m charm.train --model-dir models
+    python -m charm.train --backend hgb --encoding ordinal
+    python -m charm.train --partition-by hospital --workers 8
+    python -m charm.train --partition-by hospital --hospitals B
+    python -m charm.train --partition-by cluster --clusters 4
 """
 
 from __future__ import annotations
 
 import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Sequence
 
 import joblib
-from sklearn.ensemble import GradientBoostingRegressor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.metrics import mean_absolute_error, r2_score
+from threadpoolctl import threadpool_limits
 
-from charm.config import MODEL_DIR
+from charm.config import DEFAULT_LAGS, DEFAULT_WINDOWS, MODEL_DIR
 from charm.db import get_connection
-from charm.features import build_features, get_feature_columns
+from charm.encoding import (
+    DEFAULT_ENCODING,
+    ENCODINGS,
+    MEDICATION_CODE_COLUMN,
+    check_encoding,
+    encode,
+)
+from charm.encoding import feature_columns as encoded_feature_columns
+from charm.features import build_features, get_base_feature_columns, parse_lag_spec
+from charm.registry import (
+    ARTIFACT_HASHES,
+    COLUMNS_FILE,
+    MANIFEST_FILE,
+    META_FILE,
+    MODEL_FILE,
+    PARTITIONS_DIR,
+    file_sha256,
+    load_manifest,
+)
 from charm.utils import setup_logging
 
 logger = setup_logging()
 
 TARGET = "quantity_used"
 
+BACKENDS = ("gbr", "hgb")
+DEFAULT_BACKEND = "gbr"
+
+PARTITION_MODES = ("hospital", "cluster")
+DEFAULT_CLUSTERS = 4
+
+# HistGradientBoosting bins categorical features into at most 255 values.
+_HGB_MAX_CATEGORIES = 255
+
+
+def make_estimator(backend: str = DEFAULT_BACKEND, feature_cols=None, meta=None):
+    """Return an unfitted regressor for *backend*.
+
+    - ``gbr`` — sklearn GradientBoostingRegressor (single-threaded, exact splits)
+    - ``hgb`` — sklearn HistGradientBoostingRegressor (binned, multi-threaded
+      via OpenMP); with the ``ordinal`` encoding the medication code is
+      treated as a native categorical feature.
+    """
+    meta = meta or {}
+    if backend == "gbr":
+        return GradientBoostingRegressor(
+            n_estimators=200,
+            max_depth=4,
+            learning_rate=0.1,
+            subsample=0.8,
+            random_state=42,
+        )
+    if backend == "hgb":
+        if meta.get("encoding") == "sparse":
+            raise ValueError("The 'hgb' backend does not accept the 'sparse' encoding.")
+        categorical = None
+        if meta.get("encoding") == "ordinal":
+            if len(meta.get("categories", [])) <= _HGB_MAX_CATEGORIES:
+                categorical = [feature_cols.index(MEDICATION_CODE_COLUMN)]
+            else:
+                logger.warning(
+                    "%d medications exceed HistGradientBoosting's %d-category limit; "
+                    "medication_code is used as a numeric feature.",
+                    len(meta["categories"]),
+                    _HGB_MAX_CATEGORIES,
+                )
+        return HistGradientBoostingRegressor(
+            max_iter=200,
+            learning_rate=0.1,
+            max_leaf_nodes=31,
+            early_stopping=False,
+            categorical_features=categorical,
+            random_state=42,
+        )
+    raise ValueError(f"Unknown backend '{backend}'. Valid backends: {', '.join(BACKENDS)}")
+
+
+def _atomic_dump(obj, path: Path) -> None:
+    """Dump *obj* to a temp file and rename it over *path*.
+
+    Running processes hot-reload artifacts (see ``charm.registry``), so they
+    must never observe a half-written file.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_json(obj: dict, path: Path) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(obj, indent=2))
+    os.replace(tmp_path, path)
+
+
+def build_training_matrix(
+    df: pd.DataFrame,
+    encoding: str = DEFAULT_ENCODING,
+):
+    """Encode a ``build_features(one_hot=False)`` frame for fitting.
+
+    Returns ``(X, feature_cols, meta)`` where *meta* records everything
+    inference needs to rebuild the same layout (see ``charm.encoding``).
+    """
+    check_encoding(encoding)
+    base_cols = get_base_feature_columns(df)
+    medications = df["medication"].tolist()
+    feature_cols = encoded_feature_columns(base_cols, medications, encoding)
+    lags, windows = parse_lag_spec(base_cols)
+
+    meta: dict = {"encoding": encoding, "lags": list(lags), "windows": list(windows)}
+    if encoding == "ordinal":
+        meta["categories"] = sorted(set(medications))
+
+    X = encode(
+        df[base_cols].to_numpy(dtype=np.float64),
+        medications,
+        feature_cols,
+        encoding,
+        categories=meta.get("categories"),
+    )
+    return X, feature_cols, meta
+
+
+def save_artifacts(model_dir_path: Path, model, feature_cols: list[str], meta: dict) -> None:
+    """Write model.joblib, columns.joblib and model_meta.json atomically.
+
+    The meta goes last and records the hash of the other two, so the
+    registry can tell a finished set from one caught mid-update.
+    """
+    model_dir_path.mkdir(parents=True, exist_ok=True)
+    model_path = model_dir_path / MODEL_FILE
+    cols_path = model_dir_path / COLUMNS_FILE
+    _atomic_dump(model, model_path)
+    _atomic_dump(feature_cols, cols_path)
+    meta = {
+        **meta,
+        ARTIFACT_HASHES: {p.name: file_sha256(p) for p in (model_path, cols_path)},
+    }
+    _atomic_write_json(meta, model_dir_path / META_FILE)
+    logger.info("Model saved to %s", model_path)
+    logger.info("Feature columns saved to %s", cols_path)
+
 
 def train_model(
     model_dir: str | None = None,
     db_path: str | None = None,
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+    encoding: str = DEFAULT_ENCODING,
+    backend: str = DEFAULT_BACKEND,
 ) -> Path:
-    """Train a global GradientBoostingRegressor and save artifacts.
+    """Train a global gradient-boosting model and save artifacts.
 
     Saves:
-        <model_dir>/model.joblib   — the trained model
-        <model_dir>/columns.joblib — ordered list of feature column names
+        <model_dir>/model.joblib     — the trained model
+        <model_dir>/columns.joblib   — ordered list of feature column names
+        <model_dir>/model_meta.json  — backend, medication encoding, lag/window set
 
     Returns the model directory Path.
     """
@@ -41,39 +193,196 @@ def train_model(
 
     conn = get_connection(db_path)
     try:
-        df = build_features(conn=conn)
+        df = build_features(conn=conn, lags=lags, windows=windows, one_hot=False)
     finally:
         conn.close()
 
-    feature_cols = get_feature_columns(df)
-    X = df[feature_cols].values
-    y = df[TARGET].values
-
-    logger.info("Training GradientBoostingRegressor on %d samples, %d features …", X.shape[0], X.shape[1])
+    X, feature_cols, meta = build_training_matrix(df, encoding)
+    y = df[TARGET].to_numpy()
+    meta["backend"] = backend
+    model = make_estimator(backend, feature_cols, meta)
 
-    model = GradientBoostingRegressor(
-        n_estimators=200,
-        max_depth=4,
-        learning_rate=0.1,
-        subsample=0.8,
-        random_state=42,
+    logger.info(
+        "Training %s on %d samples, %d features (%s encoding) …",
+        type(model).__name__, X.shape[0], X.shape[1], encoding,
     )
     model.fit(X, y)
 
-    # Quick in-sample metrics (we have only 240 rows; real eval would need CV)
+    # Quick in-sample metrics; out-of-sample numbers come from `python -m charm.backtest`
     y_pred = model.predict(X)
     mae = mean_absolute_error(y, y_pred)
     r2 = r2_score(y, y_pred)
     logger.info("In-sample MAE: %.2f | R²: %.4f", mae, r2)
 
-    # Save artifacts
-    model_path = model_dir_path / "model.joblib"
-    cols_path = model_dir_path / "columns.joblib"
-    joblib.dump(model, model_path)
-    joblib.dump(feature_cols, cols_path)
-    logger.info("Model saved to %s", model_path)
-    logger.info("Feature columns saved to %s", cols_path)
+    save_artifacts(model_dir_path, model, feature_cols, meta)
+
+    return model_dir_path
+
+
+# ── Partitioned training ─────────────────────────────────────────────
+
+def medication_clusters(df: pd.DataFrame, n_clusters: int = DEFAULT_CLUSTERS) -> dict[str, str]:
+    """Assign each medication to one of *n_clusters* demand-volume clusters.
+
+    Medications are bucketed by quantiles of log mean monthly usage, so each
+    cluster model is fitted on series of a similar scale.
+    """
+    level = np.log1p(df.groupby("medication")["quantity_used"].mean())
+    n = max(1, min(n_clusters, len(level)))
+    codes = pd.qcut(level.rank(method="first"), n, labels=False)
+    return {med: f"c{int(code)}" for med, code in codes.items()}
+
+
+def _partition_dir(model_dir_path: Path, by: str, key: str) -> Path:
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+    return model_dir_path / PARTITIONS_DIR / f"{by}={safe}"
+
+
+def _fit_partition(
+    key: str,
+    df: pd.DataFrame,
+    out_dir: str,
+    encoding: str,
+    backend: str,
+    threads: int | None = None,
+) -> dict:
+    """Fit and save one partition's model; runs inside a worker process.
+
+    *threads* caps the BLAS/OpenMP pools so parallel ``hgb`` fits do not
+    oversubscribe the machine. Returns the partition's manifest entry.
+    """
+    with threadpool_limits(limits=threads):
+        X, feature_cols, meta = build_training_matrix(df, encoding)
+        y = df[TARGET].to_numpy()
+        meta["backend"] = backend
+        meta["partition"] = key
+        model = make_estimator(backend, feature_cols, meta)
+        model.fit(X, y)
+        mae = mean_absolute_error(y, model.predict(X))
+    save_artifacts(Path(out_dir), model, feature_cols, meta)
+    return {
+        "rows": int(len(df)),
+        "medications": sorted(df["medication"].unique().tolist()),
+        "in_sample_mae": round(float(mae), 3),
+    }
 
+
+def train_partitioned(
+    by: str = "hospital",
+    model_dir: str | None = None,
+    db_path: str | None = None,
+    hospitals: Sequence[str] | None = None,
+    changed_only: bool = False,
+    n_clusters: int = DEFAULT_CLUSTERS,
+    workers: int | None = None,
+    lags: Sequence[int] = DEFAULT_LAGS,
+    windows: Sequence[int] = DEFAULT_WINDOWS,
+    encoding: str = DEFAULT_ENCODING,
+    backend: str = DEFAULT_BACKEND,
+) -> Path:
+    """Train independent models per hospital or per medication cluster.
+
+    Partitions are fitted in parallel on a ``ProcessPoolExecutor`` with
+    *workers* processes (default: all cores). Each writes its artifacts to
+    ``<model_dir>/partitions/<by>=<key>/`` and ``<model_dir>/manifest.json``
+    lists them for ``charm.copilot`` routing.
+
+    With ``by="hospital"`` only the hospitals named in *hospitals* — or,
+    with *changed_only*, those with orders newer than their manifest entry —
+    are retrained; other hospitals' entries are kept as they are. Cluster
+    mode always retrains every cluster.
+
+    Returns the model directory Path.
+    """
+    if by not in PARTITION_MODES:
+        raise ValueError(
+            f"Unknown partition mode '{by}'. Valid modes: {', '.join(PARTITION_MODES)}"
+        )
+    if by == "cluster" and (hospitals or changed_only):
+        raise ValueError("hospitals/changed_only only apply to by='hospital'.")
+
+    model_dir_path = Path(model_dir or MODEL_DIR)
+    previous = load_manifest(model_dir_path)
+    if previous is None or previous.get("by") != by or by == "cluster":
+        previous = {"partitions": {}}
+    if hospitals:
+        hospitals = sorted({h.upper() for h in hospitals})
+
+    conn = get_connection(db_path)
+    try:
+        watermarks = {
+            r["hospital"]: r["max_id"]
+            for r in conn.execute(
+                "SELECT hospital, MAX(id) AS max_id FROM orders GROUP BY hospital"
+            )
+        }
+        if changed_only:
+            known = previous["partitions"]
+            hospitals = sorted(
+                h for h, max_id in watermarks.items()
+                if known.get(h, {}).get("max_order_id") != max_id
+                and (not hospitals or h in hospitals)
+            )
+            if not hospitals:
+                logger.info("All hospital models are up to date.")
+                return model_dir_path
+        df = build_features(
+            conn=conn,
+            lags=lags,
+            windows=windows,
+            one_hot=False,
+            hospitals=hospitals if by == "hospital" else None,
+        )
+    finally:
+        conn.close()
+
+    if by == "hospital":
+        groups = dict(tuple(df.groupby("hospital", sort=True)))
+    else:
+        clusters = medication_clusters(df, n_clusters)
+        groups = dict(tuple(df.groupby(df["medication"].map(clusters), sort=True)))
+    out_dirs = {key: _partition_dir(model_dir_path, by, key) for key in groups}
+
+    n_workers = max(1, min(len(groups), workers or os.cpu_count() or 1))
+    logger.info(
+        "Training %d %s partition(s) on %d worker(s) …", len(groups), by, n_workers
+    )
+    if n_workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {
+                key: pool.submit(
+                    _fit_partition, key, part, str(out_dirs[key]), encoding, backend, threads
+                )
+                for key, part in groups.items()
+            }
+            results = {key: fut.result() for key, fut in futures.items()}
+    else:
+        results = {
+            key: _fit_partition(key, part, str(out_dirs[key]), encoding, backend)
+            for key, part in groups.items()
+        }
+
+    partitions = dict(previous["partitions"])
+    for key, entry in results.items():
+        entry["path"] = out_dirs[key].relative_to(model_dir_path).as_posix()
+        if by == "hospital":
+            entry["max_order_id"] = watermarks[key]
+        partitions[key] = entry
+        logger.info(
+            "Partition %s: %d rows, in-sample MAE %.2f", key, entry["rows"], entry["in_sample_mae"]
+        )
+
+    manifest = {
+        "by": by,
+        "encoding": encoding,
+        "backend": backend,
+        "lags": sorted(lags),
+        "windows": sorted(windows),
+        "partitions": dict(sorted(partitions.items())),
+    }
+    _atomic_write_json(manifest, model_dir_path / MANIFEST_FILE)
+    logger.info("Manifest saved to %s", model_dir_path / MANIFEST_FILE)
     return model_dir_path
 
 
@@ -94,8 +403,87 @@ def main() -> None:
         default=None,
         help="Path to SQLite database (default: CHARM_DB_PATH env or charm.db).",
     )
+    parser.add_argument(
+        "--lags",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_LAGS),
+        help="Lag offsets in months for lag_<k>_used/ordered (default: 1).",
+    )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_WINDOWS),
+        help="Rolling-mean windows in months (default: 3).",
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=ENCODINGS,
+        default=DEFAULT_ENCODING,
+        help=f"Medication encoding (default: {DEFAULT_ENCODING}).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help="Estimator backend: gbr (GradientBoosting) or hgb "
+             f"(multi-threaded HistGradientBoosting). Default: {DEFAULT_BACKEND}.",
+    )
+    parser.add_argument(
+        "--partition-by",
+        choices=PARTITION_MODES,
+        default=None,
+        help="Train one model per hospital or per medication cluster "
+             "instead of a single global model.",
+    )
+    parser.add_argument(
+        "--hospitals",
+        nargs="+",
+        default=None,
+        help="With --partition-by hospital: retrain only these hospitals.",
+    )
+    parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="With --partition-by hospital: retrain only hospitals with new orders.",
+    )
+    parser.add_argument(
+        "--clusters",
+        type=int,
+        default=DEFAULT_CLUSTERS,
+        help=f"With --partition-by cluster: number of clusters (default: {DEFAULT_CLUSTERS}).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes for partitioned training (default: all cores).",
+    )
     args = parser.parse_args()
-    train_model(args.model_dir, args.db)
+    if args.partition_by:
+        train_partitioned(
+            args.partition_by,
+            args.model_dir,
+            args.db,
+            hospitals=args.hospitals,
+            changed_only=args.changed_only,
+            n_clusters=args.clusters,
+            workers=args.workers,
+            lags=args.lags,
+            windows=args.windows,
+            encoding=args.encoding,
+            backend=args.backend,
+        )
+        return
+    train_model(
+        args.model_dir,
+        args.db,
+        lags=args.lags,
+        windows=args.windows,
+        encoding=args.encoding,
+        backend=args.backend,
+    )
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ CHARM Copilot utilities — logging setup, month helpers.
 import calendar
 import logging
 import sys
+from datetime import date
 
 from charm.config import MONTH_NAME_TO_NUM, MONTH_NAMES
 
@@ -36,8 +37,43 @@ def month_name_to_num(name: str) -> int:
     return MONTH_NAME_TO_NUM[key]
 
 
-def days_in_month(month_num: int, year: int = 2025) -> int:
-    """Return the number of days in *month_num* for *year*."""
+def days_in_month(month_num: int, year: int | None = None) -> int:
+    """Return the number of days in *month_num* for *year* (default: this year)."""
     if not 1 <= month_num <= 12:
         raise ValueError(f"month_num must be 1–12, got {month_num}")
-    return calendar.monthrange(year, month_num)[1]
+    return calendar.monthrange(year or date.today().year, month_num)[1]
+
+
+def order_period(month_num: int, purchase_date: str) -> str:
+    """Return the ``YYYY-MM`` period an order for *month_num* belongs to.
+
+    The year is the purchase year, shifted by one when the order month is
+    more than six months away from the purchase month (e.g. a December
+    purchase for January stock). Mirrors ``charm.db.period_sql``.
+    """
+    year, purchase_month = int(purchase_date[:4]), int(purchase_date[5:7])
+    if month_num - purchase_month > 6:
+        year -= 1
+    elif month_num - purchase_month < -6:
+        year += 1
+    return f"{year:04d}-{month_num:02d}"
+
+
+def period_index(period: str) -> int:
+    """Monotonic month number for a ``YYYY-MM`` period (``year * 12 + month``)."""
+    return int(period[:4]) * 12 + int(period[5:7])
+
+
+def shift_period(period: str, months: int) -> str:
+    """Return the ``YYYY-MM`` period *months* after *period* (negative: before)."""
+    index = period_index(period) - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def next_month_start(month_num: int, today: date | None = None) -> date:
+    """First day of the next occurrence of *month_num*, counting this month."""
+    if not 1 <= month_num <= 12:
+        raise ValueError(f"month_num must be 1–12, got {month_num}")
+    today = today or date.today()
+    year = today.year if month_num >= today.month else today.year + 1
+    return date(year, month_num, 1)
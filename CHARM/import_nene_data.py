@@ -1,10 +1,11 @@
 import csv
-from pymongo import MongoClient
 from datetime import datetime
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['charm_inventory']
+from charm.storage import close_mongo, get_mongo_db
+from KaltriDB import buffered_usage_log
+
+# Connect to MongoDB (shared client settings from charm.config)
+db = get_mongo_db('charm_inventory')
 inventory_collection = db['inventory']
 usage_collection = db['usage_logs']
 
@@ -15,7 +16,8 @@ usage_collection.delete_many({'hospital': 'A'})
 
 # Read and process CSV
 print("Loading data from CSV...")
-with open('data/nene_tereza_synthetic_orders_2025_with_consumption.csv', 'r') as file:
+with open('data/nene_tereza_synthetic_orders_2025_with_consumption.csv', 'r') as file, \
+        buffered_usage_log(usage_collection) as usage_log:
     csv_reader = csv.DictReader(file)
     
     # Dictionary to accumulate inventory
@@ -64,7 +66,7 @@ with open('data/nene_tereza_synthetic_orders_2025_with_consumption.csv', 'r') as
             'avg_daily_consumption': avg_daily_consumption,
             'logged_at': datetime.now()
         }
-        usage_collection.insert_one(usage_entry)
+        usage_log.add(usage_entry)
     
     # Insert inventory items
     print(f"Inserting {len(inventory_items)} unique medications into inventory...")
@@ -94,4 +96,4 @@ low_stock = inventory_collection.count_documents({
 })
 print(f"   - Low stock items (< 100 units): {low_stock}")
 
-client.close()
+close_mongo()
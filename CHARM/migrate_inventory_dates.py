@@ -0,0 +1,32 @@
+"""One-shot migration: convert inventory date strings to BSON dates.
+
+Older versions of KaltriDB.add_item stored date_added and expiry_date as
+"YYYY-MM-DD" strings, which cannot be range-queried through an index. This
+converts them in place, server-side, in every inventory_<h> collection and
+then creates the expiry_date/quantity indexes. Safe to re-run: documents
+that already hold dates are left alone, and strings that do not parse are
+kept as they are (and reported).
+
+    python migrate_inventory_dates.py
+"""
+from KaltriDB import db, ensure_indexes
+
+DATE_FIELDS = ["date_added", "expiry_date"]
+
+for name in sorted(db.list_collection_names(filter={"name": {"$regex": "^inventory_"}})):
+    collection = db[name]
+    for field in DATE_FIELDS:
+        result = collection.update_many(
+            {field: {"$type": "string"}},
+            [{"$set": {field: {"$dateFromString": {
+                "dateString": f"${field}",
+                "format": "%Y-%m-%d",
+                "onError": f"${field}",
+            }}}}],
+        )
+        left = collection.count_documents({field: {"$type": "string"}})
+        print(f"  {name}.{field}: converted {result.modified_count}"
+              + (f", {left} unparseable left as strings" if left else ""))
+
+ensure_indexes()
+print("✅ Inventory dates migrated and indexed.")
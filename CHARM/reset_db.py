@@ -1,10 +1,10 @@
-from pymongo import MongoClient
+from charm.storage import get_mongo_db
 
-client = MongoClient('mongodb://localhost:27017/')
-db = client.hospital_inventory
+db = get_mongo_db()
 
 # Clear collections to allow re-seeding
 db['inventory_a'].drop()
 db['usage_logs'].delete_many({'hospital': 'A'}) # Only clear usage for A
+db['usage_monthly'].delete_many({'hospital': 'A'}) # ...and its monthly rollups
 
 print("✅ Hospital A inventory and usage logs cleared.")
@@ -0,0 +1,90 @@
+"""Shared fixtures: an in-memory MongoDB (mongomock) behind charm.storage."""
+
+import re
+import threading
+
+import mongomock
+import pytest
+from mongomock.filtering import filter_applies
+from pymongo import UpdateOne
+
+import charm.storage as storage
+
+_ARRAY_FILTER_PATH = re.compile(r"(.+)\.\$\[(\w+)\]\.(.+)")
+
+
+def _resolve_array_filters(collection, query, update, array_filters):
+    """Rewrite ``$[name]`` paths to concrete indexes of the matching document.
+
+    mongomock does not implement ``arrayFilters``; this resolves them the
+    way the server does for the single document the query selects.
+    """
+    doc = collection.find_one(query)
+    if doc is None:
+        return query, update
+    resolved = {}
+    for op, fields in update.items():
+        out = {}
+        for path, value in fields.items():
+            match = _ARRAY_FILTER_PATH.fullmatch(path)
+            if not match:
+                out[path] = value
+                continue
+            array, name, rest = match.groups()
+            conditions = [f for f in array_filters if all(k.split(".")[0] == name for k in f)]
+            for i, elem in enumerate(doc.get(array, [])):
+                if all(filter_applies(c, {name: elem}) for c in conditions):
+                    out[f"{array}.{i}.{rest}"] = value
+        resolved[op] = out
+    return {"_id": doc["_id"]}, resolved
+
+
+class _ServerCollection(mongomock.Collection):
+    """mongomock collection with the server behaviour CHARM relies on.
+
+    Single-document writes are serialised (as the server does per
+    document), ``array_filters`` are resolved, and ``bulk_write`` accepts
+    the pymongo ``UpdateOne`` objects mongomock cannot unpack.
+    """
+
+    _write_lock = threading.RLock()
+
+    def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        with self._write_lock:
+            if array_filters:
+                filter, update = _resolve_array_filters(self, filter, update, array_filters)
+            return super().update_one(filter, update, upsert=upsert, **kwargs)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None,
+                            upsert=False, return_document=False, array_filters=None, **kwargs):
+        with self._write_lock:
+            if array_filters:
+                filter, update = _resolve_array_filters(self, filter, update, array_filters)
+            return super().find_one_and_update(filter, update, projection=projection, sort=sort,
+                                               upsert=upsert, return_document=return_document,
+                                               **kwargs)
+
+    def find_one_and_delete(self, *args, **kwargs):
+        with self._write_lock:
+            return super().find_one_and_delete(*args, **kwargs)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        for op in requests:
+            assert isinstance(op, UpdateOne), op
+            self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Route charm.storage (and so KaltriDB and app) to a fresh in-memory client."""
+    get_collection = mongomock.Database.get_collection
+
+    def server_collection(self, name, *args, **kwargs):
+        collection = get_collection(self, name, *args, **kwargs)
+        collection.__class__ = _ServerCollection
+        return collection
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongomock.Database, "get_collection", server_collection)
+    monkeypatch.setattr(storage, "get_mongo_client", lambda: client)
+    return client
@@ -0,0 +1,211 @@
+"""Tests for the Flask app routes (mongomock)."""
+
+import time
+
+import pytest
+from bson import ObjectId
+
+import app as charm_app
+import KaltriDB
+
+
+@pytest.fixture
+def client(mongo, monkeypatch):
+    monkeypatch.setattr(KaltriDB, "_indexed_inventories", set())
+    monkeypatch.setattr(KaltriDB, "_usage_buffer", KaltriDB.UsageLogBuffer(
+        KaltriDB.usage_collection, rollups=KaltriDB.rollup_collection, flush_interval=None))
+    monkeypatch.setattr(charm_app, "_database_ready", False)
+    charm_app.app.config["TESTING"] = True
+    with charm_app.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess.update(username="admin_a", role="hospital_admin", hospital="A",
+                        display_name="Admin A")
+        yield client
+
+
+def _login(client, **user):
+    with client.session_transaction() as sess:
+        sess.update(user)
+
+
+def _flashes(client):
+    with client.session_transaction() as sess:
+        return [message for _, message in sess.pop("_flashes", [])]
+
+
+def test_stock_forms_reject_bad_numbers(client):
+    KaltriDB.add_item("A", "Med", 20, 1.0, "2025-01-05", "2030-01-01")
+    item_id = KaltriDB.get_inventory("A")[0]["_id"]
+
+    for quantity in ("", "abc", "-3", "2.5"):
+        assert client.post(f"/update_item/{item_id}", data={"quantity": quantity}).status_code == 302
+        assert _flashes(client) == ["Quantity must be a whole number of units."]
+    for units in ("", "x", "0"):
+        assert client.post(f"/consume_item/{item_id}", data={"units": units}).status_code == 302
+        assert _flashes(client) == ["Units used must be a whole number above zero."]
+
+    client.post(f"/consume_item/{item_id}", data={"units": " 5 "})
+    assert _flashes(client) == ["Logged use of 5 units."]
+    client.post(f"/consume_item/{item_id}", data={"units": "16"})
+    assert _flashes(client) == ["Not enough stock to use that many units."]
+    assert KaltriDB.get_inventory("A")[0]["quantity"] == 15
+
+
+@pytest.mark.parametrize("query", [
+    "inv_after=garbage", "log_before=garbage", "log_before=2024-01-01_zz",
+    "log_before=not-a-date_65f0c0ffee0000000000abcd",
+])
+def test_list_ignores_malformed_cursors(client, query):
+    KaltriDB.add_item("A", "Med", 5, 1.0, "2025-01-05", "2030-01-01")
+    resp = client.get(f"/list?{query}")
+    assert resp.status_code == 200
+    assert b"Med" in resp.data
+
+
+def test_first_request_creates_indexes(client, mongo):
+    db = mongo["hospital_inventory"]
+    db["inventory_a"].insert_one({"name": "Med", "quantity": 1})
+    assert "hospital_date" not in db["usage_logs"].index_information()
+
+    client.get("/list")
+    assert "hospital_date" in db["usage_logs"].index_information()
+    assert "expiry_date" in db["inventory_a"].index_information()
+    assert charm_app._database_ready
+
+
+def _offer(hospital, price):
+    return {"offering_hospital": hospital, "offer_price": price, "status": "pending"}
+
+
+def test_accept_offer_declines_the_rest_once(client, mongo):
+    requests = mongo["hospital_inventory"]["requests"]
+    # Stored before offers had ids; the first request backfills them
+    mine = requests.insert_one({"requesting_hospital": "A", "status": "offered",
+                                "offers": [_offer("B", 10.0), _offer("C", 9.0), _offer("D", 8.0)]})
+    other = requests.insert_one({"requesting_hospital": "B", "status": "offered",
+                                 "offers": [_offer("A", 5.0)]})
+    client.get("/my_requests")
+    assert {"requesting_hospital_status", "status"} <= set(requests.index_information())
+    offers = requests.find_one(mine.inserted_id)["offers"]
+    assert all("offer_id" in o for o in offers)
+    before_other = requests.find_one(other.inserted_id)
+
+    chosen = offers[1]["offer_id"]
+    client.post(f"/accept_offer/{mine.inserted_id}/{chosen}")
+    assert _flashes(client) == ["Offer accepted!"]
+    req = requests.find_one(mine.inserted_id)
+    assert req["status"] == "accepted"
+    assert [o["status"] for o in req["offers"]] == ["declined", "accepted", "declined"]
+    assert [o["offer_id"] for o in req["offers"]] == [o["offer_id"] for o in offers]
+    assert requests.find_one(other.inserted_id) == before_other
+
+    # Accepting again, or another offer afterwards, changes nothing
+    for offer_id in (chosen, offers[0]["offer_id"]):
+        client.post(f"/accept_offer/{mine.inserted_id}/{offer_id}")
+        assert _flashes(client) == ["Unauthorized action."]
+    assert requests.find_one(mine.inserted_id) == req
+
+    # Not the requesting hospital
+    client.post(f"/accept_offer/{other.inserted_id}/{before_other['offers'][0]['offer_id']}")
+    assert _flashes(client) == ["Unauthorized action."]
+    assert requests.find_one(other.inserted_id) == before_other
+
+
+def test_decline_last_offer_reopens_request(client, mongo):
+    requests = mongo["hospital_inventory"]["requests"]
+    offers = [dict(_offer("B", 10.0), offer_id=ObjectId()), dict(_offer("C", 9.0), offer_id=ObjectId())]
+    req_id = requests.insert_one({"requesting_hospital": "A", "status": "offered",
+                                  "offers": offers}).inserted_id
+
+    client.post(f"/decline_offer/{req_id}/{offers[0]['offer_id']}")
+    req = requests.find_one(req_id)
+    assert req["status"] == "offered"
+    assert [o["status"] for o in req["offers"]] == ["declined", "pending"]
+
+    client.post(f"/decline_offer/{req_id}/{offers[1]['offer_id']}")
+    req = requests.find_one(req_id)
+    assert req["status"] == "pending"
+    assert [o["status"] for o in req["offers"]] == ["declined", "declined"]
+
+
+def test_batch_unknown_hospital_is_a_client_error(client, monkeypatch):
+    import charm.copilot
+
+    def unknown(requests):
+        raise charm.copilot.UnknownHospitalError("No medications found for hospital 'Z'")
+
+    monkeypatch.setattr(charm.copilot, "recommend_orders_batch", unknown)
+    _login(client, role="distributor", hospital=None)
+    resp = client.post("/api/copilot/batch", json={"requests": [{"hospital": "Z", "month": "April"}]})
+    assert resp.status_code == 400
+    assert "hospital 'Z'" in resp.get_json()["error"]
+
+
+def test_batch_pins_hospital_admins(client, monkeypatch):
+    import charm.copilot
+
+    calls = []
+    monkeypatch.setattr(charm.copilot, "recommend_orders_batch",
+                        lambda requests: calls.append(requests) or [])
+    batch = [{"hospital": "A", "next_month": "April"}, {"hospital": "B", "next_month": "April"}]
+    resp = client.post("/api/copilot/batch", json={"requests": batch})
+    assert resp.status_code == 403
+    assert calls == []
+
+    resp = client.post("/api/copilot/batch", json={"requests": [{"next_month": "April"}]})
+    assert resp.status_code == 200
+    assert calls == [[{"hospital": "A", "next_month": "April"}]]
+
+    _login(client, role="distributor", hospital=None)
+    assert client.post("/api/copilot/batch", json={"requests": batch}).status_code == 200
+    assert calls[-1] == batch
+
+
+def test_copilot_routes_pin_hospital_admins(client, monkeypatch):
+    import charm.copilot
+
+    calls = []
+
+    def fake_recommend(next_month, current_stock, safety_buffer=0.20, hospital=None, **kwargs):
+        calls.append(hospital)
+        return []
+
+    monkeypatch.setattr(charm.copilot, "recommend_orders", fake_recommend)
+    assert client.post("/api/copilot", json={"month": "April"}).status_code == 200
+    assert client.post("/api/copilot", json={"month": "April", "hospital": "a"}).status_code == 200
+    resp = client.post("/api/copilot", json={"month": "April", "hospital": "B"})
+    assert resp.status_code == 403
+    assert client.post("/api/copilot/jobs", json={"month": "May", "hospital": "B"}).status_code == 403
+
+    resp = client.post("/api/copilot/jobs", json={"month": "May"})
+    assert resp.status_code == 202
+    poll = resp.get_json()["poll"]
+    deadline = time.monotonic() + 5
+    while client.get(poll).get_json()["status"] not in ("done", "failed"):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert client.get(poll).get_json()["status"] == "done"
+    assert calls == ["A", "a", "A"]
+
+    _login(client, role="distributor", hospital=None)
+    assert client.post("/api/copilot", json={"month": "April", "hospital": "B"}).status_code == 200
+    assert calls[-1] == "B"
+
+
+def test_forecast_scoped_and_validated(client, monkeypatch):
+    import charm.copilot
+
+    calls = []
+
+    def fake_forecast(start_month, months=6, hospital=None, **kwargs):
+        if months < 1:
+            raise ValueError(f"months must be >= 1, got {months}")
+        calls.append((hospital, months))
+        return []
+
+    monkeypatch.setattr(charm.copilot, "forecast_horizon", fake_forecast)
+    assert client.post("/api/copilot/forecast", json={"month": "April", "months": "3"}).status_code == 200
+    assert client.post("/api/copilot/forecast", json={"month": "April", "hospital": "B"}).status_code == 403
+    assert client.post("/api/copilot/forecast", json={"month": "April", "months": "six"}).status_code == 400
+    assert client.post("/api/copilot/forecast", json={"month": "April", "months": 0}).status_code == 400
+    assert calls == [("A", 3)]
@@ -0,0 +1,66 @@
+"""Tests for charm.backtest — walk-forward folds, order simulation, report."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from charm.backtest import run_backtest, simulate_orders, walk_forward_folds
+from charm.db import init_db
+from charm.ingest import ingest_csv
+
+CSV_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "data",
+    "nene_tereza_synthetic_orders_2025_with_consumption.csv",
+)
+
+
+def test_walk_forward_folds_never_peek():
+    folds = walk_forward_folds(range(1, 13), min_train=6, horizon=2, step=3)
+    assert folds == [(6, [7, 8]), (9, [10, 11])]
+    for train_end, test in folds:
+        assert all(t > train_end for t in test)
+    with pytest.raises(ValueError):
+        walk_forward_folds(range(1, 7), min_train=6)
+
+
+def test_simulate_orders_carries_stock():
+    preds = pd.DataFrame(
+        {
+            "hospital": "A",
+            "medication": "X",
+            "_t": [1, 2, 3],
+            "predicted": [100.0, 100.0, 100.0],
+            "actual": [90.0, 130.0, 100.0],
+        }
+    )
+    out = simulate_orders(preds, safety_buffer=0.0)
+    # Month 1: order 100, 10 left; month 2: order 90, short 30; month 3: order 100.
+    np.testing.assert_array_equal(out["ordered"], [100, 90, 100])
+    np.testing.assert_array_equal(out["stockout_units"], [0, 30, 0])
+    np.testing.assert_array_equal(out["overstock_units"], [10, 0, 0])
+
+
+def test_run_backtest_reports_and_caches(tmp_path):
+    db_path = str(tmp_path / "test_charm.db")
+    cache_dir = str(tmp_path / "cache")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+
+    result = run_backtest(db_path, min_train=9, n_jobs=2, cache_dir=cache_dir)
+
+    assert len(result["folds"]) == 3
+    assert len(result["predictions"]) == 3 * 20
+    assert set(result["overall"]) >= {"mae", "mape", "bias", "stockout_units", "overstock_units"}
+    assert len(result["per_medication"]) == 20
+    assert result["overall"]["mape"] < 50
+    assert os.listdir(cache_dir)
+
+    # Cached fold matrices give identical predictions with another job count
+    again = run_backtest(db_path, min_train=9, n_jobs=1, cache_dir=cache_dir)
+    np.testing.assert_allclose(
+        again["predictions"]["predicted"], result["predictions"]["predicted"]
+    )
@@ -1,13 +1,30 @@
 """Tests for charm.copilot — recommendation output format."""
 
 import os
+import sqlite3
+from datetime import date, timedelta
+from pathlib import Path
 
+import joblib
+import pandas as pd
 import pytest
 
-from charm.copilot import recommend_orders
-from charm.db import init_db
+from charm.cache import LRUCache
+from charm.copilot import (
+    UnknownHospitalError,
+    _build_inference_features,
+    _expiry_batch,
+    _load_model,
+    forecast_horizon,
+    get_prediction_cache,
+    recommend_orders,
+    recommend_orders_batch,
+)
+from charm.db import get_connection, init_db
+from charm.features import ensure_feature_store
 from charm.ingest import ingest_csv
-from charm.train import train_model
+from charm.registry import ModelRegistry, get_model
+from charm.train import save_artifacts, train_model
 
 CSV_PATH = os.path.join(
     os.path.dirname(__file__),
@@ -78,3 +95,281 @@ def test_recommend_orders_zero_stock(pipeline):
 
     total_order = sum(r["recommended_order"] for r in recs)
     assert total_order > 0, "With zero stock, total recommended orders should be > 0."
+
+
+def test_inference_features_layout(pipeline):
+    """Batched inference matrix follows columns.joblib order, one row per med."""
+    db_path, model_dir = pipeline
+    _, feature_cols = _load_model(model_dir)
+
+    meds = ["Paracetamol 500mg tablets", "Unknown medication"]
+    conn = get_connection(db_path)
+    try:
+        X = _build_inference_features(conn, 4, meds, feature_cols)
+    finally:
+        conn.close()
+
+    assert X.shape == (2, len(feature_cols))
+    assert (X[:, feature_cols.index("month_num")] == 4).all()
+    assert X[0, feature_cols.index("med_Paracetamol 500mg tablets")] == 1
+    # Unknown medication gets fallback lags and no one-hot cell
+    med_idx = [i for i, c in enumerate(feature_cols) if c.startswith("med_")]
+    assert X[1, med_idx].sum() == 0
+    assert X[1, feature_cols.index("lag_1_used")] > 0
+
+
+def test_model_registry_hot_reload(pipeline):
+    """The registry serves hits from memory and reloads only on change."""
+    db_path, model_dir = pipeline
+    registry = ModelRegistry()
+
+    first = registry.get(model_dir)
+    assert registry.get(model_dir) is first
+    assert registry.stats()["loads"] == 1
+    assert registry.stats()["hits"] == 1
+
+    # Touching without changing content revalidates via hash, no reload
+    cols_path = os.path.join(model_dir, "columns.joblib")
+    st = os.stat(cols_path)
+    os.utime(cols_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert registry.get(model_dir).model is first.model
+    assert registry.stats()["loads"] == 1
+
+    # Retraining rewrites the artifacts → new version swapped in
+    save_artifacts(Path(model_dir), first.model, first.feature_cols[::-1], first.meta)
+    second = registry.get(model_dir)
+    assert second is not first
+    assert second.version != first.version
+    assert second.feature_cols == first.feature_cols[::-1]
+    assert registry.stats()["loads"] == 2
+
+
+def test_model_registry_skips_half_written_artifacts(pipeline, monkeypatch):
+    """New columns next to the old meta (save in progress) never get loaded."""
+    db_path, model_dir = pipeline
+    monkeypatch.setattr("charm.registry.time.sleep", lambda s: None)
+    registry = ModelRegistry()
+    first = registry.get(model_dir)
+
+    cols_path = os.path.join(model_dir, "columns.joblib")
+    joblib.dump(first.feature_cols[::-1], cols_path)
+    assert registry.get(model_dir) is first
+    assert registry.stats()["loads"] == 1
+    with pytest.raises(RuntimeError, match="do not match"):
+        ModelRegistry().get(model_dir)
+
+    # Once the meta lands, the finished set is picked up
+    save_artifacts(Path(model_dir), first.model, first.feature_cols[::-1], first.meta)
+    assert registry.get(model_dir).feature_cols == first.feature_cols[::-1]
+
+
+def test_recommend_orders_custom_lag_set(tmp_path):
+    """Models trained on a non-default lag/window set predict end to end."""
+    db_path = str(tmp_path / "charm.db")
+    model_dir = str(tmp_path / "models")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+    train_model(model_dir=model_dir, db_path=db_path, lags=(1, 2), windows=(3, 6))
+
+    recs = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    assert len(recs) == 20
+    assert all(r["predicted_demand"] > 0 for r in recs)
+
+
+def test_expiry_warnings_single_query(pipeline):
+    """Expiry comes from each medication's latest month, fetched in one query."""
+    db_path, model_dir = pipeline
+    soon = (date.today() + timedelta(days=30)).isoformat()
+    conn = get_connection(db_path)
+    conn.execute(
+        "UPDATE orders SET expiration_date = ? "
+        "WHERE medication = 'Insulin glargine' AND month_num = 12",
+        (soon,),
+    )
+    conn.execute("UPDATE orders SET expiration_date = '2099-01-01' WHERE month_num < 12")
+    conn.commit()
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    expiry = _expiry_batch(conn)
+    conn.close()
+    assert len(statements) == 1
+    assert len(expiry) == 20
+    assert expiry.loc["Insulin glargine", "expiration_date"] == soon
+    assert expiry.loc["Insulin glargine", "days_left"] in (29, 30)
+
+    recs = {
+        r["medication"]: r
+        for r in recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    }
+    assert any(w.startswith("expiry_risk") for w in recs["Insulin glargine"]["warnings"])
+
+
+def test_forecast_horizon_recursive(pipeline, monkeypatch):
+    """Step 1 of the horizon matches recommend_orders; one predict per step."""
+    db_path, model_dir = pipeline
+
+    recs = {
+        r["medication"]: r["predicted_demand"]
+        for r in recommend_orders("November", {}, model_dir=model_dir, db_path=db_path)
+    }
+
+    loaded = get_model(model_dir)
+    calls = []
+    predict = loaded.model.predict
+    monkeypatch.setattr(loaded.model, "predict", lambda X: calls.append(X.shape) or predict(X))
+
+    forecast = forecast_horizon("November", months=12, model_dir=model_dir, db_path=db_path)
+
+    assert len(forecast) == 20
+    assert len(calls) == 12 and all(shape[0] == 20 for shape in calls)
+    assert forecast[0]["months"][:3] == ["November", "December", "January"]
+    for r in forecast:
+        assert len(r["predicted_demand"]) == 12
+        assert r["predicted_demand"][0] == recs[r["medication"]]
+        assert r["total"] == pytest.approx(sum(r["predicted_demand"]), abs=1.0)
+
+
+def test_prediction_cache_skips_inference(pipeline, monkeypatch):
+    """Stock or buffer changes reuse cached demand; new orders invalidate it."""
+    db_path, model_dir = pipeline
+    cache = get_prediction_cache()
+    loaded = get_model(model_dir)
+    calls = []
+    predict = loaded.model.predict
+    monkeypatch.setattr(loaded.model, "predict", lambda X: calls.append(1) or predict(X))
+
+    first = recommend_orders("May", {}, model_dir=model_dir, db_path=db_path)
+    hits = cache.stats()["hits"]
+    second = recommend_orders(
+        "May", {first[0]["medication"]: 10_000}, safety_buffer=0.5,
+        model_dir=model_dir, db_path=db_path,
+    )
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == hits + 1
+    assert [r["predicted_demand"] for r in sorted(first, key=lambda r: r["medication"])] == [
+        r["predicted_demand"] for r in sorted(second, key=lambda r: r["medication"])
+    ]
+    assert next(r for r in second if r["current_stock"] == 10_000)["recommended_order"] == 0
+
+    conn = get_connection(db_path)
+    conn.execute(
+        "INSERT INTO orders (order_month, month_num, medication, quantity, purchase_date, "
+        "expiration_date, quantity_used, avg_daily_consumption) "
+        "VALUES ('May', 5, 'Insulin glargine', 10, '2025-05-01', '2026-05-01', 5, 0.2)"
+    )
+    conn.commit()
+    conn.close()
+    recommend_orders("May", {}, model_dir=model_dir, db_path=db_path)
+    assert len(calls) == 2
+
+
+def test_baseline_database_is_migrated_on_first_use(pipeline, tmp_path):
+    """A database from before hospitals, periods and the feature store just works."""
+    db_path, model_dir = pipeline
+    columns = ("source_file, row_hash, order_month, month_num, medication, quantity, "
+               "purchase_date, expiration_date, quantity_used, avg_daily_consumption")
+    old_path = str(tmp_path / "baseline.db")
+    old = sqlite3.connect(old_path)
+    old.execute(
+        "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, source_file TEXT, "
+        "row_hash TEXT UNIQUE, order_month TEXT NOT NULL, month_num INTEGER NOT NULL, "
+        "medication TEXT NOT NULL, quantity INTEGER NOT NULL, purchase_date TEXT NOT NULL, "
+        "expiration_date TEXT NOT NULL, quantity_used INTEGER NOT NULL, "
+        "avg_daily_consumption REAL NOT NULL)"
+    )
+    old.execute("ATTACH DATABASE ? AS current", (db_path,))
+    old.execute(f"INSERT INTO orders ({columns}) SELECT {columns} FROM current.orders ORDER BY id")
+    old.commit()
+    old.close()
+
+    expected = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path, use_cache=False)
+    recs = recommend_orders("April", {}, model_dir=model_dir, db_path=old_path, use_cache=False)
+    assert recs == expected
+
+
+def test_prediction_cache_invalidated_by_order_updates(pipeline):
+    db_path, model_dir = pipeline
+    recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+
+    conn = get_connection(db_path)
+    conn.execute("UPDATE orders SET quantity = quantity / 10, quantity_used = quantity_used / 10")
+    conn.commit()
+    ensure_feature_store(conn)
+    conn.close()
+
+    cached = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    fresh = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path, use_cache=False)
+    assert [r["predicted_demand"] for r in cached] == [r["predicted_demand"] for r in fresh]
+
+
+@pytest.fixture()
+def two_hospitals(tmp_path):
+    """The sample export as hospital A, and again as hospital B with doubled usage."""
+    db_path = str(tmp_path / "test_charm.db")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+    df = pd.read_csv(CSV_PATH)
+    df["quantity"] *= 2
+    df["quantity_used"] *= 2
+    df["hospital"] = "B"
+    csv_b = tmp_path / "hospital_b.csv"
+    df.to_csv(csv_b, index=False)
+    ingest_csv(str(csv_b), db_path=db_path)
+    return db_path, tmp_path
+
+
+@pytest.mark.parametrize("encoding", ["onehot", "sparse"])
+def test_recommend_orders_batch_single_predict(two_hospitals, monkeypatch, encoding):
+    db_path, tmp_path = two_hospitals
+    model_dir = str(tmp_path / f"models_{encoding}")
+    train_model(model_dir=model_dir, db_path=db_path, encoding=encoding)
+
+    requests = [
+        {"hospital": "A", "next_month": "April", "current_stock": {}},
+        {"hospital": "b", "next_month": "April", "safety_buffer": 0.5},
+        {"hospital": "A", "next_month": "April",
+         "current_stock": {"Insulin glargine": 10_000}},
+        {"hospital": "B", "next_month": "June"},
+    ]
+    expected = [
+        recommend_orders(
+            r["next_month"], r.get("current_stock", {}), r.get("safety_buffer", 0.20),
+            model_dir=model_dir, db_path=db_path, hospital=r["hospital"], use_cache=False,
+        )
+        for r in requests
+    ]
+
+    loaded = get_model(model_dir)
+    calls = []
+    predict = loaded.model.predict
+    monkeypatch.setattr(loaded.model, "predict", lambda X: calls.append(X.shape) or predict(X))
+
+    batch = recommend_orders_batch(requests, model_dir=model_dir, db_path=db_path,
+                                   use_cache=False)
+
+    # A/April is scored once for both of its requests: 3 blocks × 20 rows.
+    assert calls == [(60, calls[0][1])]
+    assert [b["hospital"] for b in batch] == ["A", "B", "A", "B"]
+    for got, want in zip(batch, expected):
+        assert got["recommendations"] == want
+
+    with pytest.raises(UnknownHospitalError, match="hospital 'Z'"):
+        recommend_orders_batch([{"hospital": "Z", "next_month": "April"}],
+                               model_dir=model_dir, db_path=db_path)
+
+
+def test_lru_cache_eviction_and_ttl():
+    now = [0.0]
+    cache = LRUCache(maxsize=2, ttl=10.0, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+    now[0] = 10.0
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (
+        2, 2, 1, 1
+    )
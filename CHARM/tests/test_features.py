@@ -0,0 +1,263 @@
+"""Tests for charm.features — incremental feature store."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from charm.db import get_connection, init_db
+from charm.features import (
+    add_lag_features,
+    build_features,
+    ensure_feature_store,
+    get_feature_columns,
+    is_feature_store_stale,
+    refresh_feature_store,
+)
+from charm.ingest import ingest_csv
+
+CSV_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "data",
+    "nene_tereza_synthetic_orders_2025_with_consumption.csv",
+)
+
+FEATURE_COLS = [
+    "medication",
+    "month_num",
+    "lag_1_used",
+    "lag_1_ordered",
+    "rolling_mean_3_used",
+]
+
+
+def _split_csv(tmp_path, months: list[str]) -> str:
+    df = pd.read_csv(CSV_PATH)
+    part = df[df["order_month"].isin(months)]
+    path = tmp_path / f"part_{len(months)}_{months[0]}.csv"
+    part.to_csv(path, index=False)
+    return str(path)
+
+
+def _features(db_path: str) -> pd.DataFrame:
+    df = build_features(db_path=db_path)
+    return df[FEATURE_COLS].sort_values(["medication", "month_num"]).reset_index(drop=True)
+
+
+def test_incremental_matches_full_rebuild(tmp_path):
+    full_db = str(tmp_path / "full.db")
+    inc_db = str(tmp_path / "inc.db")
+    init_db(full_db)
+    init_db(inc_db)
+    ingest_csv(CSV_PATH, db_path=full_db)
+
+    months = pd.read_csv(CSV_PATH)["order_month"].unique().tolist()
+    # Later months first, then the earlier ones: successors must be recomputed
+    ingest_csv(_split_csv(tmp_path, months[6:]), db_path=inc_db)
+    ingest_csv(_split_csv(tmp_path, months[:6]), db_path=inc_db)
+
+    pd.testing.assert_frame_equal(_features(full_db), _features(inc_db))
+
+
+def test_refresh_only_touches_delta(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    months = pd.read_csv(CSV_PATH)["order_month"].unique().tolist()
+    ingest_csv(_split_csv(tmp_path, months[:11]), db_path=db_path)
+
+    conn = get_connection(db_path)
+    try:
+        assert refresh_feature_store(conn) == 0  # already up to date
+    finally:
+        conn.close()
+
+    # Appending December rewrites exactly one row per medication
+    conn = get_connection(db_path)
+    try:
+        df = pd.read_csv(_split_csv(tmp_path, months[11:]))
+        conn.executemany(
+            """
+            INSERT INTO orders (order_month, month_num, medication, quantity,
+                purchase_date, expiration_date, quantity_used, avg_daily_consumption)
+            VALUES (?, 12, ?, ?, ?, ?, ?, ?)
+            """,
+            df[["order_month", "medication", "quantity", "purchase_date",
+                "expiration_date", "quantity_used", "avg_daily_consumption"]]
+            .itertuples(index=False, name=None),
+        )
+        assert refresh_feature_store(conn) == 20
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_refresh_in_series_batches(tmp_path):
+    full_db = str(tmp_path / "full.db")
+    batched_db = str(tmp_path / "batched.db")
+    ingest_csv(CSV_PATH, db_path=full_db)
+    ingest_csv(CSV_PATH, db_path=batched_db)
+
+    conn = get_connection(batched_db)
+    try:
+        conn.execute("DELETE FROM features")
+        conn.execute(
+            "INSERT INTO feature_dirty SELECT hospital, medication, MIN(period) "
+            "FROM orders GROUP BY hospital, medication"
+        )
+        conn.commit()
+        assert refresh_feature_store(conn, max_series=3) == 3 * 12  # 12 months per series
+        conn.commit()
+        assert conn.execute("SELECT COUNT(*) FROM feature_dirty").fetchone()[0] == 20 - 3
+        ensure_feature_store(conn, max_series=3)
+        assert not is_feature_store_stale(conn)
+    finally:
+        conn.close()
+
+    pd.testing.assert_frame_equal(_features(full_db), _features(batched_db))
+
+
+def test_build_features_requires_data(tmp_path):
+    db_path = str(tmp_path / "empty.db")
+    init_db(db_path)
+    with pytest.raises(RuntimeError, match="No data"):
+        build_features(db_path=db_path)
+
+
+def test_kernel_matches_pandas_reference():
+    rng = np.random.default_rng(0)
+    lengths = [1, 2, 5, 14]  # uneven groups, some shorter than the windows
+    df = pd.DataFrame(
+        {
+            "medication": np.repeat(["a", "b", "c", "d"], lengths),
+            "quantity": rng.integers(0, 500, sum(lengths)),
+            "quantity_used": rng.integers(0, 500, sum(lengths)),
+        }
+    )
+    out = add_lag_features(df, lags=(1, 2, 12), windows=(3, 6))
+
+    g = df.groupby("medication")
+    for k in (1, 2, 12):
+        expected = g["quantity_used"].shift(k).fillna(df["quantity_used"])
+        np.testing.assert_allclose(out[f"lag_{k}_used"], expected)
+    for w in (3, 6):
+        expected = g["quantity_used"].transform(
+            lambda s: s.shift(1).rolling(w, min_periods=1).mean()
+        ).fillna(df["quantity_used"])
+        np.testing.assert_allclose(out[f"rolling_mean_{w}_used"], expected)
+
+
+def test_custom_lag_set_columns(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+
+    df = build_features(db_path=db_path, lags=(1, 2), windows=(3, 6))
+    assert get_feature_columns(df)[:8] == [
+        "month_num",
+        "lag_1_used",
+        "lag_1_ordered",
+        "lag_2_used",
+        "lag_2_ordered",
+        "rolling_mean_3_used",
+        "rolling_mean_6_used",
+        "avg_daily_consumption",
+    ]
+
+
+def test_multi_year_series_ordered_by_period(tmp_path):
+    """A second year continues each series instead of interleaving by month."""
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+
+    df = pd.read_csv(CSV_PATH)
+    purchased = pd.to_datetime(df["purchase_date"]) + pd.DateOffset(years=1)
+    df["purchase_date"] = purchased.dt.strftime("%Y-%m-%d")
+    df["quantity_used"] += 1000
+    next_year = tmp_path / "orders_2026.csv"
+    df.to_csv(next_year, index=False)
+    ingest_csv(str(next_year), db_path=db_path)
+
+    features = build_features(db_path=db_path, one_hot=False)
+    para = features[features["medication"] == "Paracetamol 500mg tablets"]
+    assert para["period"].tolist() == sorted(para["period"].tolist())
+    assert para["period"].iloc[0] == "2025-01" and para["period"].iloc[-1] == "2026-12"
+    jan_2026 = para[para["period"] == "2026-01"].iloc[0]
+    dec_2025 = para[para["period"] == "2025-12"].iloc[0]
+    assert jan_2026["lag_1_used"] == dec_2025["quantity_used"]
+
+    recent = build_features(db_path=db_path, one_hot=False, since="2026-07", until="2026-09")
+    assert sorted(recent["period"].unique()) == ["2026-07", "2026-08", "2026-09"]
+    assert len(recent) == 3 * 20
+
+
+def _store(conn) -> pd.DataFrame:
+    return pd.read_sql_query("SELECT * FROM features ORDER BY order_id", conn)
+
+
+def _full_rebuild(conn) -> pd.DataFrame:
+    conn.execute("DELETE FROM features;")
+    conn.execute("INSERT OR REPLACE INTO feature_dirty "
+                 "SELECT DISTINCT hospital, medication, '' FROM orders;")
+    refresh_feature_store(conn)
+    return _store(conn)
+
+
+def test_updates_and_deletes_mark_store_stale(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+
+    conn = get_connection(db_path)
+    try:
+        assert not is_feature_store_stale(conn)
+        # Columns features do not use leave the store alone
+        conn.execute("UPDATE orders SET expiration_date = '2099-01-01';")
+        assert not is_feature_store_stale(conn)
+
+        meds = [r[0] for r in conn.execute(
+            "SELECT DISTINCT medication FROM orders ORDER BY medication LIMIT 2")]
+        conn.execute("UPDATE orders SET quantity_used = quantity_used + 50 "
+                     "WHERE medication = ? AND month_num = 3", (meds[0],))
+        conn.execute("DELETE FROM orders WHERE medication = ? AND month_num = 5", (meds[1],))
+        conn.commit()
+        dirty = conn.execute("SELECT medication, since FROM feature_dirty "
+                             "ORDER BY medication").fetchall()
+        assert [(r[0], r[1][-2:]) for r in dirty] == [(meds[0], "03"), (meds[1], "05")]
+
+        # Only the two touched series are rewritten, from the touched month on
+        assert refresh_feature_store(conn) == 10 + 7
+        conn.commit()
+        assert not is_feature_store_stale(conn)
+        incremental = _store(conn)
+        pd.testing.assert_frame_equal(incremental, _full_rebuild(conn))
+    finally:
+        conn.close()
+
+
+def test_init_db_seeds_dirty_series_for_older_databases(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+
+    conn = get_connection(db_path)
+    try:
+        expected = _store(conn)
+        # A store last refreshed before feature_dirty existed, missing November
+        conn.execute("DROP TABLE feature_dirty;")
+        conn.execute("DELETE FROM features WHERE month_num = 11;")
+        conn.commit()
+    finally:
+        conn.close()
+
+    init_db(db_path)
+    conn = get_connection(db_path)
+    try:
+        assert is_feature_store_stale(conn)
+        refresh_feature_store(conn)
+        conn.commit()
+        pd.testing.assert_frame_equal(_store(conn), expected)
+    finally:
+        conn.close()
@@ -1,12 +1,15 @@
 """Tests for charm.ingest — CSV ingestion + idempotency."""
 
 import os
+import sqlite3
 import tempfile
 
+import pandas as pd
 import pytest
 
 from charm.db import get_connection, init_db
-from charm.ingest import ingest_csv
+from charm.ingest import _row_hash, ingest_csv
+from charm.utils import order_period
 
 CSV_PATH = os.path.join(
     os.path.dirname(__file__),
@@ -46,3 +49,156 @@ def test_ingest_idempotent(tmp_db):
     inserted2 = ingest_csv(CSV_PATH, db_path=tmp_db)
     assert inserted2 == 0
     assert _count_rows(tmp_db) == count_after_first
+
+
+def _hashes(db_path: str) -> list[str]:
+    conn = get_connection(db_path)
+    try:
+        return [r[0] for r in conn.execute("SELECT row_hash FROM orders ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_bulk_and_row_modes_match(tmp_path):
+    bulk_db = str(tmp_path / "bulk.db")
+    row_db = str(tmp_path / "row.db")
+
+    assert ingest_csv(CSV_PATH, db_path=bulk_db, mode="bulk") == 240
+    assert ingest_csv(CSV_PATH, db_path=row_db, mode="row") == 240
+    assert _hashes(bulk_db) == _hashes(row_db)
+
+    # Row-wise hashes still follow the original natural-key scheme
+    conn = get_connection(bulk_db)
+    try:
+        row = conn.execute(
+            "SELECT order_month, medication, purchase_date, row_hash FROM orders LIMIT 1"
+        ).fetchone()
+    finally:
+        conn.close()
+    assert _row_hash(row[0], row[1], row[2]) == row[3]
+
+
+def test_bulk_skips_in_file_duplicates_and_rejects_nulls(tmp_db, tmp_path):
+    df = pd.read_csv(CSV_PATH).head(5)
+    df = pd.concat([df, df.head(2)], ignore_index=True)  # 2 in-file duplicates
+    df.loc[4, "medication"] = None                        # NOT NULL violation
+    csv_path = tmp_path / "dupes.csv"
+    df.to_csv(csv_path, index=False)
+
+    assert ingest_csv(str(csv_path), db_path=tmp_db, mode="bulk") == 4
+    assert _count_rows(tmp_db) == 4
+
+
+def test_stream_resumes_after_crash(tmp_db, monkeypatch):
+    import charm.ingest as ingest_mod
+
+    real_insert = ingest_mod._insert_bulk
+    seen: list[int] = []
+
+    def flaky_insert(conn, rows):
+        if len(seen) == 3:
+            raise RuntimeError("simulated crash")
+        seen.append(len(rows))
+        return real_insert(conn, rows)
+
+    monkeypatch.setattr(ingest_mod, "_insert_bulk", flaky_insert)
+    with pytest.raises(RuntimeError, match="simulated crash"):
+        ingest_csv(CSV_PATH, db_path=tmp_db, mode="stream", chunksize=50)
+    assert _count_rows(tmp_db) == 150  # three committed chunks survive
+
+    # Resume: only the 90 uncommitted rows are inserted
+    seen.clear()
+    monkeypatch.setattr(ingest_mod, "_insert_bulk", lambda c, r: seen.append(len(r)) or real_insert(c, r))
+    assert ingest_csv(CSV_PATH, db_path=tmp_db, mode="stream", chunksize=50) == 90
+    assert sum(seen) == 90
+    assert _count_rows(tmp_db) == 240
+    assert len(set(_hashes(tmp_db))) == 240
+
+    conn = get_connection(tmp_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM ingest_checkpoints").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_stream_resume_counts_records_not_lines(tmp_path, monkeypatch):
+    """Quoted newlines and blank lines do not shift the resume point."""
+    import charm.ingest as ingest_mod
+
+    df = pd.read_csv(CSV_PATH).head(30)
+    df.loc[[2, 9, 16], "medication"] = df.loc[[2, 9, 16], "medication"] + "\nsolution"
+    lines = df.to_csv(index=False).split("\n")  # record lines, embedded newlines split too
+    csv_path = tmp_path / "multiline.csv"
+    csv_path.write_text("\n\n".join(lines[:5]) + "\n\n\n" + "\n".join(lines[5:]))
+
+    full_db, resumed_db = str(tmp_path / "full.db"), str(tmp_path / "resumed.db")
+    assert ingest_csv(str(csv_path), db_path=full_db, mode="bulk") == 30
+
+    real_insert = ingest_mod._insert_bulk
+    calls: list[int] = []
+
+    def flaky_insert(conn, rows):
+        if len(calls) == 2:
+            raise RuntimeError("simulated crash")
+        calls.append(len(rows))
+        return real_insert(conn, rows)
+
+    monkeypatch.setattr(ingest_mod, "_insert_bulk", flaky_insert)
+    with pytest.raises(RuntimeError, match="simulated crash"):
+        ingest_csv(str(csv_path), db_path=resumed_db, mode="stream", chunksize=7)
+    calls.clear()
+    monkeypatch.setattr(ingest_mod, "_insert_bulk", lambda c, r: calls.append(len(r)) or real_insert(c, r))
+    assert ingest_csv(str(csv_path), db_path=resumed_db, mode="stream", chunksize=4) == 16
+    assert sum(calls) == 16  # no committed record is re-read, none is skipped
+
+    for query in (
+        "SELECT row_hash, medication FROM orders ORDER BY row_hash",
+        "SELECT o.row_hash, f.lag_1_used, f.rolling_mean_3_used FROM features AS f "
+        "JOIN orders AS o ON o.id = f.order_id ORDER BY o.row_hash",
+    ):
+        frames = []
+        for db_path in (full_db, resumed_db):
+            conn = get_connection(db_path)
+            try:
+                frames.append(pd.read_sql_query(query, conn))
+            finally:
+                conn.close()
+        pd.testing.assert_frame_equal(*frames)
+
+
+def test_period_migration_and_trigger(tmp_path):
+    """Pre-period databases are backfilled; raw inserts get a period too."""
+    db_path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, source_file TEXT, "
+        "row_hash TEXT UNIQUE, order_month TEXT NOT NULL, month_num INTEGER NOT NULL, "
+        "medication TEXT NOT NULL, quantity INTEGER NOT NULL, purchase_date TEXT NOT NULL, "
+        "expiration_date TEXT NOT NULL, quantity_used INTEGER NOT NULL, "
+        "avg_daily_consumption REAL NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO orders (order_month, month_num, medication, quantity, purchase_date, "
+        "expiration_date, quantity_used, avg_daily_consumption) VALUES (?, ?, 'X', 1, ?, "
+        "'2030-01-01', 1, 0.1)",
+        [("March", 3, "2025-03-02"), ("January", 1, "2025-12-28"), ("December", 12, "2026-01-03")],
+    )
+    conn.commit()
+    conn.close()
+
+    init_db(db_path)
+    conn = get_connection(db_path)
+    periods = [r["period"] for r in conn.execute("SELECT period FROM orders ORDER BY id")]
+    assert periods == ["2025-03", "2026-01", "2025-12"]
+    assert periods == [
+        order_period(m, d) for m, d in ((3, "2025-03-02"), (1, "2025-12-28"), (12, "2026-01-03"))
+    ]
+    assert {r["hospital"] for r in conn.execute("SELECT hospital FROM orders")} == {"A"}
+
+    conn.execute(
+        "INSERT INTO orders (order_month, month_num, medication, quantity, purchase_date, "
+        "expiration_date, quantity_used, avg_daily_consumption) "
+        "VALUES ('May', 5, 'X', 1, '2027-05-01', '2030-01-01', 1, 0.1)"
+    )
+    assert conn.execute("SELECT period FROM orders WHERE month_num = 5").fetchone()[0] == "2027-05"
+    conn.close()
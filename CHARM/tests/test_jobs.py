@@ -0,0 +1,52 @@
+"""Tests for charm.jobs — background execution and in-flight deduplication."""
+
+import threading
+
+from charm.jobs import DONE, FAILED, JobQueue, job_key
+
+
+def test_identical_inflight_jobs_share_one_run():
+    queue = JobQueue(workers=2)
+    release = threading.Event()
+    runs = []
+
+    def slow(x):
+        runs.append(x)
+        release.wait(5)
+        return x * 2
+
+    key = job_key("slow", x=21)
+    assert key == job_key("slow", **{"x": 21})
+    first = queue.submit(key, slow, 21)
+    second = queue.submit(key, slow, 21)
+    other = queue.submit(job_key("slow", x=1), slow, 1)
+    assert second.id == first.id and other.id != first.id
+
+    release.set()
+    queue.shutdown()
+    assert runs.count(21) == 1
+    state = queue.get(first.id).to_dict()
+    assert (state["status"], state["result"]) == (DONE, 42)
+    assert queue.stats()["deduplicated"] == 1
+
+
+def test_finished_job_does_not_absorb_new_submissions():
+    queue = JobQueue(workers=1)
+    first = queue.submit("k", lambda: 1)
+    queue.submit("other", lambda: None)  # single worker: runs after "k" finishes
+    queue.shutdown()
+    assert queue.get(first.id).status == DONE
+    assert "k" not in queue._inflight
+
+
+def test_failed_job_reports_error():
+    queue = JobQueue(workers=1)
+
+    def boom():
+        raise RuntimeError("No medications found")
+
+    job = queue.submit("k", boom)
+    queue.shutdown()
+    state = queue.get(job.id).to_dict()
+    assert state["status"] == FAILED
+    assert "No medications" in state["error"]
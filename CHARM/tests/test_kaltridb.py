@@ -0,0 +1,205 @@
+"""Tests for KaltriDB — inventory indexes, usage-log buffer, stock mutations (mongomock)."""
+
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import KaltriDB
+
+
+@pytest.fixture
+def kaltri(mongo, monkeypatch):
+    monkeypatch.setattr(KaltriDB, "_indexed_inventories", set())
+    # Log entries stay pending until a test flushes them
+    buffer = KaltriDB.UsageLogBuffer(KaltriDB.usage_collection,
+                                     rollups=KaltriDB.rollup_collection, flush_interval=None)
+    monkeypatch.setattr(KaltriDB, "_usage_buffer", buffer)
+    return KaltriDB
+
+
+def test_inventory_collection_creates_indexes(kaltri, mongo):
+    collection = kaltri.inventory_collection("A")
+    assert collection.name == "inventory_a"
+    indexes = mongo["hospital_inventory"]["inventory_a"].index_information()
+    assert {"expiry_date", "quantity"} <= set(indexes)
+    # Indexed once per process, then served from the cache
+    assert kaltri.inventory_collection("A").name == "inventory_a"
+    assert kaltri._indexed_inventories == {"inventory_a"}
+
+
+# ── Usage log buffer ─────────────────────────────────────────────────
+
+def _entry(medication, change, action, day=5):
+    return {"hospital": "A", "medication": medication, "quantity_change": change,
+            "action": action, "user": "u", "date": datetime(2025, 1, day)}
+
+
+def _rollups(collection):
+    return {d["medication"]: {k: d[k] for k in ("purchased", "used", "entries") if k in d}
+            for d in collection.find()}
+
+
+class _Flaky:
+    """Collection wrapper whose first write fails the way the server reports it."""
+
+    def __init__(self, collection, error):
+        self._collection = collection
+        self._error = error
+
+    def insert_many(self, documents, ordered=True):
+        if self._error is None:
+            return self._collection.insert_many(documents, ordered=ordered)
+        error, self._error = self._error, None
+        failed = {e["index"] for e in error.details["writeErrors"] if e["code"] != 11000}
+        self._collection.insert_many([d for i, d in enumerate(documents) if i not in failed])
+        raise error
+
+    def bulk_write(self, requests, ordered=True):
+        if self._error is None:
+            return self._collection.bulk_write(requests, ordered=ordered)
+        error, self._error = self._error, None
+        raise error
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def test_usage_buffer_flushes_on_size(mongo):
+    logs, rollups = mongo.test.logs, mongo.test.rollups
+    buffer = KaltriDB.UsageLogBuffer(logs, rollups=rollups, max_batch=3, flush_interval=None)
+    buffer.add(_entry("X", 10, "added"))
+    buffer.add(_entry("X", -4, "usage"))
+    assert logs.count_documents({}) == 0
+    buffer.add(_entry("Y", -2, "removed"))
+    assert logs.count_documents({}) == 3
+    assert _rollups(rollups) == {
+        "X": {"purchased": 10, "used": 4, "entries": 2},
+        "Y": {"used": 2, "entries": 1},
+    }
+
+
+def test_usage_buffer_flushes_on_interval_and_close(mongo):
+    logs = mongo.test.logs
+    buffer = KaltriDB.UsageLogBuffer(logs, max_batch=100, flush_interval=0.02)
+    buffer.add(_entry("X", 1, "added"))
+    deadline = time.monotonic() + 5
+    while logs.count_documents({}) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert logs.count_documents({}) == 1
+
+    buffer.flush_interval = 60  # next entry only leaves on close()
+    buffer.add(_entry("X", 1, "added"))
+    time.sleep(0.05)
+    buffer.close()
+    assert logs.count_documents({}) == 2
+    assert not buffer._thread.is_alive()
+
+
+def test_usage_buffer_requeues_failed_inserts(mongo):
+    # Entry 0 was already stored (duplicate _id), entry 1 failed validation.
+    error = BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "dup"},
+                                            {"index": 1, "code": 121, "errmsg": "invalid"}]})
+    logs, rollups = _Flaky(mongo.test.logs, error), mongo.test.rollups
+    buffer = KaltriDB.UsageLogBuffer(logs, rollups=rollups, max_batch=100, flush_interval=None)
+    for change in (5, 6, 7):
+        buffer.add(_entry("X", change, "restock"))
+
+    assert buffer.flush() == 2
+    assert [e["quantity_change"] for e in buffer._pending] == [6]
+    assert _rollups(rollups) == {"X": {"purchased": 12, "entries": 2}}
+
+    assert buffer.flush() == 1
+    assert sorted(d["quantity_change"] for d in mongo.test.logs.find()) == [5, 6, 7]
+    assert _rollups(rollups) == {"X": {"purchased": 18, "entries": 3}}
+
+
+def test_usage_buffer_retries_failed_rollups(mongo, caplog):
+    logs, rollups = mongo.test.logs, _Flaky(mongo.test.rollups, AutoReconnect("down"))
+    buffer = KaltriDB.UsageLogBuffer(logs, rollups=rollups, max_batch=100, flush_interval=None)
+    buffer.add(_entry("X", 3, "added"))
+    buffer.add(_entry("X", -1, "usage", day=20))
+
+    assert buffer.flush() == 2  # logs stored, rollups kept for retry
+    assert mongo.test.rollups.count_documents({}) == 0
+    assert buffer.dirty_rollups == {("A", "2025-01")}
+    assert "backfill_rollups.py" in caplog.text
+
+    assert buffer.flush() == 0
+    assert _rollups(mongo.test.rollups) == {"X": {"purchased": 3, "used": 1, "entries": 2}}
+
+
+def test_log_usage_rollups_match_logs(kaltri):
+    kaltri.add_item("A", "Med", 50, 1.0, "2025-01-05", "2030-01-01")
+    item_id = kaltri.get_inventory("A")[0]["_id"]
+    kaltri.update_quantity("A", item_id, 40, "u")
+    kaltri.update_quantity("A", item_id, 45, "u")
+    kaltri._usage_buffer.flush()
+
+    month = datetime.now().strftime("%Y-%m")
+    assert kaltri.get_rollup_months() == [month]
+    assert _rollups(kaltri.rollup_collection) == {
+        "Med": {"purchased": 55, "used": 10, "entries": 3},
+    }
+
+
+# ── Stock mutations ──────────────────────────────────────────────────
+
+def _stock(kaltri, quantity=50):
+    kaltri.add_item("A", "Med", quantity, 1.0, "2025-01-05", "2030-01-01")
+    return kaltri.get_inventory("A")[0]["_id"]
+
+
+def _logged(kaltri):
+    kaltri._usage_buffer.flush()
+    return [(e["action"], e["quantity_change"], e["user"])
+            for e in kaltri.usage_collection.find({}, sort=[("_id", 1)])]
+
+
+def test_consume_rejects_insufficient_stock(kaltri):
+    item_id = _stock(kaltri, 10)
+    assert kaltri.consume("A", item_id, 11, "nurse") is None
+    assert kaltri.consume("A", item_id, 10, "nurse") == 0
+    assert kaltri.consume("A", item_id, 1, "nurse") is None
+    assert kaltri.get_inventory("A")[0]["quantity"] == 0
+    assert _logged(kaltri) == [("added", 10, "System"), ("usage", -10, "nurse")]
+    with pytest.raises(ValueError):
+        kaltri.consume("A", item_id, 0, "nurse")
+
+
+def test_concurrent_consume_never_goes_negative(kaltri):
+    item_id = _stock(kaltri, 50)
+    start = threading.Barrier(8)
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(kaltri.consume("A", item_id, 10, "nurse"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(r for r in results if r is not None) == [0, 10, 20, 30, 40]
+    assert results.count(None) == 3
+    assert kaltri.get_inventory("A")[0]["quantity"] == 0
+    assert _logged(kaltri).count(("usage", -10, "nurse")) == 5
+
+
+def test_update_quantity_logs_exact_diff(kaltri):
+    item_id = _stock(kaltri, 50)
+    assert kaltri.update_quantity("A", item_id, 35, "pharm")
+    assert not kaltri.update_quantity("A", item_id, 35, "pharm")  # no change, nothing logged
+    assert kaltri.update_quantity("A", item_id, 40, "pharm")
+    assert kaltri.delete_item("A", item_id, "pharm")
+    assert not kaltri.delete_item("A", item_id, "pharm")
+    assert _logged(kaltri) == [
+        ("added", 50, "System"),
+        ("usage", -15, "pharm"),
+        ("restock", 5, "pharm"),
+        ("removed", -40, "pharm"),
+    ]
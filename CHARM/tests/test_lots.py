@@ -0,0 +1,170 @@
+"""Tests for charm.lots — FEFO consumption, projected waste, order adjustment."""
+
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from charm.copilot import recommend_orders
+from charm.db import get_connection, init_db
+from charm.ingest import ingest_csv
+from charm.lots import (
+    fefo_kernel,
+    fetch_lots,
+    load_lots,
+    project_waste,
+    sync_lots_from_inventory,
+)
+from charm.train import train_model
+from charm.utils import month_name_to_num, next_month_start
+
+CSV_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "data",
+    "nene_tereza_synthetic_orders_2025_with_consumption.csv",
+)
+
+
+def test_fefo_kernel_expires_before_use():
+    # 100 units expiring on day 10 and 100 on day 60; 60/month over 30-day months.
+    consumed, wasted, shortfall = fefo_kernel(
+        series=np.array([0, 0]),
+        expiry_day=np.array([10, 60]),
+        quantity=np.array([100, 100]),
+        demand=np.array([[60.0, 60.0]]),
+        month_start=np.array([0, 30]),
+        month_days=np.array([30, 30]),
+    )
+    # First lot covers days 0–9 only (20 units), the second the remaining 100.
+    np.testing.assert_allclose(consumed, [20, 100])
+    np.testing.assert_allclose(wasted, [80, 0])
+    np.testing.assert_allclose(shortfall, [0])
+
+
+def test_project_waste_matches_per_series_loop():
+    """Vectorised projection equals a plain per-lot FEFO loop."""
+    rng = np.random.default_rng(0)
+    start = date(2026, 1, 1)
+    n_meds, n_lots = 30, 200
+    lots = pd.DataFrame(
+        {
+            "hospital": "A",
+            "medication": rng.integers(0, n_meds, n_lots).astype(str),
+            "quantity": rng.integers(1, 200, n_lots),
+            "expiration_date": [
+                (start + timedelta(days=int(d))).isoformat()
+                for d in rng.integers(-10, 200, n_lots)
+            ],
+        }
+    )
+    demand = pd.DataFrame(
+        rng.uniform(0, 150, (n_meds, 6)),
+        index=pd.MultiIndex.from_product([["A"], np.arange(n_meds).astype(str)],
+                                         names=["hospital", "medication"]),
+    )
+    result = project_waste(lots, demand, start)
+
+    months = pd.date_range(start, periods=7, freq="MS")
+    for (hosp, med), row in result.iterrows():
+        mine = lots[lots["medication"] == med].sort_values("expiration_date", kind="stable")
+        qty = mine["quantity"].astype(float).tolist()
+        exp = [pd.Timestamp(e) for e in mine["expiration_date"]]
+        waste = 0.0
+        for m in range(6):
+            m_start, m_end = months[m], months[m + 1]
+            days = (m_end - m_start).days
+            rate = demand.loc[(hosp, med), m] / days
+            # Day-by-day FEFO reference.
+            for d in range(days):
+                today = m_start + timedelta(days=d)
+                need = rate
+                for i in range(len(qty)):
+                    if exp[i] > today and qty[i] > 0 and need > 0:
+                        used = min(qty[i], need)
+                        qty[i] -= used
+                        need -= used
+            for i in range(len(qty)):
+                if exp[i] < m_end and qty[i] > 0:
+                    waste += qty[i]
+                    qty[i] = 0.0
+        assert abs(row["projected_waste"] - waste) < 1e-6 * max(1.0, waste) + 1e-6
+
+
+def test_recommend_orders_counts_projected_waste(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    model_dir = str(tmp_path / "models")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+    train_model(model_dir=model_dir, db_path=db_path)
+
+    baseline = {
+        r["medication"]: r
+        for r in recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    }
+    assert all(r["projected_waste"] == 0 for r in baseline.values())
+
+    start = next_month_start(month_name_to_num("April"))
+    load_lots(
+        pd.DataFrame(
+            {
+                "medication": ["Paracetamol 500mg tablets", "Paracetamol 500mg tablets"],
+                "quantity": [500, 300],
+                # Expires before April even starts: all 500 are waste.
+                "expiration_date": [start - timedelta(days=1), start + timedelta(days=400)],
+            }
+        ),
+        db_path=db_path,
+    )
+    conn = get_connection(db_path)
+    assert len(fetch_lots(conn, "A")) == 2
+    conn.close()
+
+    recs = {
+        r["medication"]: r
+        for r in recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    }
+    para = recs["Paracetamol 500mg tablets"]
+    assert para["current_stock"] == 800
+    assert para["projected_waste"] == 500
+    assert any(w.startswith("projected_waste") for w in para["warnings"])
+    # Only the 300 usable units offset the order.
+    assert para["recommended_order"] == max(
+        0, baseline["Paracetamol 500mg tablets"]["recommended_order"] - 300
+    )
+    # Medications without lots keep their stock-free recommendation.
+    assert recs["Insulin glargine"]["recommended_order"] == (
+        baseline["Insulin glargine"]["recommended_order"]
+    )
+
+
+def test_sync_lots_from_inventory(tmp_path, mongo):
+    db_path = str(tmp_path / "charm.db")
+    inventory = mongo["hospital_inventory"]
+    inventory["inventory_a"].insert_many([
+        {"name": "Amoxicillin", "quantity": 40, "cost": 1.0,
+         "date_added": datetime(2025, 1, 5), "expiry_date": datetime(2026, 3, 1)},
+        # Stored before dates were BSON dates
+        {"name": "Paracetamol", "quantity": 10, "cost": 0.5,
+         "date_added": "2025-01-05", "expiry_date": "2027-01-05"},
+    ])
+    inventory["inventory_b"].insert_one(
+        {"name": "Ceftriaxone", "quantity": 5, "expiry_date": datetime(2025, 12, 1)})
+    inventory.create_collection("inventory_c")
+    load_lots(pd.DataFrame({"hospital": ["A", "C"], "medication": ["Stale", "Gone"],
+                            "quantity": [1, 2], "expiration_date": ["2030-01-01"] * 2}),
+              db_path)
+
+    assert sync_lots_from_inventory(db_path) == 3
+    conn = get_connection(db_path)
+    try:
+        lots = fetch_lots(conn)
+    finally:
+        conn.close()
+    rows = lots[["hospital", "medication", "quantity", "expiration_date"]]
+    assert rows.values.tolist() == [
+        ["A", "Amoxicillin", 40, "2026-03-01"],
+        ["A", "Paracetamol", 10, "2027-01-05"],
+        ["B", "Ceftriaxone", 5, "2025-12-01"],
+    ]
@@ -0,0 +1,98 @@
+"""Tests for charm.rebalance — surplus/deficit matching across hospitals."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from charm.db import init_db
+from charm.ingest import ingest_csv
+from charm.rebalance import plan_transfers, rebalance, surplus_deficit
+from charm.train import train_model
+
+CSV_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "data",
+    "nene_tereza_synthetic_orders_2025_with_consumption.csv",
+)
+
+
+@pytest.fixture()
+def positions():
+    return pd.DataFrame(
+        {
+            "hospital": ["A", "B", "C", "D"],
+            "medication": "X",
+            "stock": [100, 0, 50, 0],
+            "demand": [10, 50, 10, 30],
+            "days_left": [200, np.nan, 10, np.nan],
+        }
+    )
+
+
+@pytest.mark.parametrize("method", ["lp", "greedy"])
+def test_soonest_expiring_surplus_moves_first(positions, method):
+    plan = plan_transfers(positions, method=method, safety_buffer=0.0)
+    moved = plan.set_index(["source", "target"])["units"]
+    # C's 40 surplus units expire in 10 days: all of them go out.
+    assert plan.loc[plan["source"] == "C", "units"].sum() == 40
+    assert plan.groupby("target")["units"].sum().to_dict() == {"B": 50, "D": 30}
+    assert moved.sum() == 80
+
+
+def test_lp_respects_transfer_costs(positions):
+    costs = pd.DataFrame({"source": ["A"], "target": ["B"], "cost": [0.1]})
+    plan = plan_transfers(
+        positions, method="lp", safety_buffer=0.0, transfer_costs=costs, expiry_weight=0.0
+    )
+    moved = plan.set_index(["source", "target"])["units"]
+    assert moved[("A", "B")] == 50  # cheapest lane is used to the full deficit
+
+
+def test_solvers_stay_within_supply_and_demand():
+    rng = np.random.default_rng(1)
+    n_h, n_m = 25, 40
+    pos = pd.DataFrame(
+        {
+            "hospital": np.repeat([f"H{i}" for i in range(n_h)], n_m),
+            "medication": np.tile([f"M{j}" for j in range(n_m)], n_h),
+            "stock": rng.integers(0, 200, n_h * n_m),
+            "demand": rng.uniform(0, 150, n_h * n_m),
+            "days_left": rng.uniform(0, 300, n_h * n_m),
+        }
+    )
+    supply, demand = surplus_deficit(pos)
+    key = pos.set_index(["hospital", "medication"]).index
+    for method in ("lp", "greedy"):
+        plan = plan_transfers(pos, method=method)
+        out = plan.groupby(["source", "medication"])["units"].sum()
+        into = plan.groupby(["target", "medication"])["units"].sum()
+        assert (out <= pd.Series(supply, index=key).reindex(out.index)).all()
+        assert (into <= pd.Series(demand, index=key).reindex(into.index)).all()
+        # Both cover as much as the network can: min(supply, demand) per medication.
+        cover = np.minimum(
+            pd.Series(supply).groupby(pos["medication"]).sum(),
+            pd.Series(demand).groupby(pos["medication"]).sum(),
+        )
+        assert plan.groupby("medication")["units"].sum().sum() == cover.sum()
+
+
+def test_rebalance_end_to_end(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    model_dir = str(tmp_path / "models")
+    init_db(db_path)
+    ingest_csv(CSV_PATH, db_path=db_path)
+    ingest_csv(CSV_PATH, db_path=db_path, hospital="B")
+    train_model(model_dir=model_dir, db_path=db_path)
+
+    plan = rebalance(
+        "April",
+        current_stock={"A": {"Insulin glargine": 5000}, "B": {}},
+        model_dir=model_dir,
+        db_path=db_path,
+    )
+    assert not plan.empty
+    assert set(plan["source"]) == {"A"} and set(plan["target"]) == {"B"}
+    assert plan["medication"].tolist() == ["Insulin glargine"]
@@ -0,0 +1,62 @@
+"""Tests for charm.storage — per-thread SQLite reuse and lazy Mongo handles."""
+
+import os
+import threading
+
+from charm.db import get_connection, init_db
+from charm.storage import close_sqlite, lazy_collection
+
+
+def test_sqlite_connection_reused_per_thread(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+
+    conn = get_connection(db_path)
+    conn.execute("INSERT INTO lots (hospital, medication, quantity, expiration_date) "
+                 "VALUES ('A', 'X', 1, '2030-01-01')")
+    conn.close()  # uncommitted work is rolled back, connection stays usable
+    again = get_connection(db_path)
+    assert again is conn
+    assert again.execute("SELECT COUNT(*) FROM lots").fetchone()[0] == 0
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(get_connection(db_path)))
+    t.start()
+    t.join()
+    assert other[0] is not conn
+
+    # A replaced database file gets a fresh connection.
+    os.remove(db_path)
+    init_db(db_path)
+    assert get_connection(db_path) is not conn
+    close_sqlite()
+
+
+def test_nested_close_keeps_callers_transaction(tmp_path):
+    db_path = str(tmp_path / "charm.db")
+    init_db(db_path)
+    insert = ("INSERT INTO lots (hospital, medication, quantity, expiration_date) "
+              "VALUES ('A', ?, 1, '2030-01-01')")
+
+    outer = get_connection(db_path)
+    outer.execute(insert, ("X",))
+    inner = get_connection(db_path)  # e.g. a helper called mid-transaction
+    assert inner is outer
+    inner.execute(insert, ("Y",))
+    inner.close()
+    assert outer.in_transaction
+    outer.commit()
+    assert outer.execute("SELECT COUNT(*) FROM lots").fetchone()[0] == 2
+
+    outer.execute(insert, ("Z",))
+    outer.close()  # the outermost close still rolls back
+    conn = get_connection(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM lots").fetchone()[0] == 2
+    conn.close()
+    close_sqlite()
+
+
+def test_lazy_collection_does_not_connect():
+    requests = lazy_collection("requests")
+    assert requests.name == "requests"
+    assert requests.database.name == "hospital_inventory"
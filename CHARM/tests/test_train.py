@@ -1,12 +1,17 @@
 """Tests for charm.train — model artifact creation."""
 
+import json
 import os
 
+import joblib
+import pandas as pd
 import pytest
 
-from charm.db import init_db
+from charm.copilot import recommend_orders
+from charm.db import get_connection, init_db
 from charm.ingest import ingest_csv
-from charm.train import train_model
+from charm.registry import get_registry
+from charm.train import train_model, train_partitioned
 
 CSV_PATH = os.path.join(
     os.path.dirname(__file__),
@@ -33,3 +38,136 @@ def test_train_creates_artifacts(ready_db):
 
     assert os.path.isfile(os.path.join(model_dir, "model.joblib"))
     assert os.path.isfile(os.path.join(model_dir, "columns.joblib"))
+
+
+@pytest.mark.parametrize("encoding", ["sparse", "ordinal"])
+def test_train_records_encoding(ready_db, encoding):
+    db_path, tmp_path = ready_db
+    model_dir = str(tmp_path / f"models_{encoding}")
+
+    train_model(model_dir=model_dir, db_path=db_path, encoding=encoding)
+
+    with open(os.path.join(model_dir, "model_meta.json")) as f:
+        meta = json.load(f)
+    assert meta["encoding"] == encoding
+    columns = joblib.load(os.path.join(model_dir, "columns.joblib"))
+    if encoding == "ordinal":
+        assert columns[-1] == "medication_code"
+        assert len(meta["categories"]) == 20
+    else:
+        assert sum(c.startswith("med_") for c in columns) == 20
+
+    # Inference picks the matching encoder from the artifacts
+    recs = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    assert len(recs) == 20
+    assert all(r["predicted_demand"] > 0 for r in recs)
+
+
+@pytest.mark.parametrize("encoding", ["onehot", "ordinal"])
+def test_train_hgb_backend(ready_db, encoding):
+    db_path, tmp_path = ready_db
+    model_dir = str(tmp_path / f"models_hgb_{encoding}")
+
+    train_model(model_dir=model_dir, db_path=db_path, encoding=encoding, backend="hgb")
+
+    with open(os.path.join(model_dir, "model_meta.json")) as f:
+        assert json.load(f)["backend"] == "hgb"
+    model = joblib.load(os.path.join(model_dir, "model.joblib"))
+    assert type(model).__name__ == "HistGradientBoostingRegressor"
+
+    recs = recommend_orders("April", {}, model_dir=model_dir, db_path=db_path)
+    assert len(recs) == 20
+
+
+def test_hgb_rejects_sparse(ready_db):
+    db_path, tmp_path = ready_db
+    with pytest.raises(ValueError, match="sparse"):
+        train_model(
+            model_dir=str(tmp_path / "m"), db_path=db_path, encoding="sparse", backend="hgb"
+        )
+
+
+@pytest.fixture()
+def two_hospital_db(ready_db):
+    """ready_db plus the same export ingested as hospital B with doubled usage."""
+    db_path, tmp_path = ready_db
+    df = pd.read_csv(CSV_PATH)
+    df["quantity"] *= 2
+    df["quantity_used"] *= 2
+    df["hospital"] = "B"
+    csv_b = tmp_path / "hospital_b.csv"
+    df.to_csv(csv_b, index=False)
+    ingest_csv(str(csv_b), db_path=db_path)
+    return db_path, tmp_path
+
+
+def test_partitioned_by_hospital(two_hospital_db):
+    db_path, tmp_path = two_hospital_db
+    model_dir = tmp_path / "models_part"
+
+    train_partitioned("hospital", model_dir=str(model_dir), db_path=db_path, workers=2)
+
+    with open(model_dir / "manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["by"] == "hospital"
+    assert set(manifest["partitions"]) == {"A", "B"}
+    for entry in manifest["partitions"].values():
+        assert entry["rows"] == 240
+        assert (model_dir / entry["path"] / "model.joblib").is_file()
+
+    # Each hospital is scored by its own model
+    get_registry().clear()
+    recs_a = recommend_orders("April", {}, model_dir=str(model_dir), db_path=db_path)
+    recs_b = recommend_orders(
+        "April", {}, model_dir=str(model_dir), db_path=db_path, hospital="b"
+    )
+    assert len(recs_a) == len(recs_b) == 20
+    loaded = get_registry().stats()["models"]
+    assert {os.path.basename(k) for k in loaded} == {"hospital=A", "hospital=B"}
+    total_a = sum(r["predicted_demand"] for r in recs_a)
+    total_b = sum(r["predicted_demand"] for r in recs_b)
+    assert total_b > 1.5 * total_a
+
+    # Nothing changed: no retraining; refreshing B's data retrains only B
+    a_model = model_dir / manifest["partitions"]["A"]["path"] / "model.joblib"
+    a_mtime = a_model.stat().st_mtime_ns
+    train_partitioned(
+        "hospital", model_dir=str(model_dir), db_path=db_path, changed_only=True
+    )
+    with open(model_dir / "manifest.json") as f:
+        assert json.load(f) == manifest
+
+    conn = get_connection(db_path)
+    conn.execute(
+        "INSERT INTO orders (hospital, order_month, month_num, medication, quantity, "
+        "purchase_date, expiration_date, quantity_used, avg_daily_consumption) "
+        "VALUES ('B', 'January', 1, 'Paracetamol 500mg tablets', 10, "
+        "'2026-01-05', '2027-01-05', 10, 0.3)"
+    )
+    conn.commit()
+    conn.close()
+    train_partitioned(
+        "hospital", model_dir=str(model_dir), db_path=db_path, changed_only=True
+    )
+    with open(model_dir / "manifest.json") as f:
+        updated = json.load(f)["partitions"]
+    assert updated["A"] == manifest["partitions"]["A"]
+    assert updated["B"]["rows"] == 241
+    assert a_model.stat().st_mtime_ns == a_mtime
+
+
+def test_partitioned_by_cluster(ready_db):
+    db_path, tmp_path = ready_db
+    model_dir = tmp_path / "models_cluster"
+
+    train_partitioned("cluster", model_dir=str(model_dir), db_path=db_path, n_clusters=3)
+
+    with open(model_dir / "manifest.json") as f:
+        partitions = json.load(f)["partitions"]
+    assert len(partitions) == 3
+    meds = [m for entry in partitions.values() for m in entry["medications"]]
+    assert len(meds) == len(set(meds)) == 20
+
+    recs = recommend_orders("April", {}, model_dir=str(model_dir), db_path=db_path)
+    assert len(recs) == 20
+    assert all(r["predicted_demand"] >= 0 for r in recs)
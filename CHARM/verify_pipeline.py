@@ -35,8 +35,8 @@ try:
     log(f"  ✅ Second run inserted: {inserted2} rows (should be 0)")
 
     # Step 2c: Row count
-    import sqlite3
-    conn = sqlite3.connect("charm.db")
+    from charm.db import get_connection
+    conn = get_connection()
     count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
     meds = conn.execute("SELECT COUNT(DISTINCT medication) FROM orders").fetchone()[0]
     conn.close()